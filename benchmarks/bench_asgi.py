@@ -0,0 +1,125 @@
+"""Throughput de GET /api/payments/<id>/status/ sob WSGI (views síncronas)
+e sob ASGI (views async), com o gateway stub respondendo com latência fixa.
+
+    python -m benchmarks.bench_asgi --requests 1000 --concurrency 200 --latency 0.3
+
+Stub, servidor e gerador de carga rodam em processos separados para não
+disputarem o GIL. Com o gateway lento, o WSGI fica limitado a
+threads / latência; o ASGI só fica limitado pela CPU do próprio Django.
+Requer aiohttp e uvicorn.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import BASE_DIR, free_port, report, setup_django, summarize, wait_for_port
+
+
+def spawn(*args):
+    return subprocess.Popen([sys.executable, '-m', *args], cwd=BASE_DIR, stdout=subprocess.DEVNULL)
+
+
+def prepare_database(path, count):
+    """Cria o schema e pagamentos com id no gateway em um SQLite descartável"""
+    from django.core.management import call_command
+    from django.db import connection
+
+    from payments.models import Payment
+
+    call_command('migrate', verbosity=0)
+    payment_ids = [
+        str(Payment.objects.create(
+            amount='10.00', description='Bench', payer_email='bench@example.com',
+            payment_gateway_id=f"ORDE_BENCH_{i}",
+        ).id)
+        for i in range(count)
+    ]
+    connection.close()
+    return payment_ids
+
+
+async def drive(base_url, payment_ids, total, concurrency):
+    import aiohttp
+
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(base_url=base_url, connector=connector) as client:
+        async def one(i):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                async with client.get(f"/api/payments/{payment_ids[i % len(payment_ids)]}/status/") as response:
+                    await response.read()
+                latencies.append(time.perf_counter() - started)
+                if response.status != 200:
+                    errors += 1
+
+        # aquece conexões e o pool do servidor antes de medir
+        await asyncio.gather(*(one(i) for i in range(min(concurrency, total))))
+        latencies.clear()
+        errors = 0
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        'throughput_rps': round(total / elapsed, 1),
+        'errors': errors,
+        **summarize(latencies),
+    }
+
+
+def run(mode, database, gateway_url, payment_ids, args):
+    port = free_port()
+    server = spawn(
+        'benchmarks.serve', '--mode', mode, '--port', str(port), '--database', database,
+        '--gateway-url', gateway_url, '--threads', str(args.wsgi_threads),
+    )
+    try:
+        wait_for_port(port)
+        return asyncio.run(drive(f"http://127.0.0.1:{port}", payment_ids, args.requests, args.concurrency))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.3, help='latência do stub (s)')
+    parser.add_argument('--wsgi-threads', type=int, default=8)
+    args = parser.parse_args()
+
+    fd, database = tempfile.mkstemp(suffix='.sqlite3')
+    os.close(fd)
+    setup_django(database=database)
+    payment_ids = prepare_database(database, 100)
+
+    gateway_port = free_port()
+    gateway = spawn('benchmarks.stub_gateway', '--port', str(gateway_port), '--latency', str(args.latency))
+    try:
+        wait_for_port(gateway_port)
+        gateway_url = f"http://127.0.0.1:{gateway_port}"
+
+        results = run('wsgi', database, gateway_url, payment_ids, args)
+        report(f'status_wsgi_{args.wsgi_threads}_threads', results)
+
+        results = run('asgi', database, gateway_url, payment_ids, args)
+        report('status_asgi', results)
+    finally:
+        gateway.terminate()
+        gateway.wait()
+        os.unlink(database)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Pagamentos/s criados por POST /api/payments/bulk/ em lotes de 10/100/1000
+x o mesmo número de POST /api/payments/ sequenciais.
+
+    python -m benchmarks.bench_bulk --latency 0.02 --batch-sizes 10,100,1000
+
+O stub do PagBank responde com latência fixa; o bulk cria as ordens com
+PAGBANK_BULK_CONCURRENCY chamadas simultâneas.
+"""
+import argparse
+import time
+
+from benchmarks.common import payment_payload, report, setup_django, test_database
+from benchmarks.stub_gateway import StubGateway
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--latency', type=float, default=0.02, help='latência do stub (s)')
+    parser.add_argument('--batch-sizes', default='10,100,1000')
+    parser.add_argument('--items', type=int, default=3, help='itens por pagamento')
+    parser.add_argument('--concurrency', type=int, default=None, help='PAGBANK_BULK_CONCURRENCY')
+    args = parser.parse_args()
+
+    settings = setup_django()
+    if args.concurrency:
+        settings.PAGBANK_BULK_CONCURRENCY = args.concurrency
+
+    from rest_framework.test import APIRequestFactory
+
+    from payments.views import PaymentBulkCreateView, PaymentListCreateView
+
+    factory = APIRequestFactory()
+    single_view = PaymentListCreateView.as_view()
+    bulk_view = PaymentBulkCreateView.as_view()
+    payload = payment_payload(items=args.items)
+
+    with test_database(), StubGateway(latency=args.latency) as gateway:
+        settings.PAGBANK_API_URL = gateway.url
+        # aquece pool de conexões e caches
+        bulk_view(factory.post('/api/payments/bulk/', {'payments': [payload] * 10}, format='json'))
+
+        for size in (int(value) for value in args.batch_sizes.split(',')):
+            started = time.perf_counter()
+            for _ in range(size):
+                response = single_view(factory.post('/api/payments/', payload, format='json'))
+                assert response.status_code == 201, response.data
+            single_elapsed = time.perf_counter() - started
+
+            started = time.perf_counter()
+            response = bulk_view(factory.post('/api/payments/bulk/', {'payments': [payload] * size}, format='json'))
+            bulk_elapsed = time.perf_counter() - started
+            assert response.status_code == 201, response.data
+
+            report(f'bulk_{size}', {
+                'single_payments_per_s': round(size / single_elapsed, 1),
+                'bulk_payments_per_s': round(size / bulk_elapsed, 1),
+                'bulk_request_ms': round(bulk_elapsed * 1000, 1),
+            })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Escritas no banco por checkout em POST /api/payments/, com o PagBank
+recusando (falha) ou aceitando (sucesso) a ordem: fluxo anterior (cria,
+chama o gateway e apaga em caso de falha) x pending_gateway.
+
+    python -m benchmarks.bench_checkout_writes --checkouts 200 --items 3
+
+`writes` conta linhas gravadas (inclusive apagadas); `write_statements`,
+os INSERT/UPDATE/DELETE executados. Valores por checkout.
+"""
+import argparse
+
+from benchmarks.common import count_queries, payment_payload, report, setup_django, test_database
+from benchmarks.stub_gateway import StubGateway
+
+
+def legacy_create(service, data):
+    """PaymentListCreateView.post anterior: apaga pagamento e itens se o checkout falhar"""
+    from payments.models import Payment
+
+    payment = Payment.objects.create_with_items(
+        data['items'], amount=data['amount'], description=data['description'], payer_email=data['payer_email']
+    )
+    result = service.create_checkout_session({
+        'items': data['items'],
+        'payer_email': data['payer_email'],
+        'payer_name': 'Cliente',
+        'external_reference': str(payment.id)
+    })
+    if result['success']:
+        payment.preference_id = result.get('checkout_code', '')
+        payment.save()
+    else:
+        payment.delete()
+
+
+def run(checkouts, create):
+    counter = {'reads': 0, 'write_statements': 0, 'writes': 0}
+    with count_queries(counter):
+        for _ in range(checkouts):
+            create()
+    return {key: round(value / checkouts, 2) for key, value in counter.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--checkouts', type=int, default=200)
+    parser.add_argument('--items', type=int, default=3, help='itens por pagamento')
+    args = parser.parse_args()
+
+    settings = setup_django()
+
+    from rest_framework.test import APIRequestFactory
+
+    from payments.models import Payment
+    from payments.serializers import CreatePaymentSerializer
+    from payments.services import PagSeguroService
+    from payments.views import PaymentListCreateView
+
+    factory = APIRequestFactory()
+    view = PaymentListCreateView.as_view()
+    payload = payment_payload(items=args.items)
+    serializer = CreatePaymentSerializer(data=payload)
+    serializer.is_valid(raise_exception=True)
+    data = serializer.validated_data
+
+    # 400 não é repetido pelo retry: uma chamada ao gateway por checkout
+    with test_database(), StubGateway(error_status=400) as gateway:
+        settings.PAGBANK_API_URL = gateway.url
+        service = PagSeguroService()
+
+        for outcome, error_rate in (('failed', 1.0), ('succeeded', 0.0)):
+            gateway.error_rate = error_rate
+
+            before = run(args.checkouts, lambda: legacy_create(service, data))
+            report(f'checkout_{outcome}_legacy', before)
+
+            after = run(args.checkouts, lambda: view(factory.post('/api/payments/', payload, format='json')))
+            report(f'checkout_{outcome}_pending_gateway', {
+                **after,
+                'writes_saved_pct': round(100 * (before['writes'] - after['writes']) / before['writes'], 1),
+                'gateway_failed_rows': Payment.objects.filter(status='gateway_failed').count(),
+            })
+
+
+if __name__ == '__main__':
+    main()
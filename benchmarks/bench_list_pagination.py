@@ -0,0 +1,95 @@
+"""Latência por página de GET /api/payments/ em profundidades crescentes:
+paginação por cursor (keyset) x LIMIT/OFFSET.
+
+    python -m benchmarks.bench_list_pagination --rows 100000 --fields id,status
+
+O baseline OFFSET usa LimitOffsetPagination do DRF com o mesmo filtro e a
+mesma projeção; cada medida é a mediana de --repeat requisições.
+`list_projection` compara a primeira página com todos os campos e só com --fields.
+"""
+import argparse
+import statistics
+import time
+
+from benchmarks.common import report, setup_django, test_database
+
+
+def timed(view, factory, url, repeat):
+    latencies = []
+    for _ in range(repeat):
+        request = factory.get(url)
+        started = time.perf_counter()
+        response = view(request)
+        latencies.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.data
+    return round(statistics.median(latencies) * 1000, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--depths', default='0,1000,10000,50000,90000')
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--fields', default='id,status')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    setup_django()
+
+    from rest_framework.pagination import Cursor, LimitOffsetPagination
+    from rest_framework.test import APIRequestFactory
+    from rest_framework.views import APIView
+
+    from payments.models import Payment
+    from payments.pagination import PaymentCursorPagination, payment_list_queryset
+    from payments.serializers import PaymentSerializer
+    from payments.views import PaymentListCreateView
+
+    class OffsetPaymentListView(APIView):
+        """Listagem com LIMIT/OFFSET, para comparação"""
+
+        def get(self, request):
+            payments, fields = payment_list_queryset(request.query_params, PaymentSerializer.Meta.fields)
+            paginator = LimitOffsetPagination()
+            page = paginator.paginate_queryset(payments.order_by('-created_at'), request, view=self)
+            return paginator.get_paginated_response(PaymentSerializer(page, many=True, fields=fields).data)
+
+    factory = APIRequestFactory()
+    cursor_view = PaymentListCreateView.as_view()
+    offset_view = OffsetPaymentListView.as_view()
+
+    with test_database():
+        Payment.objects.bulk_create(
+            [Payment(amount='10.00', description='Bench', payer_email=f'bench{i % 100}@example.com',
+                     status='approved' if i % 4 else 'pending')
+             for i in range(args.rows)],
+            batch_size=2000,
+        )
+
+        paginator = PaymentCursorPagination()
+        paginator.base_url = '/api/payments/'
+        query = f"page_size={args.page_size}&fields={args.fields}"
+        for depth in (int(value) for value in args.depths.split(',')):
+            if depth >= args.rows:
+                continue
+            # posição do cursor equivalente a OFFSET depth
+            position = Payment.objects.order_by('-created_at').values_list('created_at', flat=True)[depth]
+            cursor = paginator.encode_cursor(Cursor(offset=0, reverse=False, position=str(position)))
+            cursor = cursor.split('cursor=', 1)[1].split('&', 1)[0]
+
+            report(f'list_depth_{depth}', {
+                'rows': args.rows,
+                'offset_p50_ms': timed(offset_view, factory,
+                                       f"/api/payments/?limit={args.page_size}&offset={depth}&fields={args.fields}",
+                                       args.repeat),
+                'cursor_p50_ms': timed(cursor_view, factory, f"/api/payments/?{query}&cursor={cursor}", args.repeat),
+            })
+
+        report('list_projection', {
+            'all_fields_p50_ms': timed(cursor_view, factory, f"/api/payments/?page_size={args.page_size}", args.repeat),
+            'projected_p50_ms': timed(cursor_view, factory, f"/api/payments/?{query}", args.repeat),
+        })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Latência do webhook e do health check com o worker saturado por criações
+de pagamento, sem e com o descarte de carga (payments.load_shedding).
+
+    python -m benchmarks.bench_load_shedding --flood 64 --threads 16 --latency 0.5 --duration 10
+
+O servidor WSGI tem --threads threads; --flood clientes criam pagamentos
+sem parar contra o stub lento, e um cliente separado manda um webhook e um
+health check a cada 100ms. Sem descarte, o webhook espera na fila atrás das
+criações presas no gateway; com PAGBANK_SHED_MAX_CONCURRENCY = --threads,
+as criações acima da faixa livre recebem 503 na hora e a fila anda.
+Os limites por cliente ficam desligados (toda a carga sai do mesmo IP).
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from benchmarks.bench_asgi import prepare_database, spawn
+from benchmarks.common import free_port, report, setup_django, summarize, wait_for_port
+
+PAYMENT = {
+    'amount': '10.00',
+    'description': 'Bench',
+    'payer_email': 'bench@example.com',
+    'items': [{'title': 'Produto', 'quantity': 1, 'unit_price': '10.00'}],
+}
+
+
+async def drive(base_url, flood, duration):
+    import aiohttp
+
+    deadline = time.perf_counter() + duration
+    created = shed = failed = 0
+    critical = {'webhook': [], 'health': []}
+    critical_errors = 0
+    connector = aiohttp.TCPConnector(limit=flood + 4)
+    timeout = aiohttp.ClientTimeout(total=60)
+
+    async with aiohttp.ClientSession(base_url=base_url, connector=connector, timeout=timeout) as client:
+        async def flooder():
+            nonlocal created, shed, failed
+            while time.perf_counter() < deadline:
+                async with client.post('/api/payments/', json=PAYMENT) as response:
+                    await response.read()
+                if response.status == 201:
+                    created += 1
+                elif response.status == 503:
+                    shed += 1
+                    await asyncio.sleep(0.05)
+                else:
+                    failed += 1
+
+        async def probe(name, method, path, **kwargs):
+            nonlocal critical_errors
+            started = time.perf_counter()
+            async with client.request(method, path, **kwargs) as response:
+                await response.read()
+            critical[name].append(time.perf_counter() - started)
+            if response.status != 200:
+                critical_errors += 1
+
+        async def prober():
+            # deixa o flood ocupar o worker antes de medir
+            await asyncio.sleep(1.0)
+            probes = []
+            while time.perf_counter() < deadline:
+                probes.append(asyncio.create_task(probe(
+                    'webhook', 'POST', '/api/payments/webhook/', data='notificationCode=BENCH',
+                    headers={'Content-Type': 'application/x-www-form-urlencoded'},
+                )))
+                probes.append(asyncio.create_task(probe('health', 'GET', '/api/')))
+                await asyncio.sleep(0.1)
+            await asyncio.gather(*probes)
+
+        started = time.perf_counter()
+        await asyncio.gather(prober(), *(flooder() for _ in range(flood)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        'created_per_s': round(created / elapsed, 1),
+        'shed_per_s': round(shed / elapsed, 1),
+        'failed': failed,
+        'critical_errors': critical_errors,
+        **{f'webhook_{k}': v for k, v in summarize(critical['webhook']).items()},
+        **{f'health_{k}': v for k, v in summarize(critical['health']).items()},
+    }
+
+
+def run(database, gateway_url, args, max_concurrency):
+    port = free_port()
+    server = spawn(
+        'benchmarks.serve', '--mode', 'wsgi', '--port', str(port), '--database', database,
+        '--gateway-url', gateway_url, '--threads', str(args.threads),
+        '--setting', 'PAGBANK_THROTTLE_ENABLED=False',
+        '--setting', f'PAGBANK_SHED_MAX_CONCURRENCY={max_concurrency}',
+        '--setting', f'PAGBANK_SHED_RESERVED={args.reserved}',
+    )
+    try:
+        wait_for_port(port)
+        return asyncio.run(drive(f"http://127.0.0.1:{port}", args.flood, args.duration))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--flood', type=int, default=64, help='clientes criando pagamentos')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--reserved', type=int, default=2)
+    parser.add_argument('--latency', type=float, default=0.5, help='latência do stub (s)')
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args()
+
+    fd, database = tempfile.mkstemp(suffix='.sqlite3')
+    os.close(fd)
+    setup_django(database=database)
+    prepare_database(database, 0)
+
+    gateway_port = free_port()
+    gateway = spawn('benchmarks.stub_gateway', '--port', str(gateway_port), '--latency', str(args.latency))
+    try:
+        wait_for_port(gateway_port)
+        gateway_url = f"http://127.0.0.1:{gateway_port}"
+        report('load_shedding_off', run(database, gateway_url, args, 0))
+        report(f'load_shedding_on_{args.threads}_reserved_{args.reserved}', run(database, gateway_url, args, args.threads))
+    finally:
+        gateway.terminate()
+        gateway.wait()
+        os.unlink(database)
+
+
+if __name__ == '__main__':
+    main()
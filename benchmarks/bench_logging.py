@@ -0,0 +1,132 @@
+"""Latência de PagBankService.create_order com o logger 'payments' em INFO:
+logs antigos (json.dumps indentado + resposta inteira, FileHandler síncrono)
+x pipeline atual (Payload preguiçoso, JSON gravado por QueueFileHandler),
+com e sem amostragem de payloads.
+
+    python -m benchmarks.bench_logging --requests 2000 --io-delay 0.002
+
+--io-delay simula um disco lento (segundos por registro gravado): no
+FileHandler síncrono a espera cai na requisição; no QueueFileHandler, na
+thread de escrita. Cada cenário roda com o disco normal e com o lento.
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+import uuid
+
+from benchmarks.common import report, setup_django, summarize
+from benchmarks.stub_gateway import StubGateway
+
+
+def payment_data():
+    return {
+        'items': [{'title': f'Produto {i}', 'quantity': 1, 'unit_price': '10.00'} for i in range(5)],
+        'payer_email': 'bench@example.com',
+        'payer_name': 'Cliente',
+        'external_reference': str(uuid.uuid4()),
+    }
+
+
+def legacy_service_class():
+    """PagBankService com os logs de create_order anteriores ao pipeline estruturado"""
+    import json
+
+    from payments.services import PagBankService, logger
+
+    class LegacyLoggingService(PagBankService):
+        def create_order(self, payment_data):
+            logger.info("Criando ordem PagBank v4...")
+            order_data = self._build_order_data(payment_data)
+            logger.info(f"Dados da ordem: {json.dumps(order_data, indent=2)}")
+            response = self._request('POST', '/orders', 'create_order', json=order_data)
+            logger.info(f"Status: {response.status_code}")
+            logger.info(f"Resposta: {response.text}")
+            return self._order_result(response)
+
+    return LegacyLoggingService
+
+
+def slow(handler_class, io_delay):
+    """Subclasse do handler que espera `io_delay` segundos a cada registro gravado"""
+    class SlowHandler(handler_class):
+        def emit(self, record):
+            if io_delay:
+                time.sleep(io_delay)
+            super().emit(record)
+
+    return SlowHandler
+
+
+def configure(handler):
+    logger = logging.getLogger('payments')
+    for old in list(logger.handlers):
+        logger.removeHandler(old)
+        old.close()
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+
+def measure(service, requests):
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        result = service.create_order(payment_data())
+        latencies.append(time.perf_counter() - started)
+        assert result['success'], result
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--io-delay', type=float, default=0.002, help='espera por registro no disco lento (s)')
+    parser.add_argument('--sample-rate', type=float, default=0.1)
+    args = parser.parse_args()
+
+    setup_django(quiet_logs=False)
+
+    from django.conf import settings
+
+    from payments import structured_logging
+    from payments.services import PagBankService
+
+    with tempfile.TemporaryDirectory() as directory, StubGateway() as gateway:
+        settings.PAGBANK_API_URL = gateway.url
+        for disk, io_delay in (('fast_disk', 0.0), ('slow_disk', args.io_delay)):
+            scenarios = (
+                ('legacy_sync_file', legacy_service_class(), None, 1.0),
+                ('queue_json', PagBankService, structured_logging.QueueFileHandler, 1.0),
+                (f'queue_json_sampled_{args.sample_rate:g}', PagBankService,
+                 structured_logging.QueueFileHandler, args.sample_rate),
+            )
+            for name, service_class, handler_class, sample_rate in scenarios:
+                path = os.path.join(directory, f'{name}_{disk}.log')
+                if handler_class is None:
+                    handler = slow(logging.FileHandler, io_delay)(path, encoding='utf-8')
+                    handler.setFormatter(logging.Formatter(
+                        '{levelname} {asctime} {module} {process:d} {thread:d} {message}', style='{'
+                    ))
+                else:
+                    handler = handler_class(path)
+                    # o mesmo arquivo, gravado pela thread da fila
+                    handler.target = slow(logging.FileHandler, io_delay)(path, encoding='utf-8', delay=True)
+                    handler.setFormatter(structured_logging.JsonFormatter())
+                    handler.addFilter(structured_logging.PayloadSampleFilter(sample_rate))
+                configure(handler)
+
+                service = service_class()
+                measure(service, 50)
+                structured_logging.stats.reset()
+                latencies = measure(service, args.requests)
+                configure(logging.NullHandler())
+                report(f'logging_{name}_{disk}', {
+                    **summarize(latencies),
+                    'log_bytes_per_request': round(os.path.getsize(path) / (args.requests + 50)),
+                    **structured_logging.stats.snapshot(),
+                })
+
+
+if __name__ == '__main__':
+    main()
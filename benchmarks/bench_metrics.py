@@ -0,0 +1,128 @@
+"""Custo das métricas (payments.metrics) e agregação entre processos.
+
+    python -m benchmarks.bench_metrics --operations 200000 --threads 8 --requests 300
+
+1. ns por Counter.inc / Histogram.observe, com 1 e com --threads threads,
+   x um contador com lock (o que os shards por thread evitam).
+2. Dois servidores WSGI com o mesmo PAGBANK_METRICS_DIR: --requests GETs em
+   cada um e um scrape de GET /api/metrics/ em só um deles, que precisa
+   somar as requisições dos dois.
+"""
+import argparse
+import os
+import re
+import tempfile
+import threading
+import time
+import urllib.request
+
+from benchmarks.bench_asgi import prepare_database, spawn
+from benchmarks.common import free_port, report, setup_django, wait_for_port
+
+
+class LockedCounter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, *labels):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + 1
+
+
+def ns_per_operation(operation, operations, threads):
+    per_thread = operations // threads
+
+    def work():
+        for _ in range(per_thread):
+            operation()
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return round((time.perf_counter() - started) / (per_thread * threads) * 1e9, 1)
+
+
+def micro(args):
+    from payments import metrics
+
+    registry = metrics.Registry()
+    counter = metrics.Counter('bench_total', 'bench', ('operation', 'status'), registry=registry)
+    histogram = metrics.Histogram('bench_seconds', 'bench', ('operation',), registry=registry)
+    locked = LockedCounter()
+
+    operations = {
+        'counter_inc': lambda: counter.inc('create_order', '201'),
+        'histogram_observe': lambda: histogram.observe(0.042, 'create_order'),
+        'locked_counter_inc': lambda: locked.inc('create_order', '201'),
+    }
+    for name, operation in operations.items():
+        report(f'metrics_{name}', {
+            'ns_1_thread': ns_per_operation(operation, args.operations, 1),
+            f'ns_{args.threads}_threads': ns_per_operation(operation, args.operations, args.threads),
+        })
+    started = time.perf_counter()
+    metrics.render(registry.samples(), registry)
+    report('metrics_render', {'ms': round((time.perf_counter() - started) * 1000, 3)})
+
+
+def get(url):
+    with urllib.request.urlopen(url) as response:
+        return response.read().decode()
+
+
+def multiprocess(args, database):
+    prepare_database(database, 0)
+    servers = []
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            ports = [free_port() for _ in range(2)]
+            for port in ports:
+                servers.append(spawn(
+                    'benchmarks.serve', '--mode', 'wsgi', '--port', str(port), '--database', database,
+                    '--gateway-url', 'http://127.0.0.1:9', '--threads', '4',
+                    '--setting', f'PAGBANK_METRICS_DIR={directory}',
+                    '--setting', 'PAGBANK_METRICS_FLUSH_INTERVAL=0.2',
+                ))
+            for port in ports:
+                wait_for_port(port)
+                for _ in range(args.requests):
+                    get(f"http://127.0.0.1:{port}/api/")
+            time.sleep(1.0)
+
+            started = time.perf_counter()
+            text = get(f"http://127.0.0.1:{ports[0]}/api/metrics/")
+            scrape_ms = (time.perf_counter() - started) * 1000
+            match = re.search(r'^http_requests_total\{view="health-check",method="GET",status="200"\} (\d+)$', text, re.M)
+            report('metrics_two_processes', {
+                'requests_sent': 2 * args.requests,
+                'requests_scraped': int(match.group(1)) if match else 0,
+                'snapshot_files': len(os.listdir(directory)),
+                'scrape_ms': round(scrape_ms, 2),
+            })
+        finally:
+            for server in servers:
+                server.terminate()
+                server.wait()
+            os.unlink(database)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--operations', type=int, default=200000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=300, help='GETs por servidor')
+    args = parser.parse_args()
+
+    fd, database = tempfile.mkstemp(suffix='.sqlite3')
+    os.close(fd)
+    setup_django(database=database)
+    micro(args)
+    multiprocess(args, database)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""Micro-benchmarks dos caminhos de CPU de toda requisição, comparados com um
+baseline gravado. Termina com código 1 se algum caso ficar mais lento que o
+baseline além da tolerância, para pegar regressões.
+
+    python -m benchmarks.bench_micro                     # mede e compara
+    python -m benchmarks.bench_micro --save-baseline     # regrava o baseline
+    python -m benchmarks.bench_micro --filter serialize  # só os casos com esse trecho
+
+Cada caso roda em --rounds rodadas de N chamadas (N escolhido para a rodada
+durar ao menos --min-time), e vale a melhor rodada (µs por chamada). Logo
+antes de cada caso roda também uma carga fixa de calibração (Python puro);
+a comparação usa o caso dividido pela calibração (`relative`), o que tira
+parte do ruído de CPU compartilhada e de frequência variável, e um caso
+acima da tolerância é medido de novo antes de falhar. Ainda assim o
+baseline (benchmarks/baselines/micro.json) vale para a máquina e a versão
+do Python em que foi gravado: regrave-o ao trocar de uma delas.
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from decimal import Decimal
+from pathlib import Path
+
+from benchmarks.common import BASE_DIR, payment_payload, report, setup_django, test_database
+
+BASELINE = BASE_DIR / 'benchmarks' / 'baselines' / 'micro.json'
+
+
+def order_payment_data(items):
+    return {
+        'items': [{'title': f'Produto {i}', 'quantity': 2, 'unit_price': Decimal('19.90')} for i in range(items)],
+        'payer_email': 'bench@example.com',
+        'payer_name': 'Cliente',
+        'payer_cpf': '12345678909',
+        'external_reference': 'c5b3f1de-7c2c-4c8e-9d55-1d0f0b7e5f10',
+    }
+
+
+class ErrorResponse:
+    """Resposta de erro do PagBank com várias mensagens (para _error_message)"""
+
+    content = b'{}'
+    text = ''
+
+    def __init__(self, messages):
+        self.data = {'error_messages': [
+            {'code': f'4000{i}', 'description': f'Campo inválido {i}', 'parameter_name': f'items[{i}]'}
+            for i in range(messages)
+        ]}
+
+    def json(self):
+        return self.data
+
+
+def calibration():
+    """Carga fixa de referência: dicts, strings e Decimal, como os casos"""
+    total = Decimal('0')
+    for i in range(50):
+        item = {'title': f'Item {i}', 'unit_price': Decimal('19.90'), 'quantity': i % 3 + 1}
+        total += item['unit_price'] * item['quantity']
+    return total
+
+
+def build_cases():
+    """{nome: chamada sem argumentos}; o preparo fica fora da medição"""
+    from payments.models import Payment
+    from payments.serializers import CreatePaymentSerializer, PaymentSerializer
+    from payments.services import STATUS_MAP, PagBankService, map_gateway_status
+
+    service = PagBankService()
+    cases = {}
+
+    create_data = payment_payload(items=10, unit_price='19.90')
+    cases['create_serializer_is_valid_10_items'] = lambda: CreatePaymentSerializer(data=create_data).is_valid()
+
+    # Soma em Decimal dos itens contra o amount (CreatePaymentSerializer.validate)
+    validated = CreatePaymentSerializer(data=create_data)
+    validated.is_valid(raise_exception=True)
+    attrs = dict(validated.validated_data)
+    cases['create_serializer_validate_totals_10_items'] = lambda: validated.validate(attrs)
+
+    Payment.objects.bulk_create_with_items(
+        [{**payment_payload(items=3), 'items': payment_payload(items=3)['items']} for _ in range(10000)]
+    )
+    for count in (1, 100, 10000):
+        payments = list(Payment.objects.with_items().order_by('created_at')[:count])
+        cases[f'payment_serializer_{count}'] = (
+            lambda payments=payments: PaymentSerializer(payments, many=True).data
+        )
+
+    for items in (1, 20):
+        data = order_payment_data(items)
+        cases[f'build_order_data_{items}_items'] = lambda data=data: service._build_order_data(data)
+
+    error = ErrorResponse(10)
+    cases['error_message_10_messages'] = lambda: service._error_message(error)
+
+    statuses = list(STATUS_MAP) + ['UNKNOWN']
+    cases['map_gateway_status_all'] = lambda: [map_gateway_status(value) for value in statuses]
+    return cases
+
+
+def measure(call, rounds, min_time):
+    """µs por chamada em cada rodada"""
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            call()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2 if elapsed * 2 >= min_time else 10
+    timings = [elapsed / number]
+    for _ in range(rounds - 1):
+        started = time.perf_counter()
+        for _ in range(number):
+            call()
+        timings.append((time.perf_counter() - started) / number)
+    return [value * 1e6 for value in timings], number
+
+
+def run_case(call, args):
+    reference, _ = measure(calibration, args.rounds, args.min_time / 2)
+    timings, number = measure(call, args.rounds, args.min_time)
+    return {
+        'best_us': round(min(timings), 3),
+        'median_us': round(statistics.median(timings), 3),
+        'calls_per_round': number,
+        'relative': round(min(timings) / min(reference), 4),
+    }
+
+
+def load_baseline(path):
+    try:
+        with open(path, encoding='utf-8') as baseline_file:
+            return json.load(baseline_file)
+    except FileNotFoundError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.2, help='duração mínima de uma rodada (s)')
+    parser.add_argument('--filter', default='', help='só os casos cujo nome contém este texto')
+    parser.add_argument('--baseline', type=Path, default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='grava os resultados como baseline')
+    parser.add_argument('--tolerance', type=float, default=0.3,
+                        help='regressão máxima aceita (0.3 = até 30%% mais lento que o baseline)')
+    parser.add_argument('--retries', type=int, default=2, help='novas medições de um caso acima da tolerância')
+    args = parser.parse_args()
+
+    setup_django()
+    baseline = None if args.save_baseline else load_baseline(args.baseline)
+    results = {}
+    regressions = []
+
+    with test_database():
+        cases = build_cases()
+        for name, call in cases.items():
+            if args.filter not in name:
+                continue
+            result = run_case(call, args)
+            previous = (baseline or {}).get('cases', {}).get(name)
+            if previous:
+                # Um caso acima da tolerância é medido de novo (--retries vezes)
+                # antes de contar como regressão; vale a melhor medição
+                for _ in range(args.retries):
+                    if result['relative'] <= previous['relative'] * (1 + args.tolerance):
+                        break
+                    result = min(result, run_case(call, args), key=lambda value: value['relative'])
+                result['baseline_relative'] = previous['relative']
+                result['change'] = round(result['relative'] / previous['relative'] - 1, 3)
+                if result['change'] > args.tolerance:
+                    regressions.append(name)
+            results[name] = result
+            report(f'micro_{name}', result)
+
+    if args.save_baseline:
+        if args.filter and (saved := load_baseline(args.baseline)):
+            results = {**saved['cases'], **results}
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as baseline_file:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'cases': results,
+            }, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+        print(f"Baseline gravado em {args.baseline}")
+    elif baseline is None:
+        print(f"Sem baseline em {args.baseline}; grave um com --save-baseline")
+    elif regressions:
+        print(f"Regressão acima de {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Latência de PaymentListCreateView.post com e sem pool de conexões.
+
+    python -m benchmarks.bench_pooling --requests 500 --latency 0.002
+
+"Sem pool" reproduz o comportamento anterior (requests.post por chamada,
+uma conexão TCP nova por checkout).
+"""
+import argparse
+import time
+from unittest import mock
+
+from benchmarks.common import payment_payload, report, setup_django, summarize, test_database
+from benchmarks.stub_gateway import StubGateway
+
+
+def run(view, factory, gateway, total):
+    latencies = []
+    gateway.reset_counters()
+    for _ in range(total):
+        request = factory.post('/api/payments/', payment_payload(), format='json')
+        started = time.perf_counter()
+        response = view(request)
+        latencies.append(time.perf_counter() - started)
+        assert response.status_code == 201, response.data
+    return {**summarize(latencies), 'tcp_connections': gateway.connections}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--latency', type=float, default=0.0, help='latência do stub (s)')
+    args = parser.parse_args()
+
+    settings = setup_django()
+
+    import requests
+    from rest_framework.test import APIRequestFactory
+
+    from payments import http_client
+    from payments.views import PaymentListCreateView
+
+    view = PaymentListCreateView.as_view()
+    factory = APIRequestFactory()
+
+    with test_database(), StubGateway(latency=args.latency) as gateway:
+        settings.PAGBANK_API_URL = gateway.url
+
+        with mock.patch('payments.services.get_session', return_value=requests):
+            report('post_without_pooling', run(view, factory, gateway, args.requests))
+
+        http_client.reset_session()
+        report('post_with_pooling', run(view, factory, gateway, args.requests))
+
+
+if __name__ == '__main__':
+    main()
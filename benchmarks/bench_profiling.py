@@ -0,0 +1,78 @@
+"""Custo do ProfilingMiddleware em POST /api/payments/ e GET /api/payments/:
+desligado x ligado sem amostragem (só queries e chamadas ao PagBank) x
+amostrando tudo (cProfile + buffer no cache).
+
+    python -m benchmarks.bench_profiling --requests 500
+
+No fim, mostra as funções mais caras do último perfil de GET /api/payments/.
+"""
+import argparse
+import json
+import time
+
+from benchmarks.common import payment_payload, report, setup_django, summarize, test_database
+from benchmarks.stub_gateway import StubGateway
+
+
+def measure(client, requests):
+    body = json.dumps(payment_payload(items=3))
+    posts, gets = [], []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = client.post('/api/payments/', body, content_type='application/json')
+        posts.append(time.perf_counter() - started)
+        assert response.status_code == 201, response.content
+        started = time.perf_counter()
+        client.get('/api/payments/')
+        gets.append(time.perf_counter() - started)
+    return posts, gets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.0, help='latência do stub do PagBank (s)')
+    parser.add_argument('--top', type=int, default=8, help='funções mostradas do último perfil')
+    args = parser.parse_args()
+
+    settings = setup_django()
+    settings.PAGBANK_THROTTLE_ENABLED = False
+    settings.PAGBANK_PROFILE_SLOW_MS = 0
+
+    from django.core.cache import cache
+    from django.test import Client
+
+    from payments import profiling
+
+    with test_database(), StubGateway(latency=args.latency) as gateway:
+        settings.PAGBANK_API_URL = gateway.url
+        scenarios = (
+            ('disabled', False, 0.0),
+            ('capture_only', True, 0.0),
+            ('sampled', True, 1.0),
+        )
+        for name, enabled, sample_rate in scenarios:
+            settings.PAGBANK_PROFILING_ENABLED = enabled
+            settings.PAGBANK_PROFILE_SAMPLE_RATE = sample_rate
+            cache.clear()
+            profiling.stats.reset()
+
+            client = Client()
+            measure(client, 20)
+            posts, gets = measure(client, args.requests)
+            report(f'profiling_{name}', {
+                'post': summarize(posts),
+                'get': summarize(gets),
+                **profiling.stats.snapshot(),
+            })
+
+        latest = next(entry for entry in profiling.get_buffer().entries() if entry['method'] == 'GET')
+        report('profiling_latest_get', {
+            'duration_ms': latest['duration_ms'],
+            'query_count': latest['query_count'],
+            'top_tottime': [[row['function'], row['tottime_ms']] for row in latest['profile']['tottime'][:args.top]],
+        })
+
+
+if __name__ == '__main__':
+    main()
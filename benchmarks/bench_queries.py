@@ -0,0 +1,83 @@
+"""Queries por endpoint com páginas e pagamentos de tamanhos crescentes.
+Termina com código 1 se algum endpoint passar do orçamento (QUERY_BUDGET),
+para pegar regressões de N+1.
+
+    python -m benchmarks.bench_queries
+"""
+import argparse
+import sys
+import time
+
+from benchmarks.common import report, setup_django, test_database
+
+# Máximo de queries por requisição, independente do tamanho da página
+QUERY_BUDGET = {
+    'list': 2,
+    'list_projected': 1,
+    'detail': 2,
+    'status': 2,
+}
+
+
+def measure(client, url):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        response = client.get(url)
+        elapsed = time.perf_counter() - started
+    assert response.status_code == 200, response.status_code
+    return len(queries), round(elapsed * 1000, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--page-sizes', default='10,100,500')
+    parser.add_argument('--items', type=int, default=5, help='itens por pagamento')
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.test import Client
+
+    from payments.models import Payment, PaymentItem
+
+    client = Client()
+    page_sizes = [int(size) for size in args.page_sizes.split(',')]
+    over_budget = []
+
+    with test_database():
+        payments = Payment.objects.bulk_create([
+            Payment(amount='10.00', description='Bench', payer_email='bench@example.com')
+            for _ in range(max(page_sizes))
+        ])
+        PaymentItem.objects.bulk_create([
+            PaymentItem(payment=payment, title=f'Item {i}', quantity=1, unit_price='2.00')
+            for payment in payments for i in range(args.items)
+        ])
+        payment_id = payments[0].id
+
+        cases = [(f'list_{size}', 'list', f'/api/payments/?page_size={size}') for size in page_sizes]
+        cases += [(f'list_projected_{size}', 'list_projected', f'/api/payments/?page_size={size}&fields=id,status')
+                  for size in page_sizes]
+        cases += [
+            ('detail', 'detail', f'/api/payments/{payment_id}/'),
+            ('status', 'status', f'/api/payments/{payment_id}/status/'),
+        ]
+
+        client.get('/api/payments/?page_size=1')  # aquece URLconf e serializers
+        for name, endpoint, url in cases:
+            count, elapsed_ms = measure(client, url)
+            budget = QUERY_BUDGET[endpoint]
+            report(f'queries_{name}', {'queries': count, 'budget': budget, 'elapsed_ms': elapsed_ms})
+            if count > budget:
+                over_budget.append(name)
+
+    if over_budget:
+        print(f"Acima do orçamento de queries: {', '.join(over_budget)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
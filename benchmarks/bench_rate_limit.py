@@ -0,0 +1,82 @@
+"""Checkouts/s concluídos e taxa de 429 com o PagBank limitando as ordens,
+sem e com o limite de chamadas do lado do cliente (payments.rate_limit).
+
+    python -m benchmarks.bench_rate_limit --gateway-limit 50 --workers 50 --duration 10
+
+O stub responde 429 (Retry-After: 1) acima de --gateway-limit ordens/s.
+Sem o limite, os workers disparam, recebem 429 e o retry (com orçamento)
+desiste; com PAGBANK_RATE_LIMIT_ORDERS um pouco abaixo do limite do
+gateway, as chamadas esperam a vez na fila.
+"""
+import argparse
+import threading
+import time
+import uuid
+
+from benchmarks.common import report, setup_django, summarize
+from benchmarks.stub_gateway import StubGateway
+
+
+def run(service, workers, duration):
+    latencies, failures = [], []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            result = service.create_checkout_session({
+                'items': [{'title': 'Produto', 'quantity': 1, 'unit_price': '10.00'}],
+                'payer_email': 'bench@example.com',
+                'payer_name': 'Cliente',
+                'external_reference': str(uuid.uuid4()),
+            })
+            with lock:
+                (latencies if result['success'] else failures).append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, failures, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--gateway-limit', type=int, default=50, help='ordens/s aceitas pelo stub')
+    parser.add_argument('--client-limit', type=float, default=45.0, help='PAGBANK_RATE_LIMIT_ORDERS')
+    parser.add_argument('--workers', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--latency', type=float, default=0.02, help='latência do stub (s)')
+    args = parser.parse_args()
+
+    settings = setup_django()
+
+    from payments import rate_limit, retry
+    from payments.services import PagBankService
+
+    with StubGateway(latency=args.latency, rate_limit=args.gateway_limit) as gateway:
+        settings.PAGBANK_API_URL = gateway.url
+        # Rajada curta: o stub conta em janelas fixas de 1s
+        settings.PAGBANK_RATE_LIMIT_BURST_SECONDS = 0.1
+
+        for name, client_limit in (('rate_limit_off', 0.0), ('rate_limit_on', args.client_limit)):
+            settings.PAGBANK_RATE_LIMIT_ORDERS = client_limit
+            rate_limit._backend = None
+            retry._budget = None
+            gateway.reset_counters()
+
+            latencies, failures, elapsed = run(PagBankService(), args.workers, args.duration)
+            report(name, {
+                'completed_per_s': round(len(latencies) / elapsed, 1),
+                'failed_per_s': round(len(failures) / elapsed, 1),
+                'gateway_requests': gateway.requests,
+                'http_429_pct': round(100 * gateway.throttled / gateway.requests, 1) if gateway.requests else 0.0,
+                **summarize(latencies),
+            })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Reconciliação de pagamentos pendentes antigos com o stub do PagBank:
+laço sequencial (get_order + transition_status por pagamento) x
+reconcile_payments (blocos pelo índice, consultas em paralelo, bulk_update).
+
+    python -m benchmarks.bench_reconcile --payments 2000 --latency 0.02 --concurrency 10
+
+Também roda o reconcile com PAGBANK_RATE_LIMIT_READS=--rate para mostrar o
+limite de consultas/s (o mesmo limite de leituras das consultas de /status/).
+"""
+import argparse
+import time
+from datetime import timedelta
+
+from benchmarks.common import count_queries, report, setup_django, test_database
+from benchmarks.stub_gateway import StubGateway
+
+
+def create_pending(count):
+    from django.utils import timezone
+
+    from payments.models import Payment
+
+    Payment.objects.bulk_create([
+        Payment(
+            amount='10.00', description='Bench', payer_email='bench@example.com',
+            payment_gateway_id=f"ORDE_REC_{i}", status='pending',
+        )
+        for i in range(count)
+    ], batch_size=500)
+    Payment.objects.update(created_at=timezone.now() - timedelta(hours=2))
+
+
+def reset():
+    from payments.models import Payment, WebhookDelivery
+
+    Payment.objects.update(status='pending')
+    # a deduplicação de webhooks descartaria as mesmas ordens na rodada seguinte
+    WebhookDelivery.objects.all().delete()
+
+
+def sequential(service, cutoff, chunk_size):
+    """Um get_order e um UPDATE por pagamento, um de cada vez"""
+    from payments.models import Payment
+    from payments.services import map_gateway_status
+
+    scanned = calls = 0
+    for payment in Payment.objects.filter(status='pending', created_at__lt=cutoff).iterator(chunk_size):
+        scanned += 1
+        result = service.get_order(payment.payment_gateway_id)
+        calls += 1
+        if result['success']:
+            Payment.objects.transition_status(payment.id, map_gateway_status(result['order'].get('status')))
+    return scanned, calls
+
+
+def reconcile(service, cutoff, chunk_size, concurrency):
+    from payments.reconcile import Reconciler, stale_pending_chunks
+
+    reconciler = Reconciler(service, concurrency)
+    scanned = 0
+    try:
+        for rows in stale_pending_chunks(cutoff, chunk_size):
+            reconciler.reconcile_chunk(rows)
+            scanned += len(rows)
+    finally:
+        reconciler.close()
+    return scanned, reconciler.gateway_calls
+
+
+def measure(name, run):
+    from payments.models import Payment
+
+    reset()
+    counter = {'reads': 0, 'write_statements': 0, 'writes': 0}
+    started = time.perf_counter()
+    with count_queries(counter):
+        scanned, calls = run()
+    elapsed = time.perf_counter() - started
+    results = {
+        'rows_scanned': scanned,
+        'rows_per_s': round(scanned / elapsed, 1),
+        'gateway_calls_per_s': round(calls / elapsed, 1),
+        'write_statements': counter['write_statements'],
+        'approved': Payment.objects.filter(status='approved').count(),
+        'elapsed_s': round(elapsed, 2),
+    }
+    report(name, results)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--payments', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.02, help='latência do stub (s)')
+    parser.add_argument('--chunk-size', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--rate', type=float, default=100.0, help='limite da rodada com rate limit (consultas/s)')
+    args = parser.parse_args()
+
+    settings = setup_django()
+
+    from django.utils import timezone
+
+    from payments import rate_limit
+    from payments.services import PagBankService
+
+    with test_database(), StubGateway(latency=args.latency, order_status='PAID') as gateway:
+        settings.PAGBANK_API_URL = gateway.url
+        service = PagBankService()
+        create_pending(args.payments)
+        cutoff = timezone.now() - timedelta(minutes=15)
+
+        before = measure('reconcile_sequential', lambda: sequential(service, cutoff, args.chunk_size))
+        after = measure(f'reconcile_chunked_{args.concurrency}_concurrent', lambda: reconcile(service, cutoff, args.chunk_size, args.concurrency))
+        report('reconcile_speedup', {'rows_per_s_x': round(after['rows_per_s'] / before['rows_per_s'], 1)})
+        settings.PAGBANK_RATE_LIMIT_READS = args.rate
+        rate_limit._backend = None
+        measure(f'reconcile_rate_limited_{args.rate:g}_per_s', lambda: reconcile(service, cutoff, args.chunk_size, args.concurrency))
+
+
+if __name__ == '__main__':
+    main()
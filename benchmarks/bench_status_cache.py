@@ -0,0 +1,119 @@
+"""Chamadas ao PagBank/s com N pollers simultâneos em
+GET /api/payments/<id>/status/, sem e com o cache de status.
+
+    python -m benchmarks.bench_status_cache --pollers 1000 --payments 100 --interval 10
+
+Cada poller consulta um pagamento pendente (com id no gateway) a cada
+--interval segundos, como um checkout aberto no frontend. Servidor ASGI
+em outro processo; o stub do PagBank conta as chamadas recebidas.
+Requer aiohttp e uvicorn.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from benchmarks.bench_asgi import prepare_database, spawn
+from benchmarks.common import free_port, report, setup_django, summarize, wait_for_port
+from benchmarks.stub_gateway import StubGateway
+
+
+async def poll(base_url, payment_ids, pollers, duration, interval):
+    import aiohttp
+
+    latencies = []
+    errors = 0
+    connector = aiohttp.TCPConnector(limit=pollers)
+
+    async with aiohttp.ClientSession(base_url=base_url, connector=connector) as client:
+        async def poller(i):
+            nonlocal errors
+            url = f"/api/payments/{payment_ids[i % len(payment_ids)]}/status/"
+            # espalha o início dos pollers dentro do primeiro intervalo
+            await asyncio.sleep(interval * i / pollers)
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                async with client.get(url) as response:
+                    await response.read()
+                latencies.append(time.perf_counter() - started)
+                if response.status != 200:
+                    errors += 1
+                await asyncio.sleep(interval)
+
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(poller(i) for i in range(pollers)))
+
+    return latencies, errors
+
+
+def run(name, database, gateway, payment_ids, args, settings):
+    port = free_port()
+    server = spawn(
+        'benchmarks.serve', '--mode', args.mode, '--port', str(port), '--database', database,
+        '--gateway-url', gateway.url, '--threads', str(args.wsgi_threads),
+        *(f'--setting={setting}' for setting in settings),
+    )
+    try:
+        wait_for_port(port)
+        gateway.reset_counters()
+        started = time.perf_counter()
+        latencies, errors = asyncio.run(poll(
+            f"http://127.0.0.1:{port}", payment_ids, args.pollers, args.duration, args.interval
+        ))
+        elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+
+    results = {
+        'polls_per_s': round(len(latencies) / elapsed, 1),
+        'gateway_calls_per_s': round(gateway.requests / elapsed, 1),
+        'gateway_calls_per_poll': round(gateway.requests / len(latencies), 3) if latencies else 0.0,
+        'errors': errors,
+        **summarize(latencies),
+    }
+    report(name, results)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pollers', type=int, default=1000)
+    parser.add_argument('--payments', type=int, default=100, help='checkouts abertos')
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--interval', type=float, default=10.0, help='intervalo entre polls de um poller (s)')
+    parser.add_argument('--latency', type=float, default=0.05, help='latência do stub (s)')
+    parser.add_argument('--mode', choices=('asgi', 'wsgi'), default='asgi')
+    parser.add_argument('--wsgi-threads', type=int, default=32)
+    args = parser.parse_args()
+
+    fd, database = tempfile.mkstemp(suffix='.sqlite3')
+    os.close(fd)
+    setup_django(database=database)
+    payment_ids = prepare_database(database, args.payments)
+
+    try:
+        with StubGateway(latency=args.latency) as gateway:
+            before = run('status_cache_off', database, gateway, payment_ids, args,
+                         ['PAGBANK_STATUS_CACHE_ENABLED=False'])
+            after = run('status_cache_on', database, gateway, payment_ids, args, [])
+            # Um processo só não atende toda a carga oferecida sem cache; a
+            # economia na carga oferecida é estimada pelas chamadas por poll
+            offered = args.pollers / args.interval
+            per_poll_saved = before['gateway_calls_per_poll'] - after['gateway_calls_per_poll']
+            report('status_cache_saved', {
+                'offered_polls_per_s': round(offered, 1),
+                'measured_gateway_calls_per_s_saved': round(
+                    before['gateway_calls_per_s'] - after['gateway_calls_per_s'], 1
+                ),
+                'gateway_calls_per_s_saved_at_offered_load': round(offered * per_poll_saved, 1),
+                'gateway_calls_per_poll_saved_pct': round(100 * per_poll_saved / before['gateway_calls_per_poll'], 1)
+                if before['gateway_calls_per_poll'] else 0.0,
+            })
+    finally:
+        os.unlink(database)
+
+
+if __name__ == '__main__':
+    main()
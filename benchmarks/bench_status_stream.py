@@ -0,0 +1,110 @@
+"""Entrega de mudanças de status para N clientes em long-poll
+(GET /api/payments/<id>/status/wait/) em um único processo ASGI.
+
+    python -m benchmarks.bench_status_stream --clients 1000 --payments 100
+
+Os clientes esperam com ?status=pending; este processo então aprova os
+pagamentos no banco (como o worker process_webhooks, em outro processo) e
+mede quanto tempo cada cliente levou para receber o novo status, além das
+threads do servidor com todos os clientes esperando. A entrega entre
+processos usa o backend 'database' (PAGBANK_STATUS_EVENTS_POLL_INTERVAL).
+Requer aiohttp e uvicorn.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from benchmarks.bench_asgi import prepare_database, spawn
+from benchmarks.common import free_port, report, setup_django, summarize, wait_for_port
+
+
+def process_status(pid, field):
+    """Campo de /proc/<pid>/status (ex.: Threads, VmRSS em kB)"""
+    with open(f'/proc/{pid}/status') as status_file:
+        for line in status_file:
+            if line.startswith(f'{field}:'):
+                return int(line.split()[1])
+    return None
+
+
+def approve(payment_ids):
+    from django.utils import timezone
+
+    from payments.models import Payment
+
+    Payment.objects.filter(id__in=payment_ids).update(status='approved', updated_at=timezone.now())
+
+
+async def wait_all(base_url, payment_ids, clients, server_pid, settle):
+    import aiohttp
+    from asgiref.sync import sync_to_async
+
+    received = []
+    errors = 0
+    connector = aiohttp.TCPConnector(limit=clients)
+    timeout = aiohttp.ClientTimeout(total=None)
+
+    async with aiohttp.ClientSession(base_url=base_url, connector=connector, timeout=timeout) as client:
+        async def waiter(i):
+            nonlocal errors
+            url = f"/api/payments/{payment_ids[i % len(payment_ids)]}/status/wait/"
+            async with client.get(url, params={'status': 'pending', 'timeout': '60'}) as response:
+                data = await response.json()
+            if response.status != 200 or data.get('status') != 'approved':
+                errors += 1
+            received.append(time.perf_counter())
+
+        tasks = [asyncio.ensure_future(waiter(i)) for i in range(clients)]
+        # todos conectados e esperando antes da mudança
+        await asyncio.sleep(settle)
+        threads = process_status(server_pid, 'Threads')
+        rss_mb = round(process_status(server_pid, 'VmRSS') / 1024, 1)
+        changed_at = time.perf_counter()
+        await sync_to_async(approve)(payment_ids)
+        await asyncio.gather(*tasks)
+
+    return {
+        'clients': clients,
+        'server_threads_while_waiting': threads,
+        'server_rss_mb_while_waiting': rss_mb,
+        'errors': errors,
+        **summarize([at - changed_at for at in received]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--payments', type=int, default=100)
+    parser.add_argument('--poll-interval', type=float, default=1.0,
+                        help='PAGBANK_STATUS_EVENTS_POLL_INTERVAL do servidor (s)')
+    parser.add_argument('--settle', type=float, default=5.0, help='espera até todos conectarem (s)')
+    args = parser.parse_args()
+
+    fd, database = tempfile.mkstemp(suffix='.sqlite3')
+    os.close(fd)
+    setup_django(database=database)
+    payment_ids = prepare_database(database, args.payments)
+
+    port = free_port()
+    server = spawn(
+        'benchmarks.serve', '--mode', 'asgi', '--port', str(port), '--database', database,
+        '--gateway-url', 'http://127.0.0.1:9',
+        f'--setting=PAGBANK_STATUS_EVENTS_POLL_INTERVAL={args.poll_interval}',
+    )
+    try:
+        wait_for_port(port)
+        results = asyncio.run(wait_all(
+            f"http://127.0.0.1:{port}", payment_ids, args.clients, server.pid, args.settle
+        ))
+        report(f'status_long_poll_{args.clients}_clients', results)
+    finally:
+        server.terminate()
+        server.wait()
+        os.unlink(database)
+
+
+if __name__ == '__main__':
+    main()
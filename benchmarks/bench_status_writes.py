@@ -0,0 +1,114 @@
+"""Escritas de status/s com várias threads aplicando as mesmas notificações:
+get + save() (comportamento anterior) x UPDATE condicional
+(Payment.objects.transition_status).
+
+    python -m benchmarks.bench_status_writes --payments 200 --threads 8
+
+Cada thread entrega WAITING, PAID e REFUNDED ('6') para todos os pagamentos,
+em ordens embaralhadas. O estado final correto é 'refunded'; `lost_updates`
+conta pagamentos que terminaram em outro status por causa da corrida e
+`duplicate_writes` as transições gravadas por mais de uma thread.
+Usa um SQLite em arquivo para que as threads tenham conexões próprias.
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from benchmarks.common import report, setup_django
+
+EVENTS = ('WAITING', 'PAID', '6')
+
+
+def get_then_save(payment_id, gateway_status):
+    """Comportamento anterior: lê a linha, valida a transição e salva"""
+    from payments.models import Payment
+    from payments.services import map_gateway_status
+
+    payment = Payment.objects.get(id=payment_id)
+    new_status = map_gateway_status(gateway_status)
+    if payment.can_transition_to(new_status):
+        payment.status = new_status
+        payment.save()
+        return True
+    return False
+
+
+def conditional_update(payment_id, gateway_status):
+    from payments.models import Payment
+    from payments.services import map_gateway_status
+
+    return Payment.objects.transition_status(payment_id, map_gateway_status(gateway_status))
+
+
+def run(apply, payment_ids, threads):
+    from django.db import connection
+
+    from payments.models import Payment
+
+    Payment.objects.update(status='pending')
+    barrier = threading.Barrier(threads)
+    writes = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        # cada thread entrega as notificações quase em ordem de fase, com
+        # sobreposição para simular reenvios atrasados
+        work = [(payment_id, event) for payment_id in payment_ids for event in EVENTS]
+        work.sort(key=lambda item: rng.random() * 2 + EVENTS.index(item[1]))
+        count = 0
+        barrier.wait()
+        for payment_id, event in work:
+            count += bool(apply(payment_id, event))
+        writes.append(count)
+        connection.close()
+
+    pool = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads)]
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    deliveries = threads * len(payment_ids) * len(EVENTS)
+    return {
+        'deliveries': deliveries,
+        'deliveries_per_s': round(deliveries / elapsed, 1),
+        'rows_written': sum(writes),
+        # pending -> approved -> refunded: duas transições por pagamento
+        'duplicate_writes': sum(writes) - 2 * len(payment_ids),
+        'lost_updates': Payment.objects.exclude(status='refunded').count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--payments', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    fd, database = tempfile.mkstemp(suffix='.sqlite3')
+    os.close(fd)
+    setup_django(database=database)
+
+    from django.core.management import call_command
+
+    from payments.models import Payment
+
+    try:
+        call_command('migrate', verbosity=0)
+        payment_ids = [
+            Payment.objects.create(amount='10.00', description='Bench', payer_email='bench@example.com').id
+            for _ in range(args.payments)
+        ]
+        report('status_get_then_save', run(get_then_save, payment_ids, args.threads))
+        report('status_conditional_update', run(conditional_update, payment_ids, args.threads))
+    finally:
+        os.unlink(database)
+
+
+if __name__ == '__main__':
+    main()
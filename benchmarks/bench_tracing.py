@@ -0,0 +1,131 @@
+"""Custo do tracing (payments.tracing) em POST /api/payments/ e GET /api/payments/:
+desligado x ligado sem amostragem x amostrando tudo (exporter 'file' e
+'otlp', este para um coletor OTLP/HTTP local que conta os spans recebidos).
+
+    python -m benchmarks.bench_tracing --requests 1000 --latency 0.0
+
+Também mede o ns por span() aberto fora e dentro de um trace amostrado.
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.common import payment_payload, report, setup_django, summarize, test_database
+from benchmarks.stub_gateway import StubGateway
+
+
+class CollectorHandler(BaseHTTPRequestHandler):
+    """POST /v1/traces de um OpenTelemetry Collector, só contando os spans"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        for resource in body['resourceSpans']:
+            for scope in resource['scopeSpans']:
+                self.server.spans += len(scope['spans'])
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+
+class Collector(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), CollectorHandler)
+        self.spans = 0
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def endpoint(self):
+        return f"http://127.0.0.1:{self.server_port}/v1/traces"
+
+
+def ns_per_span(tracing, operations, sample_rate):
+    with tracing.start_trace('bench', sample_rate=sample_rate) as root:
+        started = time.perf_counter()
+        for _ in range(operations):
+            with tracing.span('filho'):
+                pass
+        elapsed = time.perf_counter() - started
+    root.trace.spans.clear()
+    return round(elapsed / operations * 1e9, 1)
+
+
+def measure(client, requests):
+    body = json.dumps(payment_payload(items=3))
+    posts, gets = [], []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = client.post('/api/payments/', body, content_type='application/json')
+        posts.append(time.perf_counter() - started)
+        assert response.status_code == 201, response.content
+        started = time.perf_counter()
+        client.get('/api/payments/')
+        gets.append(time.perf_counter() - started)
+    return posts, gets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.0, help='latência do stub do PagBank (s)')
+    parser.add_argument('--operations', type=int, default=100000, help='spans no micro-benchmark')
+    args = parser.parse_args()
+
+    settings = setup_django()
+    settings.PAGBANK_THROTTLE_ENABLED = False
+
+    from django.test import Client
+
+    from payments import tracing
+
+    report('tracing_span', {
+        'ns_unsampled': ns_per_span(tracing, args.operations, 0.0),
+        'ns_sampled': ns_per_span(tracing, args.operations, 1.0),
+    })
+
+    with test_database(), StubGateway(latency=args.latency) as gateway, \
+            tempfile.TemporaryDirectory() as directory:
+        settings.PAGBANK_API_URL = gateway.url
+        collector = Collector()
+        scenarios = (
+            ('disabled', False, 0.0, 'file'),
+            ('unsampled', True, 0.0, 'file'),
+            ('sampled_file', True, 1.0, 'file'),
+            ('sampled_otlp', True, 1.0, 'otlp'),
+        )
+        for name, enabled, sample_rate, exporter in scenarios:
+            settings.PAGBANK_TRACING_ENABLED = enabled
+            settings.PAGBANK_TRACE_SAMPLE_RATE = sample_rate
+            settings.PAGBANK_TRACE_EXPORTER = exporter
+            settings.PAGBANK_TRACE_FILE = os.path.join(directory, f'{name}.jsonl')
+            settings.PAGBANK_TRACE_OTLP_ENDPOINT = collector.endpoint
+            tracing._processor = None
+            tracing.stats.reset()
+
+            client = Client()
+            measure(client, 20)
+            posts, gets = measure(client, args.requests)
+            if sample_rate:
+                tracing.get_processor().flush()
+                time.sleep(0.5)
+            report(f'tracing_{name}', {
+                'post': summarize(posts),
+                'get': summarize(gets),
+                **tracing.stats.snapshot(),
+                'collector_spans': collector.spans if exporter == 'otlp' else 0,
+            })
+        collector.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Escritas no banco ao reaplicar um log de notificações com reenvios e
+entregas fora de ordem, antes e depois da deduplicação + máquina de estados.
+`writes` conta linhas gravadas; `write_statements`, os UPDATEs/INSERTs
+executados (inclusive as chaves de deduplicação em WebhookDelivery).
+
+    python -m benchmarks.bench_webhook_replay --payments 500
+
+Por pagamento o log tem: WAITING, WAITING (reenvio), PAID, WAITING (reenvio
+atrasado), PAID (reenvio) e IN_ANALYSIS (evento antigo fora de ordem).
+"""
+import argparse
+import time
+
+from benchmarks.common import count_queries, report, setup_django, test_database
+
+
+def replay_log(payment_ids):
+    log = []
+    for payment_id in payment_ids:
+        order_id = f"ORDE_{payment_id.hex[:20]}"
+        waiting = {'id': order_id, 'reference_id': str(payment_id), 'status': 'WAITING',
+                   'created_at': '2025-06-16T10:00:00-03:00'}
+        paid = {**waiting, 'status': 'PAID', 'charges': [{'paid_at': '2025-06-16T10:05:00-03:00'}]}
+        in_analysis = {**waiting, 'status': 'IN_ANALYSIS', 'updated_at': '2025-06-16T10:01:00-03:00'}
+        log += [waiting, dict(waiting), paid, dict(waiting), dict(paid), in_analysis]
+    return log
+
+
+def legacy_update_local_payment(reference_id, order_id, status):
+    """update_local_payment anterior: get + save() da linha inteira sempre"""
+    from payments.models import Payment
+    from payments.services import map_gateway_status
+
+    payment = Payment.objects.get(id=reference_id)
+    payment.mercadopago_id = order_id
+    payment.status = map_gateway_status(status)
+    payment.save()
+
+
+def run(log, apply, batch_size=None):
+    """Reaplica o log evento a evento, ou em lotes se batch_size for dado"""
+    from payments.models import Payment
+
+    Payment.objects.update(status='pending', payment_gateway_id=None)
+    items = [log[i:i + batch_size] for i in range(0, len(log), batch_size)] if batch_size else log
+    counter = {'reads': 0, 'write_statements': 0, 'writes': 0}
+    started = time.perf_counter()
+    with count_queries(counter):
+        for item in items:
+            apply(item)
+    elapsed = time.perf_counter() - started
+    approved = Payment.objects.filter(status='approved').count()
+    return {**counter, 'events': len(log), 'approved': approved,
+            'events_per_s': round(len(log) / elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--payments', type=int, default=500)
+    parser.add_argument('--batch-size', type=int, default=500, help='webhooks por process_webhooks')
+    args = parser.parse_args()
+
+    setup_django()
+
+    from payments.models import Payment, WebhookDelivery
+    from payments.services import PagBankService
+
+    service = PagBankService()
+
+    with test_database():
+        payment_ids = [
+            Payment.objects.create(amount='10.00', description='Bench', payer_email='bench@example.com').id
+            for _ in range(args.payments)
+        ]
+        log = replay_log(payment_ids)
+
+        before = run(log, lambda e: legacy_update_local_payment(e['reference_id'], e['id'], e['status']))
+        report('webhook_replay_legacy', before)
+
+        WebhookDelivery.objects.all().delete()
+        after = run(log, service.process_webhook)
+        report('webhook_replay_dedupe_state_machine', {
+            **after,
+            'writes_saved': before['writes'] - after['writes'],
+            'writes_saved_pct': round(100 * (before['writes'] - after['writes']) / before['writes'], 1),
+        })
+
+        WebhookDelivery.objects.all().delete()
+        report(f'webhook_replay_batched_{args.batch_size}',
+               run(log, service.process_webhooks, args.batch_size))
+
+
+if __name__ == '__main__':
+    main()
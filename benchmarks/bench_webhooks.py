@@ -0,0 +1,100 @@
+"""Vazão do webhook: notificações/s enfileiradas pelo endpoint e
+notificações/s aplicadas pelo worker (process_webhooks) por tamanho de lote.
+
+    python -m benchmarks.bench_webhooks --notifications 2000
+
+"inline" mede o caminho antigo: o próprio request aplica a notificação via
+PagBankService.process_webhook antes de responder.
+"""
+import argparse
+import json
+import time
+
+from benchmarks.common import report, setup_django, summarize, test_database
+
+STATUSES = ('WAITING', 'IN_ANALYSIS', 'PAID', 'CANCELED')
+
+
+def notifications(payment_ids, total):
+    for i in range(total):
+        payment_id = payment_ids[i % len(payment_ids)]
+        yield json.dumps({
+            'id': f"ORDE_{payment_id.hex[:20]}",
+            'reference_id': str(payment_id),
+            'status': STATUSES[i % len(STATUSES)],
+        })
+
+
+def ingest(view, factory, bodies):
+    latencies = []
+    started = time.perf_counter()
+    for body in bodies:
+        request = factory.post('/api/payments/webhook/', body, content_type='application/json')
+        t0 = time.perf_counter()
+        response = view(request)
+        latencies.append(time.perf_counter() - t0)
+        assert response.status_code == 200, response.status_code
+    elapsed = time.perf_counter() - started
+    return {'notifications_per_s': round(len(latencies) / elapsed, 1), **summarize(latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--notifications', type=int, default=2000)
+    parser.add_argument('--payments', type=int, default=200)
+    parser.add_argument('--batch-sizes', default='1,10,100,500')
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.http import HttpResponse
+    from rest_framework.test import APIRequestFactory
+    from rest_framework.views import APIView
+
+    from payments.models import Payment, WebhookEvent
+    from payments.services import PagBankService
+    from payments.views import PagSeguroWebhookView
+    from payments.webhook_queue import get_webhook_queue, process_batch
+
+    class InlineWebhookView(APIView):
+        """Webhook aplicando a notificação dentro do request (comportamento anterior)"""
+
+        def post(self, request):
+            result = PagBankService().process_webhook(json.loads(request.body))
+            return HttpResponse(status=200 if result['success'] else 400)
+
+    factory = APIRequestFactory()
+
+    with test_database():
+        payment_ids = [
+            Payment.objects.create(amount='10.00', description='Bench', payer_email='bench@example.com').id
+            for _ in range(args.payments)
+        ]
+        bodies = list(notifications(payment_ids, args.notifications))
+
+        report('webhook_inline', ingest(InlineWebhookView.as_view(), factory, bodies))
+        WebhookEvent.objects.all().delete()
+
+        queue = get_webhook_queue()
+        service = PagBankService()
+        for batch_size in (int(size) for size in args.batch_sizes.split(',')):
+            WebhookEvent.objects.all().delete()
+            report('webhook_enqueue', ingest(PagSeguroWebhookView.as_view(), factory, bodies))
+
+            processed = 0
+            started = time.perf_counter()
+            while True:
+                done, failed = process_batch(queue, service, batch_size, max_attempts=5)
+                if not done and not failed:
+                    break
+                processed += done
+            elapsed = time.perf_counter() - started
+            assert processed == args.notifications, processed
+            report(f'webhook_worker_batch_{batch_size}', {
+                'notifications_per_s': round(processed / elapsed, 1),
+                'processed': processed,
+            })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""Utilitários compartilhados pelos benchmarks.
+
+Os benchmarks rodam fora do test runner do Django, mas usam um banco de
+teste descartável para não tocar no db.sqlite3 de desenvolvimento.
+"""
+import json
+import logging
+import os
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def setup_django(quiet_logs=True, database=None):
+    """Inicializa o Django com os settings do projeto.
+
+    `database` aponta o banco default para outro arquivo SQLite, para que
+    servidores em subprocessos compartilhem os dados do benchmark.
+    """
+    if str(BASE_DIR) not in sys.path:
+        sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mercadopago_backend.settings')
+
+    import django
+    from django.conf import settings
+
+    if database:
+        settings.DATABASES['default']['NAME'] = database
+    django.setup()
+    # DEBUG guarda todas as queries em memória e distorce as medições
+    settings.DEBUG = False
+    settings.ALLOWED_HOSTS = ['*']
+    if quiet_logs:
+        logging.getLogger('payments').setLevel(logging.CRITICAL)
+    return settings
+
+
+@contextmanager
+def test_database():
+    """Cria um banco de teste temporário e o destrói ao final"""
+    from django.db import connection
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+@contextmanager
+def count_queries(counter):
+    """Soma em `counter` as leituras (reads), os comandos de escrita
+    (write_statements) e as linhas gravadas (writes)"""
+    from django.db import connection
+
+    def wrapper(execute, sql, params, many, context):
+        verb = sql.lstrip().split(' ', 1)[0].upper()
+        result = execute(sql, params, many, context)
+        if verb in ('INSERT', 'UPDATE', 'DELETE'):
+            counter['write_statements'] += 1
+            rowcount = context['cursor'].rowcount
+            if verb == 'INSERT' and ' RETURNING ' in sql:
+                # INSERT ... RETURNING (bulk_create) não informa rowcount no SQLite
+                rowcount = sql.split(' VALUES ', 1)[1].count('), (') + 1
+            # UPDATE condicional que não casa nenhuma linha não grava nada
+            counter['writes'] += max(rowcount, 0)
+        elif verb == 'SELECT':
+            counter['reads'] += 1
+        return result
+
+    with connection.execute_wrapper(wrapper):
+        yield
+
+
+def wait_for_port(port, host='127.0.0.1', timeout=30):
+    """Espera até um servidor aceitar conexões na porta"""
+    import socket
+    import time
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f"Servidor não respondeu na porta {port}")
+
+
+def free_port():
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, pct):
+    """Percentil por rank mais próximo"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies):
+    """Resumo de latências em milissegundos"""
+    return {
+        'count': len(latencies),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'max_ms': round(max(latencies) * 1000, 3) if latencies else 0.0,
+    }
+
+
+def report(name, results):
+    """Imprime o resultado em JSON (uma linha por benchmark)"""
+    print(json.dumps({'benchmark': name, **results}, ensure_ascii=False))
+
+
+def payment_payload(items=1, unit_price='10.00'):
+    """Payload válido para POST /api/payments/"""
+    from decimal import Decimal
+
+    total = Decimal(unit_price) * items
+    return {
+        'amount': str(total),
+        'description': 'Benchmark',
+        'payer_email': 'bench@example.com',
+        'items': [
+            {'title': f'Item {i}', 'quantity': 1, 'unit_price': unit_price}
+            for i in range(items)
+        ],
+    }
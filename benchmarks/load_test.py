@@ -0,0 +1,239 @@
+"""Teste de carga ponta a ponta, offline: o projeto (benchmarks.serve) contra o
+stub do PagBank (benchmarks.stub_gateway), cada um no seu processo.
+
+    python -m benchmarks.load_test --rps create=20,transparent=10,status=50,webhook=20 \
+        --duration 10 --latency 0.05 --output load.json
+
+Cada endpoint recebe a sua taxa fixa de requisições (carga em malha aberta:
+a requisição i sai no instante i / rps, esteja o servidor atrasado ou não,
+e a latência conta desde esse instante, então a fila do lado do cliente
+também aparece nos percentis):
+
+- create: POST /api/payments/
+- transparent: POST /api/payments/transparent/
+- status: GET /api/payments/<id>/status/ de pagamentos pré-criados
+- webhook: POST /api/payments/webhook/ com notificações v4
+
+O stub também notifica o webhook de cada ordem/cobrança criada
+(--webhook-delay). No fim a fila de webhooks é drenada com
+process_webhooks --once e os status dos pagamentos entram no resultado.
+Cada endpoint gera uma linha JSON (enviadas, vazão, p50/p95/p99, taxa de
+erro por status); --output grava tudo em um arquivo JSON. --target aponta
+para um servidor já no ar (sem subir stub nem banco). Requer aiohttp.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import uuid
+from collections import Counter
+from io import StringIO
+
+from benchmarks.bench_asgi import prepare_database, spawn
+from benchmarks.common import free_port, payment_payload, report, setup_django, summarize, wait_for_port
+
+ENDPOINTS = ('create', 'transparent', 'status', 'webhook')
+
+
+def parse_rps(value):
+    """'create=20,status=50' -> {'create': 20.0, 'status': 50.0}"""
+    rates = {}
+    for part in value.split(','):
+        name, _, rate = part.partition('=')
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"endpoint desconhecido: {name} (use {', '.join(ENDPOINTS)})")
+        rates[name] = float(rate)
+    return rates
+
+
+def build_request(endpoint, payment_ids, i):
+    """(método, path, corpo JSON) da i-ésima requisição do endpoint"""
+    if endpoint == 'create':
+        return 'POST', '/api/payments/', payment_payload(items=3)
+    if endpoint == 'transparent':
+        return 'POST', '/api/payments/transparent/', {
+            'payment': payment_payload(items=1),
+            'card': {
+                'encrypted_card': 'stub-encrypted-card',
+                'security_code': '123',
+                'holder_name': 'Cliente Carga',
+                'holder_cpf': '12345678909',
+            },
+        }
+    payment_id = payment_ids[i % len(payment_ids)]
+    if endpoint == 'status':
+        return 'GET', f'/api/payments/{payment_id}/status/', None
+    return 'POST', '/api/payments/webhook/', {
+        'id': f'ORDE_LOAD_{uuid.uuid4().hex[:12].upper()}',
+        'reference_id': payment_id,
+        'status': 'PAID',
+    }
+
+
+async def drive(base_url, rates, duration, payment_ids, concurrency, timeout):
+    import aiohttp
+
+    results = {endpoint: {'latencies': [], 'statuses': Counter()} for endpoint in rates}
+    # Limita as conexões abertas; quem espera por uma vaga conta na latência
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+
+    async with aiohttp.ClientSession(base_url=base_url, connector=connector, timeout=client_timeout) as client:
+        async def one(endpoint, i, scheduled):
+            method, path, body = build_request(endpoint, payment_ids, i)
+            async with semaphore:
+                try:
+                    async with client.request(method, path, json=body) as response:
+                        await response.read()
+                    status = str(response.status)
+                except asyncio.TimeoutError:
+                    status = 'timeout'
+                except aiohttp.ClientError:
+                    status = 'connection_error'
+            results[endpoint]['latencies'].append(time.perf_counter() - scheduled)
+            results[endpoint]['statuses'][status] += 1
+
+        async def generate(endpoint, rate):
+            tasks = []
+            for i in range(int(rate * duration)):
+                scheduled = started + i / rate
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(one(endpoint, i, scheduled)))
+            await asyncio.gather(*tasks)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(generate(endpoint, rate) for endpoint, rate in rates.items()))
+        elapsed = time.perf_counter() - started
+
+    return results, elapsed
+
+
+def summarize_endpoint(result, rate, elapsed):
+    statuses = result['statuses']
+    sent = sum(statuses.values())
+    errors = sum(count for status, count in statuses.items() if not status.startswith('2'))
+    return {
+        'target_rps': rate,
+        'sent': sent,
+        'throughput_rps': round((sent - errors) / elapsed, 1),
+        'errors': errors,
+        'error_rate': round(errors / sent, 4) if sent else 0.0,
+        'statuses': dict(statuses),
+        **summarize(result['latencies']),
+    }
+
+
+def get_json(url):
+    import urllib.request
+
+    with urllib.request.urlopen(url) as response:
+        return json.loads(response.read())
+
+
+def drain_webhooks():
+    """Aplica a fila de webhooks (como o worker) e conta os pagamentos por status"""
+    from django.core.management import call_command
+    from django.db.models import Count
+
+    from payments.models import Payment
+
+    started = time.perf_counter()
+    call_command('process_webhooks', '--once', stdout=StringIO())
+    return {
+        'drain_seconds': round(time.perf_counter() - started, 2),
+        'payments_by_status': dict(Payment.objects.values_list('status').annotate(count=Count('id'))),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rps', type=parse_rps, default='create=20,transparent=10,status=50,webhook=20',
+                        help='requisições/s por endpoint (create, transparent, status, webhook)')
+    parser.add_argument('--duration', type=float, default=10.0, help='segundos de carga')
+    parser.add_argument('--concurrency', type=int, default=256, help='conexões abertas no máximo')
+    parser.add_argument('--timeout', type=float, default=30.0, help='timeout por requisição (s)')
+    parser.add_argument('--mode', choices=('wsgi', 'asgi'), default='wsgi')
+    parser.add_argument('--threads', type=int, default=8, help='threads do servidor WSGI')
+    parser.add_argument('--latency', type=float, default=0.05, help='latência do stub do PagBank (s)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fração de respostas de erro do stub')
+    parser.add_argument('--error-status', type=int, default=502)
+    parser.add_argument('--webhook-delay', type=float, default=0.5, help='atraso das notificações do stub (s)')
+    parser.add_argument('--payments', type=int, default=100, help='pagamentos pré-criados para status/webhook')
+    parser.add_argument('--setting', action='append', default=[], metavar='NOME=VALOR',
+                        help='repassado ao servidor (ex.: PAGBANK_SHED_MAX_CONCURRENCY=16)')
+    parser.add_argument('--target', help='URL de um servidor já no ar (status/webhook usam --payment-ids)')
+    parser.add_argument('--payment-ids', default='', help='ids separados por vírgula, com --target')
+    parser.add_argument('--output', help='grava configuração e resultados neste arquivo JSON')
+    args = parser.parse_args()
+
+    config = {key: value for key, value in vars(args).items() if key != 'output'}
+    output = {'config': config, 'results': {}}
+
+    def emit(name, results):
+        report(name, results)
+        output['results'][name] = results
+
+    processes = []
+    database = None
+    try:
+        if args.target:
+            base_url = args.target.rstrip('/')
+            payment_ids = [value for value in args.payment_ids.split(',') if value]
+            if not payment_ids and {'status', 'webhook'} & set(args.rps):
+                parser.error('status/webhook com --target precisam de --payment-ids')
+        else:
+            fd, database = tempfile.mkstemp(suffix='.sqlite3')
+            os.close(fd)
+            setup_django(database=database)
+            payment_ids = prepare_database(database, args.payments)
+
+            port, gateway_port = free_port(), free_port()
+            base_url = f"http://127.0.0.1:{port}"
+            processes.append(spawn(
+                'benchmarks.stub_gateway', '--port', str(gateway_port), '--latency', str(args.latency),
+                '--error-rate', str(args.error_rate), '--error-status', str(args.error_status),
+                '--webhook-url', f"{base_url}/api/payments/webhook/", '--webhook-delay', str(args.webhook_delay),
+            ))
+            settings = ['PAGBANK_THROTTLE_ENABLED=False', *args.setting]
+            processes.append(spawn(
+                'benchmarks.serve', '--mode', args.mode, '--port', str(port), '--database', database,
+                '--gateway-url', f"http://127.0.0.1:{gateway_port}", '--threads', str(args.threads),
+                *(value for setting in settings for value in ('--setting', setting)),
+            ))
+            wait_for_port(gateway_port)
+            wait_for_port(port)
+
+        results, elapsed = asyncio.run(
+            drive(base_url, args.rps, args.duration, payment_ids, args.concurrency, args.timeout)
+        )
+        for endpoint, rate in args.rps.items():
+            emit(f'load_{endpoint}', summarize_endpoint(results[endpoint], rate, elapsed))
+        emit('load_total', summarize_endpoint({
+            'latencies': [value for result in results.values() for value in result['latencies']],
+            'statuses': sum((result['statuses'] for result in results.values()), Counter()),
+        }, sum(args.rps.values()), elapsed))
+
+        if not args.target:
+            # Espera as últimas notificações do stub antes de drenar a fila
+            time.sleep(args.webhook_delay + 0.5)
+            emit('load_stub', get_json(f"http://127.0.0.1:{gateway_port}/_stub/stats"))
+            emit('load_webhooks', drain_webhooks())
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        if database:
+            os.unlink(database)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(output, output_file, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
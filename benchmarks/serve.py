@@ -0,0 +1,86 @@
+"""Sobe o projeto em um processo próprio para os benchmarks HTTP.
+
+    python -m benchmarks.serve --mode asgi --port 8001 --database /tmp/bench.sqlite3 \
+        --gateway-url http://127.0.0.1:8999
+
+--mode wsgi usa um pool fixo de threads (como um worker gthread do gunicorn);
+--mode asgi roda um único event loop no uvicorn com as views async.
+"""
+import argparse
+import ast
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import setup_django
+
+
+def serve_wsgi(port, threads):
+    from django.core.handlers.wsgi import WSGIHandler
+    from django.core.servers.basehttp import WSGIRequestHandler, WSGIServer
+
+    executor = ThreadPoolExecutor(max_workers=threads)
+
+    class Server(WSGIServer):
+        """Atende cada conexão em um pool fixo de threads"""
+        request_queue_size = 1024
+
+        def process_request(self, request, client_address):
+            executor.submit(self.process_request_thread, request, client_address)
+
+        def process_request_thread(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    server = Server(('127.0.0.1', port), WSGIRequestHandler)
+    server.set_app(WSGIHandler())
+    server.serve_forever()
+
+
+def serve_asgi(port):
+    import uvicorn
+    from django.core.asgi import get_asgi_application
+
+    uvicorn.run(
+        get_asgi_application(), host='127.0.0.1', port=port,
+        log_level='warning', lifespan='off', backlog=2048,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor do projeto para benchmarks')
+    parser.add_argument('--mode', choices=('wsgi', 'asgi'), required=True)
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--database', required=True)
+    parser.add_argument('--gateway-url', required=True)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--setting', action='append', default=[], metavar='NOME=VALOR',
+                        help='sobrescreve um setting (valor literal Python ou texto)')
+    args = parser.parse_args()
+
+    settings = setup_django(database=args.database)
+    settings.PAGBANK_API_URL = args.gateway_url
+    settings.PAGBANK_ASYNC_VIEWS = args.mode == 'asgi'
+    for override in args.setting:
+        name, value = override.split('=', 1)
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            pass
+        setattr(settings, name, value)
+    logging.getLogger('django.server').setLevel(logging.CRITICAL)
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)
+    # a ClientSession do app vive até o fim do processo, como num worker real
+    logging.getLogger('asyncio').setLevel(logging.CRITICAL)
+
+    if args.mode == 'wsgi':
+        serve_wsgi(args.port, args.threads)
+    else:
+        serve_asgi(args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""Servidor stub local que imita os endpoints usados da API PagBank v4.
+
+Uso:
+    with StubGateway(latency=0.005) as gateway:
+        settings.PAGBANK_API_URL = gateway.url
+
+ou, em um processo separado:
+    python -m benchmarks.stub_gateway --port 8999 --latency 0.05
+
+Com `webhook_url`, cada ordem ou cobrança criada gera, `webhook_delay`
+segundos depois, a notificação v4 (id, reference_id e `webhook_status`)
+enviada por uma thread, como o PagBank faz para as notification_urls.
+GET /_stub/stats devolve os contadores (para geradores de carga em outro
+processo).
+"""
+import argparse
+import json
+import queue
+import random
+import threading
+import time
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubGatewayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.gateway.record_connection()
+
+    def _send_json(self, status_code, data, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _dispatch(self, method):
+        gateway = self.server.gateway
+        payload = self._read_json() if method == 'POST' else {}
+        if method == 'GET' and self.path == '/_stub/stats':
+            return self._send_json(200, gateway.stats())
+        gateway.record_request(method, self.path)
+
+        retry_after = gateway.throttle()
+        if retry_after is not None:
+            return self._send_json(429, {
+                'error_messages': [{'code': 'rate_limit', 'description': 'Too many requests'}]
+            }, {'Retry-After': str(retry_after)})
+
+        if gateway.latency:
+            time.sleep(gateway.latency)
+
+        if gateway.error_rate and random.random() < gateway.error_rate:
+            return self._send_json(gateway.error_status, {
+                'error_messages': [{'code': 'stub_error', 'description': 'Erro injetado'}]
+            })
+
+        if method == 'POST' and self.path == '/orders':
+            order_id = f"ORDE_{uuid.uuid4().hex[:12].upper()}"
+            gateway.notify(order_id, payload.get('reference_id'))
+            return self._send_json(201, {
+                'id': order_id,
+                'reference_id': payload.get('reference_id'),
+                'status': 'WAITING',
+                'links': [{'rel': 'PAY', 'href': f"{gateway.url}/orders/{order_id}/pay"}],
+            })
+        if method == 'POST' and self.path == '/charges':
+            charge_id = f"CHAR_{uuid.uuid4().hex[:12].upper()}"
+            gateway.notify(charge_id, payload.get('reference_id'))
+            return self._send_json(201, {
+                'id': charge_id,
+                'reference_id': payload.get('reference_id'),
+                'status': 'PAID',
+                'amount': payload.get('amount', {}),
+                'payment_response': {'code': '20000', 'message': 'SUCESSO'},
+            })
+        if method == 'GET' and self.path.startswith('/orders/'):
+            return self._send_json(200, {
+                'id': self.path.rsplit('/', 1)[-1],
+                'status': gateway.order_status,
+            })
+        if method == 'GET' and self.path == '/public-keys':
+            return self._send_json(200, {'public_key': 'stub', 'created_at': int(time.time())})
+
+        return self._send_json(404, {'error_messages': [{'code': 'not_found', 'description': self.path}]})
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+
+class StubGatewayServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class StubGateway:
+    """Gateway falso rodando em uma thread, com latência e erros configuráveis"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0,
+                 error_status=502, order_status='WAITING', rate_limit=0,
+                 webhook_url=None, webhook_delay=0.0, webhook_status='PAID'):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.order_status = order_status
+        # Requisições/s aceitas (janelas de 1s) antes de responder 429; 0 = sem limite
+        self.rate_limit = rate_limit
+        self.webhook_url = webhook_url
+        self.webhook_delay = webhook_delay
+        self.webhook_status = webhook_status
+        self.connections = 0
+        self.requests = 0
+        self.throttled = 0
+        self.webhooks_sent = 0
+        self.webhooks_failed = 0
+        # (horário de envio, corpo); o atraso é fixo, então a fila já sai em ordem
+        self._webhooks = queue.Queue()
+        self._window = (0, 0)
+        self._lock = threading.Lock()
+
+        self.server = StubGatewayServer((host, port), StubGatewayHandler)
+        self.server.gateway = self
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self._thread = None
+
+    def record_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def record_request(self, method, path):
+        with self._lock:
+            self.requests += 1
+
+    def throttle(self):
+        """Segundos do Retry-After se a requisição passa do limite, senão None"""
+        if not self.rate_limit:
+            return None
+        now = time.time()
+        with self._lock:
+            window, count = self._window
+            if window != int(now):
+                window, count = int(now), 0
+            self._window = (window, count + 1)
+            if count < self.rate_limit:
+                return None
+            self.throttled += 1
+        return 1
+
+    def notify(self, resource_id, reference_id):
+        """Agenda a notificação do recurso criado (se houver webhook_url)"""
+        if self.webhook_url and reference_id:
+            body = json.dumps({'id': resource_id, 'reference_id': reference_id, 'status': self.webhook_status})
+            self._webhooks.put((time.monotonic() + self.webhook_delay, body.encode()))
+
+    def _send_webhooks(self):
+        while True:
+            due, body = self._webhooks.get()
+            time.sleep(max(0.0, due - time.monotonic()))
+            request = urllib.request.Request(
+                self.webhook_url, body, {'Content-Type': 'application/json'}, method='POST'
+            )
+            try:
+                with urllib.request.urlopen(request, timeout=10) as response:
+                    response.read()
+            except OSError:
+                with self._lock:
+                    self.webhooks_failed += 1
+            else:
+                with self._lock:
+                    self.webhooks_sent += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'connections': self.connections,
+                'requests': self.requests,
+                'throttled': self.throttled,
+                'webhooks_sent': self.webhooks_sent,
+                'webhooks_failed': self.webhooks_failed,
+                'webhooks_pending': self._webhooks.qsize(),
+            }
+
+    def reset_counters(self):
+        with self._lock:
+            self.connections = 0
+            self.requests = 0
+            self.throttled = 0
+            self.webhooks_sent = 0
+            self.webhooks_failed = 0
+            self._window = (0, 0)
+
+    def start_webhooks(self):
+        if self.webhook_url:
+            threading.Thread(target=self._send_webhooks, name='stub-webhooks', daemon=True).start()
+
+    def start(self):
+        self.start_webhooks()
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stub local da API PagBank v4')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8999)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=502)
+    parser.add_argument('--rate-limit', type=int, default=0, help='requisições/s antes de 429')
+    parser.add_argument('--order-status', default='WAITING', help='status devolvido em GET /orders/<id>')
+    parser.add_argument('--webhook-url', help='recebe a notificação de cada ordem/cobrança criada')
+    parser.add_argument('--webhook-delay', type=float, default=0.0)
+    parser.add_argument('--webhook-status', default='PAID')
+    args = parser.parse_args()
+
+    gateway = StubGateway(
+        args.host, args.port, args.latency, args.error_rate, args.error_status, args.order_status,
+        args.rate_limit, args.webhook_url, args.webhook_delay, args.webhook_status,
+    )
+    print(f"Stub PagBank em {gateway.url}", flush=True)
+    gateway.start_webhooks()
+    try:
+        gateway.server.serve_forever()
+    except KeyboardInterrupt:
+        gateway.server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -27,7 +27,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'payments.tracing.TracingMiddleware',
+    'payments.profiling.ProfilingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    'payments.metrics.MetricsMiddleware',
+    'payments.load_shedding.LoadSheddingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -154,6 +158,167 @@ PAGBANK_NOTIFICATION_URL = get_payment_config(
 PAGBANK_TIMEOUT = config('PAGBANK_TIMEOUT', default=30, cast=int)
 PAGBANK_MAX_RETRIES = config('PAGBANK_MAX_RETRIES', default=3, cast=int)
 
+# URL base alternativa (ex.: servidor stub local para benchmarks)
+PAGBANK_API_URL = config('PAGBANK_API_URL', default='')
+
+# Pool de conexões HTTP com o PagBank (Session compartilhada por processo)
+PAGBANK_CONNECT_TIMEOUT = config('PAGBANK_CONNECT_TIMEOUT', default=5, cast=float)
+PAGBANK_POOL_CONNECTIONS = config('PAGBANK_POOL_CONNECTIONS', default=10, cast=int)
+PAGBANK_POOL_MAXSIZE = config('PAGBANK_POOL_MAXSIZE', default=20, cast=int)
+PAGBANK_POOL_BLOCK = config('PAGBANK_POOL_BLOCK', default=False, cast=bool)
+PAGBANK_KEEP_ALIVE = config('PAGBANK_KEEP_ALIVE', default=True, cast=bool)
+
+# Retry com backoff exponencial + full jitter (PAGBANK_MAX_RETRIES acima)
+PAGBANK_RETRY_BASE_DELAY = config('PAGBANK_RETRY_BASE_DELAY', default=0.1, cast=float)
+PAGBANK_RETRY_MAX_DELAY = config('PAGBANK_RETRY_MAX_DELAY', default=2.0, cast=float)
+# Orçamento: retries limitados a ~20% das chamadas bem-sucedidas (+1/s mínimo),
+# começando com uma reserva pequena
+PAGBANK_RETRY_BUDGET_RATIO = config('PAGBANK_RETRY_BUDGET_RATIO', default=0.2, cast=float)
+PAGBANK_RETRY_BUDGET_MIN_PER_SECOND = config('PAGBANK_RETRY_BUDGET_MIN_PER_SECOND', default=1.0, cast=float)
+PAGBANK_RETRY_BUDGET_INITIAL_TOKENS = config('PAGBANK_RETRY_BUDGET_INITIAL_TOKENS', default=1.0, cast=float)
+
+# Circuit breaker por endpoint (/orders, /charges, /orders/{id})
+# Backend: 'local' (por processo), 'cache' (CACHES compartilhado) ou caminho pontuado
+PAGBANK_BREAKER_BACKEND = config('PAGBANK_BREAKER_BACKEND', default='local')
+PAGBANK_BREAKER_CACHE_ALIAS = config('PAGBANK_BREAKER_CACHE_ALIAS', default='default')
+PAGBANK_BREAKER_FAILURE_RATE = config('PAGBANK_BREAKER_FAILURE_RATE', default=0.5, cast=float)
+PAGBANK_BREAKER_SLOW_CALL_SECONDS = config('PAGBANK_BREAKER_SLOW_CALL_SECONDS', default=5.0, cast=float)
+PAGBANK_BREAKER_SLOW_CALL_RATE = config('PAGBANK_BREAKER_SLOW_CALL_RATE', default=0.8, cast=float)
+PAGBANK_BREAKER_MINIMUM_CALLS = config('PAGBANK_BREAKER_MINIMUM_CALLS', default=10, cast=int)
+PAGBANK_BREAKER_WINDOW_SECONDS = config('PAGBANK_BREAKER_WINDOW_SECONDS', default=30, cast=int)
+PAGBANK_BREAKER_OPEN_SECONDS = config('PAGBANK_BREAKER_OPEN_SECONDS', default=15, cast=int)
+
+# Limite de chamadas ao PagBank por família de endpoint (chamadas/s; 0 = sem
+# limite). Acima do limite a chamada espera até PAGBANK_RATE_LIMIT_MAX_WAIT
+# segundos, senão é recusada (503); um 429 com Retry-After pausa a família.
+# Backend: 'local' (por processo), 'cache' (compartilhado) ou caminho pontuado
+PAGBANK_RATE_LIMIT_BACKEND = config('PAGBANK_RATE_LIMIT_BACKEND', default='local')
+PAGBANK_RATE_LIMIT_CACHE_ALIAS = config('PAGBANK_RATE_LIMIT_CACHE_ALIAS', default='default')
+PAGBANK_RATE_LIMIT_ORDERS = config('PAGBANK_RATE_LIMIT_ORDERS', default=0.0, cast=float)
+PAGBANK_RATE_LIMIT_CHARGES = config('PAGBANK_RATE_LIMIT_CHARGES', default=0.0, cast=float)
+PAGBANK_RATE_LIMIT_READS = config('PAGBANK_RATE_LIMIT_READS', default=0.0, cast=float)
+# Rajada permitida, em segundos de limite acumulados
+PAGBANK_RATE_LIMIT_BURST_SECONDS = config('PAGBANK_RATE_LIMIT_BURST_SECONDS', default=1.0, cast=float)
+PAGBANK_RATE_LIMIT_MAX_WAIT = config('PAGBANK_RATE_LIMIT_MAX_WAIT', default=2.0, cast=float)
+
+# Limite de requisições recebidas (formato do DRF: '60/min'; vazio = sem limite).
+# 'reads': listagem e status; 'writes': criação de pagamentos. Por cliente (IP)
+# e global; contadores no cache PAGBANK_THROTTLE_CACHE_ALIAS (Redis/Memcached
+# para valer entre processos)
+PAGBANK_THROTTLE_ENABLED = config('PAGBANK_THROTTLE_ENABLED', default=True, cast=bool)
+PAGBANK_THROTTLE_CACHE_ALIAS = config('PAGBANK_THROTTLE_CACHE_ALIAS', default='default')
+PAGBANK_THROTTLE_CLIENT_READS = config('PAGBANK_THROTTLE_CLIENT_READS', default='600/min')
+PAGBANK_THROTTLE_CLIENT_WRITES = config('PAGBANK_THROTTLE_CLIENT_WRITES', default='60/min')
+PAGBANK_THROTTLE_GLOBAL_READS = config('PAGBANK_THROTTLE_GLOBAL_READS', default='')
+PAGBANK_THROTTLE_GLOBAL_WRITES = config('PAGBANK_THROTTLE_GLOBAL_WRITES', default='')
+
+# Descarte de carga: no máximo MAX_CONCURRENCY requisições em andamento por
+# processo (0 = desligado); as últimas RESERVED vagas ficam para o webhook e
+# os health checks, o resto recebe 503 com Retry-After
+PAGBANK_SHED_MAX_CONCURRENCY = config('PAGBANK_SHED_MAX_CONCURRENCY', default=0, cast=int)
+PAGBANK_SHED_RESERVED = config('PAGBANK_SHED_RESERVED', default=2, cast=int)
+PAGBANK_SHED_RETRY_AFTER = config('PAGBANK_SHED_RETRY_AFTER', default=1, cast=int)
+
+# GET /api/metrics/ (formato texto do Prometheus). Com vários processos, aponte
+# PAGBANK_METRICS_DIR para um diretório local compartilhado pelos workers (limpo
+# a cada deploy); sem ele cada processo expõe só as próprias métricas.
+# Com PAGBANK_METRICS_TOKEN o endpoint exige 'Authorization: Bearer <token>'
+PAGBANK_METRICS_ENABLED = config('PAGBANK_METRICS_ENABLED', default=True, cast=bool)
+PAGBANK_METRICS_DIR = config('PAGBANK_METRICS_DIR', default='')
+PAGBANK_METRICS_FLUSH_INTERVAL = config('PAGBANK_METRICS_FLUSH_INTERVAL', default=5.0, cast=float)
+PAGBANK_METRICS_TOKEN = config('PAGBANK_METRICS_TOKEN', default='')
+
+# Tracing: todo request ganha um trace id (header X-Trace-Id, traceparent nas
+# chamadas ao PagBank e trace_id nos logs), mas só SAMPLE_RATE (0 a 1) deles
+# guardam spans, exportados por uma thread para 'file' (JSON por linha em
+# PAGBANK_TRACE_FILE), 'otlp' (OTLP/HTTP JSON) ou um caminho pontuado
+PAGBANK_TRACING_ENABLED = config('PAGBANK_TRACING_ENABLED', default=True, cast=bool)
+PAGBANK_TRACE_SAMPLE_RATE = config('PAGBANK_TRACE_SAMPLE_RATE', default=0.0, cast=float)
+# Aceita o flag sampled do traceparent recebido (só atrás de um proxy/gateway
+# confiável); desligado, o trace id é mantido e a amostragem segue SAMPLE_RATE
+PAGBANK_TRACE_TRUST_INBOUND_SAMPLED = config('PAGBANK_TRACE_TRUST_INBOUND_SAMPLED', default=False, cast=bool)
+PAGBANK_TRACE_EXPORTER = config('PAGBANK_TRACE_EXPORTER', default='file')
+PAGBANK_TRACE_FILE = config('PAGBANK_TRACE_FILE', default=str(BASE_DIR / 'logs' / 'traces.jsonl'))
+PAGBANK_TRACE_OTLP_ENDPOINT = config('PAGBANK_TRACE_OTLP_ENDPOINT', default='http://127.0.0.1:4318/v1/traces')
+PAGBANK_TRACE_SERVICE_NAME = config('PAGBANK_TRACE_SERVICE_NAME', default='pagbank-api')
+
+# Profiling (opt-in): SAMPLE_RATE das requisições em PATH_PREFIX rodam sob o
+# cProfile, e toda requisição acima de SLOW_MS (0 = desligado) é guardada com
+# suas queries e chamadas ao PagBank. Os últimos BUFFER_SIZE perfis ficam no
+# cache CACHE_ALIAS e são lidos por staff em GET /api/profiles/ (com o LocMemCache
+# padrão, cada processo tem o seu buffer: use um cache compartilhado com vários workers)
+PAGBANK_PROFILING_ENABLED = config('PAGBANK_PROFILING_ENABLED', default=False, cast=bool)
+PAGBANK_PROFILE_SAMPLE_RATE = config('PAGBANK_PROFILE_SAMPLE_RATE', default=0.01, cast=float)
+PAGBANK_PROFILE_PATH_PREFIX = config('PAGBANK_PROFILE_PATH_PREFIX', default='/api/payments/')
+PAGBANK_PROFILE_SLOW_MS = config('PAGBANK_PROFILE_SLOW_MS', default=1000, cast=int)
+PAGBANK_PROFILE_BUFFER_SIZE = config('PAGBANK_PROFILE_BUFFER_SIZE', default=50, cast=int)
+PAGBANK_PROFILE_CACHE_ALIAS = config('PAGBANK_PROFILE_CACHE_ALIAS', default='default')
+PAGBANK_PROFILE_TOP_FUNCTIONS = config('PAGBANK_PROFILE_TOP_FUNCTIONS', default=30, cast=int)
+
+# Deploy ASGI: views async de pagamento + cliente aiohttp (AsyncPagBankService)
+PAGBANK_ASYNC_VIEWS = config('PAGBANK_ASYNC_VIEWS', default=False, cast=bool)
+PAGBANK_ASYNC_MAX_CONNECTIONS = config('PAGBANK_ASYNC_MAX_CONNECTIONS', default=200, cast=int)
+PAGBANK_ASYNC_KEEPALIVE_TIMEOUT = config('PAGBANK_ASYNC_KEEPALIVE_TIMEOUT', default=30, cast=float)
+
+# POST /api/payments/bulk/: limite por requisição e ordens criadas em paralelo
+PAGBANK_BULK_MAX_PAYMENTS = config('PAGBANK_BULK_MAX_PAYMENTS', default=1000, cast=int)
+PAGBANK_BULK_CONCURRENCY = config('PAGBANK_BULK_CONCURRENCY', default=10, cast=int)
+
+# Cache de GET /api/payments/<id>/status/: TTL curto para pendentes, longo para os
+# demais (invalidados pelos webhooks); polls simultâneos fazem uma só consulta
+PAGBANK_STATUS_CACHE_ENABLED = config('PAGBANK_STATUS_CACHE_ENABLED', default=True, cast=bool)
+PAGBANK_STATUS_CACHE_ALIAS = config('PAGBANK_STATUS_CACHE_ALIAS', default='default')
+PAGBANK_STATUS_CACHE_TTL = config('PAGBANK_STATUS_CACHE_TTL', default=5, cast=int)
+PAGBANK_STATUS_CACHE_FINAL_TTL = config('PAGBANK_STATUS_CACHE_FINAL_TTL', default=3600, cast=int)
+
+# Long-poll (/status/wait/) e SSE (/events/) de mudanças de status.
+# Backend entre processos: 'database' (consulta periódica aos pagamentos
+# assinados), 'local' (só o processo) ou caminho pontuado para outro backend
+PAGBANK_STATUS_EVENTS_BACKEND = config('PAGBANK_STATUS_EVENTS_BACKEND', default='database')
+PAGBANK_STATUS_EVENTS_POLL_INTERVAL = config('PAGBANK_STATUS_EVENTS_POLL_INTERVAL', default=1.0, cast=float)
+PAGBANK_STATUS_LONG_POLL_TIMEOUT = config('PAGBANK_STATUS_LONG_POLL_TIMEOUT', default=30, cast=int)
+PAGBANK_STATUS_STREAM_TIMEOUT = config('PAGBANK_STATUS_STREAM_TIMEOUT', default=300, cast=int)
+PAGBANK_STATUS_STREAM_HEARTBEAT = config('PAGBANK_STATUS_STREAM_HEARTBEAT', default=15, cast=int)
+
+# Fecha a conexão com o banco enquanto espera o PagBank (criação de pagamentos)
+PAGBANK_RELEASE_DB_CONNECTION = config('PAGBANK_RELEASE_DB_CONNECTION', default=True, cast=bool)
+
+# Idempotency-Key em POST /api/payments/ e /api/payments/transparent/
+# Respostas guardadas por PAGBANK_IDEMPOTENCY_TTL; uma requisição travada há mais
+# que PAGBANK_IDEMPOTENCY_LOCK_TIMEOUT (worker morto) pode ser retomada por um retry.
+# O padrão cobre a pior chamada ao PagBank (PAGBANK_TIMEOUT em cada tentativa e
+# o backoff máximo entre elas) com 30 s de folga
+PAGBANK_IDEMPOTENCY_TTL = config('PAGBANK_IDEMPOTENCY_TTL', default=86400, cast=int)
+PAGBANK_IDEMPOTENCY_LOCK_TIMEOUT = config(
+    'PAGBANK_IDEMPOTENCY_LOCK_TIMEOUT',
+    default=int(
+        PAGBANK_TIMEOUT * (PAGBANK_MAX_RETRIES + 1) + PAGBANK_RETRY_MAX_DELAY * PAGBANK_MAX_RETRIES
+    ) + 30,
+    cast=int
+)
+
+# Fila de webhooks: o endpoint só enfileira; `manage.py process_webhooks` aplica
+# Backend: 'database' (tabela WebhookEvent) ou caminho pontuado
+PAGBANK_WEBHOOK_QUEUE_BACKEND = config('PAGBANK_WEBHOOK_QUEUE_BACKEND', default='database')
+PAGBANK_WEBHOOK_BATCH_SIZE = config('PAGBANK_WEBHOOK_BATCH_SIZE', default=100, cast=int)
+PAGBANK_WEBHOOK_POLL_INTERVAL = config('PAGBANK_WEBHOOK_POLL_INTERVAL', default=1.0, cast=float)
+PAGBANK_WEBHOOK_MAX_ATTEMPTS = config('PAGBANK_WEBHOOK_MAX_ATTEMPTS', default=5, cast=int)
+# Eventos reservados há mais tempo que isso (worker morto) voltam para a fila
+PAGBANK_WEBHOOK_VISIBILITY_TIMEOUT = config('PAGBANK_WEBHOOK_VISIBILITY_TIMEOUT', default=300, cast=int)
+# Deduplicação de reenvios por (id no gateway, status, timestamp do evento),
+# na tabela WebhookDelivery; `manage.py purge_webhook_deliveries` remove as
+# chaves mais antigas que o TTL
+PAGBANK_WEBHOOK_DEDUPE_TTL = config('PAGBANK_WEBHOOK_DEDUPE_TTL', default=86400, cast=int)
+
+# `manage.py reconcile_payments`: pendentes criados há mais de MIN_AGE segundos
+# são consultados no PagBank em blocos, no limite de PAGBANK_RATE_LIMIT_READS
+PAGBANK_RECONCILE_MIN_AGE = config('PAGBANK_RECONCILE_MIN_AGE', default=900, cast=int)
+PAGBANK_RECONCILE_CHUNK_SIZE = config('PAGBANK_RECONCILE_CHUNK_SIZE', default=200, cast=int)
+PAGBANK_RECONCILE_CONCURRENCY = config('PAGBANK_RECONCILE_CONCURRENCY', default=10, cast=int)
+PAGBANK_RECONCILE_CHECKPOINT = config(
+    'PAGBANK_RECONCILE_CHECKPOINT', default=str(BASE_DIR / '.reconcile_checkpoint.json')
+)
+
 # ===============================
 # COMPATIBILIDADE REVERSA (manter código antigo funcionando)
 # ===============================
@@ -174,6 +339,13 @@ PAGSEGURO_NOTIFICATION_URL = PAGBANK_NOTIFICATION_URL
 log_dir = BASE_DIR / 'logs'
 log_dir.mkdir(exist_ok=True)
 
+# Arquivo em JSON (um objeto por linha), gravado por uma thread a partir de uma
+# fila em memória; só PAYLOAD_SAMPLE_RATE (0 a 1) dos payloads enviados e
+# recebidos do PagBank são registrados em INFO. Cartão e tax_id são mascarados
+PAGBANK_LOG_JSON = config('PAGBANK_LOG_JSON', default=True, cast=bool)
+PAGBANK_LOG_QUEUE_SIZE = config('PAGBANK_LOG_QUEUE_SIZE', default=10000, cast=int)
+PAGBANK_LOG_PAYLOAD_SAMPLE_RATE = config('PAGBANK_LOG_PAYLOAD_SAMPLE_RATE', default=1.0, cast=float)
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -186,16 +358,31 @@ LOGGING = {
             'format': '{levelname} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'payments.structured_logging.JsonFormatter',
+        },
+    },
+    'filters': {
+        'payload_sample': {
+            '()': 'payments.structured_logging.PayloadSampleFilter',
+            'rate': PAGBANK_LOG_PAYLOAD_SAMPLE_RATE,
+        },
+        'trace_context': {
+            '()': 'payments.tracing.TraceContextFilter',
+        },
     },
     'handlers': {
         'console': {
             'class': 'logging.StreamHandler',
             'formatter': 'verbose' if DEBUG else 'simple',
+            'filters': ['payload_sample', 'trace_context'],
         },
         'file': {
-            'class': 'logging.FileHandler',
+            '()': 'payments.structured_logging.QueueFileHandler',
             'filename': log_dir / 'pagbank.log',
-            'formatter': 'verbose',
+            'queue_size': PAGBANK_LOG_QUEUE_SIZE,
+            'formatter': 'json' if PAGBANK_LOG_JSON else 'verbose',
+            'filters': ['payload_sample', 'trace_context'],
         },
     },
     'loggers': {
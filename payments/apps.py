@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class PaymentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'payments'
+
+    def ready(self):
+        from .metrics import install_query_timer
+        from .profiling import install_query_recorder
+        from .tracing import install_query_tracer
+
+        # Conta queries e tempo de banco por rota (MetricsMiddleware)
+        connection_created.connect(install_query_timer, dispatch_uid='payments.metrics.query_timer')
+        # Um span por query nos traces amostrados (TracingMiddleware)
+        connection_created.connect(install_query_tracer, dispatch_uid='payments.tracing.query_tracer')
+        # SQL das requisições capturadas pelo ProfilingMiddleware
+        connection_created.connect(install_query_recorder, dispatch_uid='payments.profiling.query_recorder')
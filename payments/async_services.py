@@ -0,0 +1,202 @@
+import asyncio
+import json
+import logging
+import time
+import weakref
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .circuit_breaker import CircuitOpenError, get_breaker
+from .http_client import get_timeout
+from .metrics import record_gateway_call
+from .rate_limit import RateLimitExceeded, get_rate_limiter
+from .services import CIRCUIT_ENDPOINTS, RATE_LIMIT_FAMILIES, PagBankService
+from .structured_logging import Payload
+from .tracing import span, trace_headers, traced
+
+logger = logging.getLogger(__name__)
+
+# Uma ClientSession (pool de conexões) por event loop do processo
+_sessions = weakref.WeakKeyDictionary()
+
+
+def get_async_session():
+    """Retorna a ClientSession compartilhada do event loop atual"""
+    if aiohttp is None:
+        raise ImproperlyConfigured("AsyncPagBankService requer aiohttp (pip install aiohttp)")
+
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(
+            limit=getattr(settings, 'PAGBANK_ASYNC_MAX_CONNECTIONS', 200),
+            keepalive_timeout=getattr(settings, 'PAGBANK_ASYNC_KEEPALIVE_TIMEOUT', 30),
+        ))
+        _sessions[loop] = session
+    return session
+
+
+class GatewayResponse:
+    """Resposta já lida do aiohttp com a interface usada pelos parsers do service"""
+
+    def __init__(self, status_code, content, headers):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AsyncPagBankService(PagBankService):
+    """Versão async do PagBankService para views rodando sob ASGI.
+
+    Mesma interface de create_order, get_order e create_charge_credit_card,
+    mas cada método é uma coroutine. Payloads, retry e circuit breaker são os
+    mesmos do service síncrono.
+    """
+
+    async def _request(self, method, path, operation, idempotency_key=None, **kwargs):
+        """Executa uma chamada HTTP async usando o pool do event loop, com retry"""
+        headers = self._request_headers(method, idempotency_key)
+        connect_timeout, read_timeout = get_timeout(operation)
+        timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        session = get_async_session()
+
+        async def send():
+            with span('pagbank.http', **{'http.method': method, 'pagbank.operation': operation}) as http_span:
+                started = time.perf_counter()
+                try:
+                    async with session.request(
+                        method,
+                        f"{self.api_url}{path}",
+                        headers=trace_headers(headers),
+                        timeout=timeout,
+                        **kwargs
+                    ) as response:
+                        result = GatewayResponse(response.status, await response.read(), response.headers)
+                except asyncio.TimeoutError:
+                    record_gateway_call(operation, started, 'timeout')
+                    raise
+                except aiohttp.ClientError:
+                    record_gateway_call(operation, started, 'error')
+                    raise
+                record_gateway_call(operation, started, result.status_code)
+                http_span.set_attribute('http.status_code', result.status_code)
+                return result
+
+        endpoint = CIRCUIT_ENDPOINTS.get(operation)
+        if endpoint:
+            breaker = get_breaker(endpoint)
+            call = lambda: breaker.call_async(send, self._is_gateway_failure)
+        else:
+            call = send
+
+        limiter = get_rate_limiter(RATE_LIMIT_FAMILIES[operation])
+
+        async def attempt():
+            await limiter.acquire_async()
+            response = await call()
+            limiter.observe(response)
+            return response
+
+        return await self.retry_policy.call_async(attempt)
+
+    async def test_connection(self):
+        """Testa conexão com PagBank"""
+        try:
+            response = await self._request('GET', '/public-keys', 'public_keys')
+
+            return {
+                "success": response.status_code == 200,
+                "status": response.status_code,
+                "response": response.text[:200] if response.text else None
+            }
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    @traced('AsyncPagBankService.create_order')
+    async def create_order(self, payment_data):
+        """Cria ordem no PagBank v4"""
+        try:
+            logger.info("Criando ordem PagBank v4 (async)...")
+
+            order_data = self._build_order_data(payment_data)
+            logger.info("Dados da ordem", extra={'payload': Payload(order_data, payment_data.get('external_reference'))})
+
+            response = await self._request(
+                'POST', '/orders', 'create_order',
+                idempotency_key=payment_data.get('idempotency_key'), json=order_data
+            )
+
+            logger.info(f"Resposta PagBank - Status: {response.status_code}", extra={
+                'status_code': response.status_code,
+                'payload': Payload(response, payment_data.get('external_reference')),
+            })
+
+            return self._order_result(response)
+
+        except (CircuitOpenError, RateLimitExceeded) as e:
+            return self._circuit_open_result(e)
+        except Exception as e:
+            logger.error(f"Erro ao criar ordem: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    @traced('AsyncPagBankService.get_order')
+    async def get_order(self, order_id):
+        """Busca ordem no PagBank"""
+        try:
+            response = await self._request('GET', f'/orders/{order_id}', 'get_order')
+            return self._get_order_result(response)
+
+        except (CircuitOpenError, RateLimitExceeded) as e:
+            return self._circuit_open_result(e)
+        except Exception as e:
+            logger.error(f"Erro ao buscar ordem: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    @traced('AsyncPagBankService.create_charge_credit_card')
+    async def create_charge_credit_card(self, payment_data, card_data):
+        """Cria cobrança com cartão de crédito"""
+        try:
+            logger.info("Criando cobrança com cartão (async)...")
+
+            charge_data = self._build_charge_data(payment_data, card_data)
+            logger.info("Dados da cobrança", extra={'payload': Payload(charge_data, payment_data.get('external_reference'))})
+
+            response = await self._request(
+                'POST', '/charges', 'create_charge',
+                idempotency_key=payment_data.get('idempotency_key'), json=charge_data
+            )
+
+            logger.info(f"Resposta PagBank - Status: {response.status_code}", extra={
+                'status_code': response.status_code,
+                'payload': Payload(response, payment_data.get('external_reference')),
+            })
+
+            return self._charge_result(response)
+
+        except (CircuitOpenError, RateLimitExceeded) as e:
+            return self._circuit_open_result(e)
+        except Exception as e:
+            logger.error(f"Erro na cobrança: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    # Métodos de compatibilidade
+    async def create_checkout_session(self, payment_data):
+        """Compatibilidade - redireciona para create_order"""
+        return await self.create_order(payment_data)
+
+    async def create_transparent_payment(self, payment_data, card_data):
+        """Compatibilidade - redireciona para create_charge_credit_card"""
+        return await self.create_charge_credit_card(payment_data, card_data)
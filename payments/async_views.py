@@ -0,0 +1,293 @@
+"""Views async para deploy ASGI (PAGBANK_ASYNC_VIEWS=True).
+
+Mesmas rotas e respostas das views síncronas, mas as chamadas ao PagBank
+usam AsyncPagBankService: enquanto uma requisição espera o gateway, o
+worker continua atendendo outras. O long-poll e o SSE de status só
+existem aqui: cada cliente esperando é uma coroutine, não uma thread.
+"""
+import asyncio
+import functools
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from .async_services import AsyncPagBankService
+from .bulk import acreate_checkouts, bulk_size
+from .db import release_connection
+from .idempotency import idempotent
+from .models import Payment
+from .pagination import PaymentCursorPagination, payment_list_queryset
+from .serializers import PaymentSerializer
+from .throttling import throttle
+from . import checkout, status_cache, status_events
+
+logger = logging.getLogger(__name__)
+
+
+def json_response(data, status_code=status.HTTP_200_OK, headers=None):
+    """Renderiza como o DRF para manter o mesmo formato das views síncronas"""
+    return HttpResponse(
+        JSONRenderer().render(data),
+        status=status_code,
+        content_type='application/json',
+        headers=headers
+    )
+
+
+def parse_json_body(request):
+    """Corpo JSON da requisição, ou None se inválido"""
+    try:
+        return json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+
+
+def asgi_only(view):
+    """501 fora do handler ASGI: sob WSGI cada cliente esperando prenderia uma
+    thread do servidor e um event loop que só dura a requisição (a tarefa
+    listen() do backend seria destruída ainda pendente)"""
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not isinstance(request, ASGIRequest):
+            return json_response(
+                {'error': 'Disponível apenas no deploy ASGI'}, status.HTTP_501_NOT_IMPLEMENTED
+            )
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def serialize_payment(payment):
+    return PaymentSerializer(payment).data
+
+
+def list_payments(request):
+    """Mesma listagem paginada de PaymentListCreateView.get; retorna (dados, status)"""
+    drf_request = Request(request)
+    try:
+        payments, fields = payment_list_queryset(drf_request.query_params, PaymentSerializer.Meta.fields)
+        paginator = PaymentCursorPagination()
+        page = paginator.paginate_queryset(payments, drf_request)
+    except APIException as e:
+        return e.detail, e.status_code
+    data = PaymentSerializer(page, many=True, fields=fields).data
+    return paginator.get_paginated_response(data).data, status.HTTP_200_OK
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncPaymentListCreateView(View):
+    @throttle('reads')
+    async def get(self, request):
+        """Lista pagamentos paginados por cursor"""
+        data, status_code = await sync_to_async(list_payments)(request)
+        return json_response(data, status_code)
+
+    @throttle('writes')
+    @idempotent('payments.create')
+    async def post(self, request):
+        """Cria um novo pagamento (aceita o header Idempotency-Key)"""
+        data = parse_json_body(request)
+        if data is None:
+            return json_response({'error': 'JSON inválido'}, status.HTTP_400_BAD_REQUEST)
+
+        validated_data, error = checkout.validate_payment(data)
+        if error:
+            return json_response(*error)
+
+        payment = await sync_to_async(checkout.create_pending_payment)(validated_data, request)
+
+        await sync_to_async(release_connection)()
+        ps_result = await AsyncPagBankService().create_checkout_session(
+            checkout.checkout_request(payment, validated_data)
+        )
+
+        new_status, fields = checkout.checkout_gateway_result(ps_result)
+        await Payment.objects.arecord_gateway_result(payment.id, new_status, **fields)
+        return json_response(*checkout.checkout_response(payment, ps_result))
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncPaymentBulkCreateView(View):
+    # Cada pagamento do lote conta como uma escrita nos limites
+    @throttle('writes', cost=lambda request: bulk_size(request.body))
+    @idempotent('payments.bulk_create')
+    async def post(self, request):
+        """Cria vários pagamentos de uma vez (ver PaymentBulkCreateView; aceita o
+        header Idempotency-Key)"""
+        validated_data, error = checkout.validate_bulk(parse_json_body(request))
+        if error:
+            return json_response(*error)
+
+        payments = await sync_to_async(checkout.create_pending_payments)(validated_data)
+        await sync_to_async(release_connection)()
+        results = await acreate_checkouts(AsyncPagBankService(), payments, validated_data)
+        return json_response(*await sync_to_async(checkout.bulk_response)(payments, results))
+
+
+async def load_payment_status(payment_id):
+    """Pagamento serializado com o status atualizado pelo PagBank, ou None"""
+    try:
+        payment = await Payment.objects.with_items().aget(id=payment_id)
+    except Payment.DoesNotExist:
+        return None
+
+    if payment.mercadopago_id:
+        mapped_status = checkout.order_status(await AsyncPagBankService().get_order(payment.mercadopago_id))
+        if mapped_status and await Payment.objects.atransition_status(payment.id, mapped_status):
+            await payment.arefresh_from_db(fields=['status', 'updated_at'])
+            status_events.publish(payment.id, mapped_status)
+
+    return await sync_to_async(serialize_payment)(payment)
+
+
+@require_GET
+@throttle('reads')
+async def payment_status(request, payment_id):
+    """Verifica o status atual de um pagamento (via cache de status)"""
+    return json_response(*checkout.status_response(await status_cache.aget_status(payment_id, load_payment_status)))
+
+
+def read_payment(payment_id):
+    """Pagamento serializado como está no banco (sem consultar o PagBank), ou None"""
+    close_old_connections()
+    try:
+        payment = Payment.objects.with_items().get(id=payment_id)
+    except Payment.DoesNotExist:
+        return None
+    return serialize_payment(payment)
+
+
+# Long-poll/SSE leem no executor padrão do event loop: sob ASGI, a primeira
+# chamada thread-sensitive da requisição cria uma thread presa a ela até o
+# fim, ou seja, uma thread parada por cliente esperando
+load_payment = sync_to_async(read_payment, thread_sensitive=False)
+# Uma mudança acorda todos os clientes do pagamento ao mesmo tempo: uma só leitura
+_reload_flight = status_cache.AsyncSingleFlight()
+
+
+async def reload_payment(payment_id):
+    return await _reload_flight.do(str(payment_id), lambda: load_payment(payment_id))
+
+
+def is_final_status(payment_status):
+    return not Payment.STATUS_TRANSITIONS.get(payment_status)
+
+
+def query_timeout(request, maximum):
+    """?timeout= em segundos, limitado a `maximum`"""
+    try:
+        return min(max(float(request.GET['timeout']), 0.0), maximum)
+    except (KeyError, ValueError):
+        return maximum
+
+
+@require_GET
+@asgi_only
+async def payment_status_wait(request, payment_id):
+    """Long-poll: responde assim que o status for diferente de ?status=
+    (o último que o cliente conhece) ou quando ?timeout= acabar"""
+    known_status = request.GET.get('status')
+    timeout = query_timeout(request, settings.PAGBANK_STATUS_LONG_POLL_TIMEOUT)
+
+    # Assina antes de ler: uma mudança entre a leitura e a espera não se perde
+    async with status_events.subscribe(payment_id) as subscription:
+        data = await load_payment(payment_id)
+        if data is None:
+            return json_response(*checkout.not_found())
+        if known_status is None or data['status'] != known_status:
+            return json_response(data)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while (remaining := deadline - loop.time()) > 0:
+            new_status = await subscription.get(remaining)
+            if new_status is None:
+                break
+            if new_status != known_status:
+                data = await reload_payment(payment_id) or data
+                break
+
+    return json_response(data)
+
+
+def sse_message(event, data):
+    return f"event: {event}\ndata: {JSONRenderer().render(data).decode()}\n\n"
+
+
+@require_GET
+@asgi_only
+async def payment_events(request, payment_id):
+    """Server-sent events: envia o pagamento e, a cada mudança de status, a
+    nova representação; termina em status final ou após
+    PAGBANK_STATUS_STREAM_TIMEOUT"""
+    # Assina antes de ler, como no long-poll; só o stream fecha a assinatura
+    subscription = status_events.subscribe(payment_id)
+    try:
+        data = await load_payment(payment_id)
+    except BaseException:
+        subscription.close()
+        raise
+    if data is None:
+        subscription.close()
+        return json_response(*checkout.not_found())
+
+    async def stream(data):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.PAGBANK_STATUS_STREAM_TIMEOUT
+        heartbeat = settings.PAGBANK_STATUS_STREAM_HEARTBEAT
+        async with subscription:
+            yield sse_message('status', data)
+            while not is_final_status(data['status']):
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                new_status = await subscription.get(min(heartbeat, remaining))
+                if new_status is None:
+                    yield ": keepalive\n\n"
+                elif new_status != data['status']:
+                    data = await reload_payment(payment_id) or data
+                    yield sse_message('status', data)
+
+    response = StreamingHttpResponse(stream(data), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@csrf_exempt
+@require_POST
+@throttle('writes')
+@idempotent('payments.transparent')
+async def create_transparent_payment(request):
+    """Cria um pagamento transparente com cartão de crédito (aceita o header Idempotency-Key)"""
+    try:
+        payment_data, card_data, error = checkout.validate_transparent(parse_json_body(request) or {})
+        if error:
+            return json_response(*error)
+
+        payment = await sync_to_async(checkout.create_transparent_pending_payment)(payment_data, request)
+
+        await sync_to_async(release_connection)()
+        result = await AsyncPagBankService().create_transparent_payment(
+            checkout.transparent_request(payment, payment_data), card_data
+        )
+
+        new_status, fields = checkout.transparent_gateway_result(result)
+        await Payment.objects.arecord_gateway_result(payment.id, new_status, **fields)
+        return json_response(*checkout.transparent_response(payment, result))
+
+    except Exception as e:
+        logger.error(f"Erro no pagamento transparente: {str(e)}")
+        return json_response(*checkout.server_error(e))
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import status
+
+from .models import Payment, gateway_result_status
+
+logger = logging.getLogger(__name__)
+
+
+def get_bulk_concurrency():
+    """Chamadas simultâneas ao PagBank por requisição bulk"""
+    return max(1, getattr(settings, 'PAGBANK_BULK_CONCURRENCY', 10))
+
+
+def checkout_data(payment, data):
+    """Dados de create_checkout_session para um pagamento recém-criado. A
+    x-idempotency-key enviada ao PagBank é o id do pagamento: o retry da
+    chamada para o mesmo pagamento recebe a mesma ordem"""
+    return {
+        'items': data['items'],
+        'payer_email': data['payer_email'],
+        'payer_name': 'Cliente',
+        'external_reference': str(payment.id),
+        'idempotency_key': str(payment.id)
+    }
+
+
+def create_checkouts(service, payments, payloads):
+    """Cria as ordens no PagBank em paralelo (no máximo PAGBANK_BULK_CONCURRENCY
+    por vez); os resultados voltam na ordem dos pagamentos"""
+    def create(args):
+        payment, data = args
+        return service.create_checkout_session(checkout_data(payment, data))
+
+    with ThreadPoolExecutor(max_workers=min(get_bulk_concurrency(), len(payments))) as executor:
+        return list(executor.map(create, zip(payments, payloads)))
+
+
+async def acreate_checkouts(service, payments, payloads):
+    """Versão async de create_checkouts (AsyncPagBankService)"""
+    semaphore = asyncio.Semaphore(get_bulk_concurrency())
+
+    async def create(payment, data):
+        async with semaphore:
+            return await service.create_checkout_session(checkout_data(payment, data))
+
+    return await asyncio.gather(*(create(payment, data) for payment, data in zip(payments, payloads)))
+
+
+def save_checkout_results(payments, results):
+    """Grava o resultado de cada checkout com um único bulk_update: pending
+    (com preference_id e id da ordem) ou gateway_failed, como no endpoint
+    individual. Só sai de pending_gateway, ver gateway_result_status."""
+    now = timezone.now()
+    failed = 0
+    for payment, result in zip(payments, results):
+        if result['success']:
+            payment.status = gateway_result_status('pending')
+            payment.preference_id = result.get('checkout_code', '')
+            payment.payment_gateway_id = result.get('order_id')
+        else:
+            payment.status = gateway_result_status('gateway_failed')
+            failed += 1
+        payment.updated_at = now
+
+    Payment.objects.bulk_update(payments, ['status', 'preference_id', 'payment_gateway_id', 'updated_at'])
+
+    if failed:
+        logger.warning(f"Bulk: {failed} de {len(payments)} checkouts falharam")
+    return [bulk_result(payment, result) for payment, result in zip(payments, results)]
+
+
+def bulk_result(payment, result):
+    if result['success']:
+        return {
+            'success': True,
+            'payment_id': payment.id,
+            'checkout_code': result.get('checkout_code'),
+            'checkout_url': result.get('checkout_url'),
+            'payment_url': result.get('payment_url')
+        }
+    return {
+        'success': False,
+        'payment_id': payment.id,
+        'error': 'Erro ao criar checkout PagBank',
+        'details': result.get('error'),
+        'circuit_open': bool(result.get('circuit_open'))
+    }
+
+
+def bulk_status_code(results):
+    """201 se todos foram criados, 207 se parte falhou, 400 se nenhum"""
+    created = sum(1 for result in results if result['success'])
+    if created == len(results):
+        return status.HTTP_201_CREATED
+    if created:
+        return status.HTTP_207_MULTI_STATUS
+    return status.HTTP_400_BAD_REQUEST
+
+
+def bulk_size(body):
+    """Pagamentos em {"payments": [...]} no corpo cru, o peso de um POST bulk nos
+    limites de escrita (1 se o corpo não tiver a lista)
+
+    Lê request.body e não request.data: o idempotent ainda precisa do corpo
+    para calcular o hash depois do throttle.
+    """
+    try:
+        data = json.loads(body or b'{}')
+    except ValueError:
+        return 1
+    payloads = data.get('payments') if isinstance(data, dict) else None
+    return len(payloads) if isinstance(payloads, list) and payloads else 1
+
+
+def validate_bulk_payloads(data):
+    """Lista de payloads em {"payments": [...]}, ou (None, erro)"""
+    payloads = data.get('payments') if isinstance(data, dict) else None
+    if not isinstance(payloads, list) or not payloads:
+        return None, 'Envie uma lista não vazia em "payments"'
+    limit = getattr(settings, 'PAGBANK_BULK_MAX_PAYMENTS', 1000)
+    if len(payloads) > limit:
+        return None, f'No máximo {limit} pagamentos por requisição'
+    return payloads, None
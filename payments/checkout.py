@@ -0,0 +1,205 @@
+"""Regras dos endpoints de pagamento, compartilhadas pelas views síncronas
+(views.py) e async (async_views.py).
+
+Validação, o que gravar, o que enviar ao PagBank e o corpo das respostas
+ficam aqui; cada view só decide como esperar o banco e o PagBank. As
+respostas são tuplas (dados, status, headers), renderizadas por
+views.api_response (DRF) e async_views.json_response.
+"""
+from rest_framework import status
+
+from .bulk import bulk_status_code, checkout_data, save_checkout_results, validate_bulk_payloads
+from .idempotency import bind_payment, bound_payment_id
+from .models import Payment
+from .serializers import CreatePaymentSerializer
+from .services import map_gateway_status
+
+
+def bad_request(data):
+    return data, status.HTTP_400_BAD_REQUEST, None
+
+
+def not_found():
+    return {'error': 'Payment not found'}, status.HTTP_404_NOT_FOUND, None
+
+
+def gateway_unavailable(result):
+    """503 quando o circuit breaker recusou a chamada ao PagBank"""
+    retry_after = result.get('retry_after', 1)
+    return {
+        'error': 'PagBank temporariamente indisponível',
+        'details': result.get('error'),
+        'retry_after': retry_after
+    }, status.HTTP_503_SERVICE_UNAVAILABLE, {'Retry-After': str(retry_after)}
+
+
+def retried_payment(request):
+    """Pagamento criado por uma tentativa anterior com a mesma Idempotency-Key
+    (liberada por um 5xx), pronto para repetir a chamada ao PagBank; ou None"""
+    payment_id = bound_payment_id(request)
+    if payment_id is None:
+        return None
+    Payment.objects.retry_gateway(payment_id)
+    return Payment.objects.filter(id=payment_id).first()
+
+
+# POST /api/payments/
+
+def validate_payment(data):
+    """(dados validados, None) ou (None, resposta 400)"""
+    serializer = CreatePaymentSerializer(data=data)
+    if serializer.is_valid():
+        return serializer.validated_data, None
+    return None, bad_request(serializer.errors)
+
+
+def create_pending_payment(validated_data, request):
+    """Grava pagamento e itens uma vez, como pending_gateway (totais em centavos já
+    calculados); o retry de uma Idempotency-Key liberada reaproveita o pagamento"""
+    payment = retried_payment(request)
+    if payment is None:
+        payment = Payment.objects.create_with_items(
+            validated_data['items'],
+            amount=validated_data['amount'],
+            description=validated_data['description'],
+            payer_email=validated_data['payer_email'],
+            status='pending_gateway'
+        )
+        bind_payment(request, payment)
+    return payment
+
+
+def checkout_request(payment, validated_data):
+    """Dados de create_checkout_session (com o id do pagamento como
+    x-idempotency-key, ver bulk.checkout_data)"""
+    return checkout_data(payment, validated_data)
+
+
+def checkout_gateway_result(result):
+    """(status, campos) de record_gateway_result para o resultado do checkout.
+
+    A falha fica registrada no status (gateway_failed) em vez de apagar
+    pagamento e itens.
+    """
+    if result['success']:
+        return 'pending', {
+            'preference_id': result.get('checkout_code', ''),
+            'payment_gateway_id': result.get('order_id')
+        }
+    return 'gateway_failed', {}
+
+
+def checkout_response(payment, result):
+    if result['success']:
+        return {
+            'payment_id': payment.id,
+            'checkout_code': result.get('checkout_code'),
+            'checkout_url': result.get('checkout_url'),
+            'payment_url': result.get('payment_url')
+        }, status.HTTP_201_CREATED, None
+    if result.get('circuit_open'):
+        return gateway_unavailable(result)
+    return bad_request({
+        'error': 'Erro ao criar checkout PagBank',
+        'details': result.get('error'),
+        'payment_id': payment.id
+    })
+
+
+# POST /api/payments/bulk/
+
+def validate_bulk(data):
+    """(pagamentos validados, None) ou (None, resposta 400)"""
+    payloads, error = validate_bulk_payloads(data)
+    if error:
+        return None, bad_request({'error': error})
+    serializer = CreatePaymentSerializer(data=payloads, many=True)
+    if not serializer.is_valid():
+        return None, bad_request({'errors': serializer.errors})
+    return serializer.validated_data, None
+
+
+def create_pending_payments(validated_data):
+    return Payment.objects.bulk_create_with_items(validated_data, status='pending_gateway')
+
+
+def bulk_response(payments, results):
+    """Grava os resultados (um bulk_update) e monta a resposta, um resultado por pagamento"""
+    return {'results': save_checkout_results(payments, results)}, bulk_status_code(results), None
+
+
+# POST /api/payments/transparent/
+
+def validate_transparent(data):
+    """(dados do pagamento, dados do cartão, None) ou (None, None, resposta 400)"""
+    payment_data = data.get('payment', {})
+    card_data = data.get('card', {})
+    if not payment_data or not card_data:
+        return None, None, bad_request({'error': 'Dados de pagamento e cartão são obrigatórios'})
+    return payment_data, card_data, None
+
+
+def create_transparent_pending_payment(payment_data, request):
+    """Grava o pagamento como pending_gateway (ou reaproveita o de um retry)"""
+    payment = retried_payment(request)
+    if payment is None:
+        payment = Payment.objects.create(
+            amount=payment_data['amount'],
+            description=payment_data.get('description', 'Pagamento transparente'),
+            payer_email=payment_data['payer_email'],
+            status='pending_gateway'
+        )
+        bind_payment(request, payment)
+    return payment
+
+
+def transparent_request(payment, payment_data):
+    """Dados de create_transparent_payment, com referência externa e o id do
+    pagamento como x-idempotency-key"""
+    return {
+        **payment_data,
+        'external_reference': str(payment.id),
+        'amount_cents': payment.amount_cents,
+        'idempotency_key': str(payment.id)
+    }
+
+
+def transparent_gateway_result(result):
+    """(status, campos) de record_gateway_result para o resultado da cobrança"""
+    if result['success']:
+        return map_gateway_status(result.get('status')), {'payment_gateway_id': result.get('charge_id')}
+    return 'gateway_failed', {}
+
+
+def transparent_response(payment, result):
+    if result['success']:
+        return {
+            'success': True,
+            'payment_id': payment.id,
+            'transaction_code': result.get('charge_id'),
+            'status': result.get('status')
+        }, status.HTTP_201_CREATED, None
+    if result.get('circuit_open'):
+        return gateway_unavailable(result)
+    return bad_request({
+        'success': False,
+        'error': result.get('error'),
+        'payment_id': payment.id
+    })
+
+
+def server_error(error):
+    return {'error': str(error)}, status.HTTP_500_INTERNAL_SERVER_ERROR, None
+
+
+# GET /api/payments/<id>/status/
+
+def order_status(result):
+    """Payment.status da ordem consultada no PagBank, ou None se a consulta falhou"""
+    if result['success']:
+        return map_gateway_status(result['order'].get('status'))
+    return None
+
+
+def status_response(data):
+    return not_found() if data is None else (data, status.HTTP_200_OK, None)
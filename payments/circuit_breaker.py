@@ -0,0 +1,263 @@
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Chamada recusada sem tocar no gateway porque o circuito está aberto"""
+
+    def __init__(self, endpoint, retry_after):
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+        super().__init__(
+            f"Circuito aberto para {endpoint}: PagBank indisponível, "
+            f"tente novamente em {retry_after}s"
+        )
+
+
+class LocalBreakerBackend:
+    """Estado do circuito em memória (um por processo)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}
+        self._buckets = defaultdict(dict)
+        self._probes = {}
+
+    def get_state(self, name):
+        return self._states.get(name, (CLOSED, 0.0))
+
+    def set_state(self, name, state, changed_at):
+        with self._lock:
+            self._states[name] = (state, changed_at)
+
+    def record(self, name, bucket, failed, slow, keep_buckets, bucket_seconds):
+        with self._lock:
+            buckets = self._buckets[name]
+            counts = buckets.setdefault(bucket, [0, 0, 0])
+            counts[0] += 1
+            counts[1] += int(failed)
+            counts[2] += int(slow)
+            for old in [b for b in buckets if b <= bucket - keep_buckets]:
+                del buckets[old]
+
+    def window_counts(self, name, buckets):
+        with self._lock:
+            stored = self._buckets[name]
+            totals = [0, 0, 0]
+            for bucket in buckets:
+                for i, value in enumerate(stored.get(bucket, ())):
+                    totals[i] += value
+            return tuple(totals)
+
+    def acquire_probe(self, name, ttl):
+        now = time.monotonic()
+        with self._lock:
+            if self._probes.get(name, 0) > now:
+                return False
+            self._probes[name] = now + ttl
+            return True
+
+    def release_probe(self, name):
+        with self._lock:
+            self._probes.pop(name, None)
+
+
+class CacheBreakerBackend:
+    """Estado do circuito no cache do Django, compartilhado entre workers.
+
+    Use um cache compartilhado (Redis/Memcached); com LocMemCache o estado
+    continua sendo por processo.
+    """
+
+    FIELDS = ('total', 'failed', 'slow')
+
+    def __init__(self, alias='default', prefix='pagbank:cb'):
+        self.cache = caches[alias]
+        self.prefix = prefix
+
+    def _key(self, name, *parts):
+        return ':'.join((self.prefix, name) + tuple(str(p) for p in parts))
+
+    def get_state(self, name):
+        return tuple(self.cache.get(self._key(name, 'state'), (CLOSED, 0.0)))
+
+    def set_state(self, name, state, changed_at):
+        self.cache.set(self._key(name, 'state'), (state, changed_at), None)
+
+    def record(self, name, bucket, failed, slow, keep_buckets, bucket_seconds):
+        timeout = math.ceil(keep_buckets * bucket_seconds)
+        for field, increment in zip(self.FIELDS, (1, failed, slow)):
+            if not increment:
+                continue
+            key = self._key(name, bucket, field)
+            self.cache.add(key, 0, timeout)
+            try:
+                self.cache.incr(key)
+            except ValueError:
+                # chave expirou entre o add e o incr
+                self.cache.set(key, 1, timeout)
+
+    def window_counts(self, name, buckets):
+        keys = {self._key(name, b, f): f for b in buckets for f in self.FIELDS}
+        values = self.cache.get_many(list(keys))
+        totals = dict.fromkeys(self.FIELDS, 0)
+        for key, value in values.items():
+            totals[keys[key]] += value
+        return tuple(totals[f] for f in self.FIELDS)
+
+    def acquire_probe(self, name, ttl):
+        return self.cache.add(self._key(name, 'probe'), 1, math.ceil(ttl))
+
+    def release_probe(self, name):
+        self.cache.delete(self._key(name, 'probe'))
+
+
+class CircuitBreaker:
+    """Circuit breaker por taxa de erro/lentidão numa janela deslizante.
+
+    closed -> open quando, com pelo menos `minimum_calls` na janela, a taxa de
+    falhas ou de chamadas lentas passa do limite. Após `open_seconds`, uma
+    única chamada de teste (half-open) decide se o circuito fecha ou reabre.
+    """
+
+    def __init__(self, name, backend, failure_rate_threshold=0.5, slow_call_threshold=5.0,
+                 slow_call_rate_threshold=0.8, minimum_calls=10, window_seconds=30,
+                 open_seconds=15, buckets=10, probe_ttl=30, clock=time.time):
+        self.name = name
+        self.backend = backend
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_threshold = slow_call_threshold
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.minimum_calls = minimum_calls
+        self.open_seconds = open_seconds
+        self.buckets = buckets
+        self.bucket_seconds = window_seconds / buckets
+        self.probe_ttl = probe_ttl
+        self.clock = clock
+
+    @property
+    def state(self):
+        return self.backend.get_state(self.name)[0]
+
+    def before_call(self):
+        """Retorna True se esta chamada é o probe half-open; levanta se aberto"""
+        state, changed_at = self.backend.get_state(self.name)
+        if state == CLOSED:
+            return False
+
+        now = self.clock()
+        if state == OPEN and now - changed_at < self.open_seconds:
+            raise CircuitOpenError(self.name, math.ceil(self.open_seconds - (now - changed_at)))
+
+        if self.backend.acquire_probe(self.name, self.probe_ttl):
+            if state == OPEN:
+                self.backend.set_state(self.name, HALF_OPEN, now)
+            return True
+        raise CircuitOpenError(self.name, 1)
+
+    def after_call(self, is_probe, failed, elapsed):
+        now = self.clock()
+        slow = elapsed >= self.slow_call_threshold
+
+        if is_probe:
+            self.backend.release_probe(self.name)
+            if failed or slow:
+                self._open(now)
+            else:
+                logger.info(f"Circuito {self.name} fechado")
+                self.backend.set_state(self.name, CLOSED, now)
+            return
+
+        bucket = int(now // self.bucket_seconds)
+        self.backend.record(self.name, bucket, failed, slow, self.buckets * 2, self.bucket_seconds)
+        if not (failed or slow):
+            return
+
+        state, changed_at = self.backend.get_state(self.name)
+        if state != CLOSED:
+            return
+
+        # Ignora chamadas anteriores ao último fechamento do circuito
+        first_bucket = max(bucket - self.buckets + 1, int(changed_at // self.bucket_seconds))
+        total, failures, slow_calls = self.backend.window_counts(self.name, range(first_bucket, bucket + 1))
+        if total < self.minimum_calls:
+            return
+        if failures / total >= self.failure_rate_threshold or slow_calls / total >= self.slow_call_rate_threshold:
+            self._open(now)
+
+    def _open(self, now):
+        logger.warning(f"Circuito {self.name} aberto por {self.open_seconds}s")
+        self.backend.set_state(self.name, OPEN, now)
+
+    def call(self, func, is_failure):
+        """Executa func() protegido pelo circuito"""
+        is_probe = self.before_call()
+        started = time.monotonic()
+        try:
+            result = func()
+        except Exception:
+            self.after_call(is_probe, True, time.monotonic() - started)
+            raise
+        self.after_call(is_probe, is_failure(result), time.monotonic() - started)
+        return result
+
+    async def call_async(self, func, is_failure):
+        """Versão async de call(); func é uma função que retorna coroutine"""
+        is_probe = self.before_call()
+        started = time.monotonic()
+        try:
+            result = await func()
+        except Exception:
+            self.after_call(is_probe, True, time.monotonic() - started)
+            raise
+        self.after_call(is_probe, is_failure(result), time.monotonic() - started)
+        return result
+
+
+BACKENDS = {
+    'local': LocalBreakerBackend,
+    'cache': lambda: CacheBreakerBackend(getattr(settings, 'PAGBANK_BREAKER_CACHE_ALIAS', 'default')),
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Backend configurado em PAGBANK_BREAKER_BACKEND ('local', 'cache' ou caminho pontuado)"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = getattr(settings, 'PAGBANK_BREAKER_BACKEND', 'local')
+                factory = BACKENDS.get(name) or import_string(name)
+                _backend = factory()
+    return _backend
+
+
+def get_breaker(endpoint):
+    """CircuitBreaker do endpoint com os limites definidos nos settings"""
+    return CircuitBreaker(
+        endpoint,
+        get_backend(),
+        failure_rate_threshold=getattr(settings, 'PAGBANK_BREAKER_FAILURE_RATE', 0.5),
+        slow_call_threshold=getattr(settings, 'PAGBANK_BREAKER_SLOW_CALL_SECONDS', 5.0),
+        slow_call_rate_threshold=getattr(settings, 'PAGBANK_BREAKER_SLOW_CALL_RATE', 0.8),
+        minimum_calls=getattr(settings, 'PAGBANK_BREAKER_MINIMUM_CALLS', 10),
+        window_seconds=getattr(settings, 'PAGBANK_BREAKER_WINDOW_SECONDS', 30),
+        open_seconds=getattr(settings, 'PAGBANK_BREAKER_OPEN_SECONDS', 15),
+        probe_ttl=getattr(settings, 'PAGBANK_TIMEOUT', 30),
+    )
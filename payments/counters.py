@@ -0,0 +1,33 @@
+"""Contadores simples do processo (retries, limites, descarte de carga, logs,
+traces, perfis), expostos em GET /api/metrics/ como <nome>_<campo>_total.
+
+Sem dependências do Django nem de outros módulos do app: structured_logging,
+carregado pela configuração de LOGGING, também o usa.
+"""
+import threading
+
+
+class Counters:
+    """Contadores com nome fixo (FIELDS), protegidos por um lock.
+
+    Cada módulo declara a sua subclasse com os campos que conta e uma
+    instância no nível do módulo (`stats`).
+    """
+
+    FIELDS = ()
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counters = dict.fromkeys(self.FIELDS, 0)
+
+    def increment(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counters)
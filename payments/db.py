@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+def release_connection(using=DEFAULT_DB_ALIAS):
+    """Devolve a conexão com o banco antes de esperar o PagBank.
+
+    Chamadas ao gateway levam centenas de ms; sem isso cada requisição em
+    espera segura uma conexão do banco. Não faz nada dentro de uma transação
+    (ou com PAGBANK_RELEASE_DB_CONNECTION=False, útil com CONN_MAX_AGE alto
+    e sem pooler). A próxima query reabre a conexão.
+    """
+    if not getattr(settings, 'PAGBANK_RELEASE_DB_CONNECTION', True):
+        return
+    connection = connections[using]
+    if connection.in_atomic_block:
+        return
+    connection.close()
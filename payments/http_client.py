@@ -0,0 +1,74 @@
+import socket
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from django.conf import settings
+
+# Timeouts de leitura por operação (segundos). None = usa PAGBANK_TIMEOUT.
+# Leituras e diagnósticos não precisam esperar tanto quanto a criação de ordens.
+OPERATION_READ_TIMEOUTS = {
+    'create_order': None,
+    'create_charge': None,
+    'get_order': 10,
+    'public_keys': 10,
+}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """HTTPAdapter com TCP keep-alive nos sockets do pool"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = HTTPConnection.default_socket_options + [
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+        ]
+        super().init_poolmanager(*args, **kwargs)
+
+
+def build_session():
+    """Cria uma Session com pool de conexões configurado pelos settings"""
+    keep_alive = getattr(settings, 'PAGBANK_KEEP_ALIVE', True)
+    adapter_class = KeepAliveAdapter if keep_alive else HTTPAdapter
+    adapter = adapter_class(
+        pool_connections=getattr(settings, 'PAGBANK_POOL_CONNECTIONS', 10),
+        pool_maxsize=getattr(settings, 'PAGBANK_POOL_MAXSIZE', 20),
+        pool_block=getattr(settings, 'PAGBANK_POOL_BLOCK', False),
+    )
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
+
+
+def get_session():
+    """Retorna a Session compartilhada pelo processo (criada sob demanda)"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_session()
+    return _session
+
+
+def reset_session():
+    """Fecha o pool atual; a próxima chamada a get_session cria um novo"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
+def get_timeout(operation):
+    """Retorna a tupla (connect, read) para a operação informada"""
+    default_read = getattr(settings, 'PAGBANK_TIMEOUT', 30)
+    read_timeout = OPERATION_READ_TIMEOUTS.get(operation) or default_read
+    connect_timeout = getattr(settings, 'PAGBANK_CONNECT_TIMEOUT', 5)
+    return (min(connect_timeout, default_read), min(read_timeout, default_read))
@@ -0,0 +1,240 @@
+"""Header Idempotency-Key nos POSTs que criam pagamentos.
+
+A chave vale por cliente (usuário autenticado ou IP): clientes diferentes
+podem usar o mesmo valor. Cada requisição lê a linha de IdempotencyKey pelo
+índice e só insere quando não encontra (a unique constraint em
+(scope, caller, key) é a trava); ao terminar, a resposta é gravada. Um
+retry com a mesma chave recebe a resposta original sem criar outro Payment
+nem chamar o PagBank.
+
+Um 5xx libera a chave sem apagar a linha: o retry reaproveita o Payment
+criado pela primeira tentativa (ver bound_payment_id), e a chamada ao
+PagBank repete a mesma x-idempotency-key (o id do pagamento), então o
+PagBank devolve a mesma ordem/cobrança em vez de deixar um Payment órfão.
+Requisições sem o header não passam por aqui.
+"""
+import asyncio
+import hashlib
+import logging
+from datetime import timedelta
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.throttling import BaseThrottle
+
+from .models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+# Atributo da requisição com o IdempotencyKey reservado pelo decorator
+RECORD_ATTRIBUTE = 'idempotency_record'
+
+_ident = BaseThrottle()
+
+
+def get_idempotency_key(request):
+    """Valor do header Idempotency-Key, ou None"""
+    return request.headers.get(IDEMPOTENCY_HEADER)
+
+
+def get_caller(request):
+    """Dono da chave: o usuário autenticado ou, sem login, o IP do cliente"""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    return f"ip:{_ident.get_ident(request)}"[:100]
+
+
+def bound_payment_id(request):
+    """Id do Payment criado por uma tentativa anterior com a mesma chave, ou None"""
+    record = getattr(request, RECORD_ATTRIBUTE, None)
+    return record.payment_id if record is not None else None
+
+
+def bind_payment(request, payment):
+    """Associa o Payment recém-criado à chave da requisição (se houver)"""
+    record = getattr(request, RECORD_ATTRIBUTE, None)
+    if record is not None and record.payment_id != payment.id:
+        IdempotencyKey.objects.filter(id=record.id).update(payment=payment)
+        record.payment_id = payment.id
+
+
+def request_hash(request):
+    """sha256 de método, path e corpo: a mesma chave com outro corpo é erro do cliente"""
+    digest = hashlib.sha256(f"{request.method} {request.path}\n".encode())
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def json_content_response(content, status_code, headers=None):
+    return HttpResponse(content, status=status_code, content_type='application/json', headers=headers)
+
+
+def error_response(message, status_code, headers=None):
+    return json_content_response(JSONRenderer().render({'error': message}), status_code, headers)
+
+
+def response_content(response):
+    """Corpo JSON da resposta (Response do DRF ainda não foi renderizada)"""
+    if isinstance(response, Response):
+        return JSONRenderer().render(response.data)
+    return response.content
+
+
+def begin_request(scope, caller, key, fingerprint):
+    """Reserva a chave para esta requisição.
+
+    Retorna (registro, None) quando a requisição deve ser processada, ou
+    (None, resposta) com a resposta guardada (replay), 409 se a primeira
+    requisição ainda está em andamento ou 422 se a chave veio com outro corpo.
+    """
+    ttl = timedelta(seconds=getattr(settings, 'PAGBANK_IDEMPOTENCY_TTL', 86400))
+    lock_timeout = timedelta(seconds=settings.PAGBANK_IDEMPOTENCY_LOCK_TIMEOUT)
+    lookup = {'scope': scope, 'caller': caller, 'key': key}
+
+    for _ in range(2):
+        now = timezone.now()
+        # Lê antes de inserir: retries e replays não pagam um INSERT que falha
+        record = IdempotencyKey.objects.filter(**lookup).first()
+        if record is not None:
+            break
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    **lookup, request_hash=fingerprint, locked_at=now, expires_at=now + ttl
+                )
+            return record, None
+        except IntegrityError:
+            # Outra requisição com a mesma chave inseriu entre a leitura e o INSERT
+            pass
+    else:
+        return None, error_response('Requisição com esta Idempotency-Key em andamento', status.HTTP_409_CONFLICT)
+
+    expired = record.expires_at <= now
+    stale = record.status == 'processing' and record.locked_at <= now - lock_timeout
+    released = record.status == 'released'
+    if expired or ((stale or released) and record.request_hash == fingerprint):
+        # Chave expirada, liberada por um 5xx, ou trava de um worker que morreu
+        # no meio da requisição: assume a linha com um UPDATE condicional (só um
+        # retry concorrente ganha). Só a chave expirada esquece o pagamento
+        payment = {'payment': None} if expired else {}
+        taken = IdempotencyKey.objects.filter(
+            id=record.id, status=record.status, locked_at=record.locked_at
+        ).update(
+            request_hash=fingerprint, status='processing', response_status=None, response_body='',
+            locked_at=now, expires_at=now + ttl, **payment
+        )
+        if taken:
+            record.request_hash, record.status, record.locked_at = fingerprint, 'processing', now
+            if expired:
+                record.payment_id = None
+            return record, None
+        return None, error_response(
+            'Requisição com esta Idempotency-Key em andamento', status.HTTP_409_CONFLICT, {'Retry-After': '1'}
+        )
+
+    if record.request_hash != fingerprint:
+        return None, error_response(
+            'Idempotency-Key já usada com outro corpo de requisição', status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    if record.status == 'processing':
+        return None, error_response(
+            'Requisição com esta Idempotency-Key em andamento', status.HTTP_409_CONFLICT, {'Retry-After': '1'}
+        )
+
+    logger.info(f"Idempotency-Key {scope}:{key} repetida; devolvendo resposta original")
+    return None, json_content_response(
+        record.response_body, record.response_status, {'Idempotent-Replayed': 'true'}
+    )
+
+
+def finish_request(record, response):
+    """Guarda a resposta; erros 5xx liberam a chave para o cliente tentar de novo
+    (mantendo o pagamento associado a ela)"""
+    if response.status_code >= 500:
+        release_request(record)
+        return
+    IdempotencyKey.objects.filter(id=record.id).update(
+        status='completed',
+        response_status=response.status_code,
+        response_body=response_content(response).decode('utf-8'),
+    )
+
+
+def release_request(record):
+    IdempotencyKey.objects.filter(id=record.id, status='processing').update(status='released')
+
+
+def start(scope, request):
+    """Valida a chave e reserva; retorna (registro, resposta) como begin_request.
+    O registro reservado fica em request.idempotency_record para a view."""
+    key = get_idempotency_key(request)
+    if not key or len(key) > MAX_KEY_LENGTH:
+        return None, error_response(
+            f'{IDEMPOTENCY_HEADER} deve ter de 1 a {MAX_KEY_LENGTH} caracteres', status.HTTP_400_BAD_REQUEST
+        )
+    record, response = begin_request(scope, get_caller(request), key, request_hash(request))
+    if record is not None:
+        setattr(request, RECORD_ATTRIBUTE, record)
+    return record, response
+
+
+def idempotent(scope):
+    """Decorator de views POST (funções ou métodos, sync ou async) que honra
+    o header Idempotency-Key. A requisição é o último argumento posicional."""
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(*args, **kwargs):
+                request = args[-1]
+                if get_idempotency_key(request) is None:
+                    return await view(*args, **kwargs)
+
+                record, response = await sync_to_async(start)(scope, request)
+                if response is not None:
+                    return response
+                try:
+                    response = await view(*args, **kwargs)
+                except BaseException:
+                    await sync_to_async(release_request)(record)
+                    raise
+                await sync_to_async(finish_request)(record, response)
+                return response
+
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            request = args[-1]
+            if get_idempotency_key(request) is None:
+                return view(*args, **kwargs)
+
+            record, response = start(scope, request)
+            if response is not None:
+                return response
+            try:
+                response = view(*args, **kwargs)
+            except BaseException:
+                release_request(record)
+                raise
+            finish_request(record, response)
+            return response
+
+        return wrapper
+    return decorator
+
+
+def purge_expired():
+    """Remove chaves expiradas; retorna quantas foram apagadas"""
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
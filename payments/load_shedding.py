@@ -0,0 +1,138 @@
+"""Descarte de carga por prioridade quando o worker está saturado.
+
+LoadSheddingMiddleware conta as requisições em andamento no processo. Até
+PAGBANK_SHED_MAX_CONCURRENCY - PAGBANK_SHED_RESERVED qualquer requisição
+entra; acima disso só as críticas (webhook do PagBank e health checks)
+usam as vagas reservadas, e as demais recebem 503 com Retry-After na hora,
+sem esperar atrás de requisições que já estão presas no gateway. Assim o
+webhook e o health check do balanceador continuam respondendo mesmo com
+os endpoints de pagamento lotados.
+
+A URL só é resolvida quando o processo já passou da faixa livre. O limite
+é por processo, como os workers: com N workers a capacidade total é N vezes
+a configurada.
+"""
+import logging
+import threading
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+
+from .counters import Counters
+
+logger = logging.getLogger(__name__)
+
+CRITICAL = 'critical'
+NORMAL = 'normal'
+
+# Rotas (nomes em payments/urls.py) que sempre têm vaga reservada; as
+# métricas também, para a saturação continuar visível
+CRITICAL_URL_NAMES = frozenset({
+    'pagbank-webhook',
+    'pagseguro-webhook-compat',
+    'pagbank-webhook-compat',
+    'health-check',
+    'pagbank-health-detailed',
+    'metrics',
+})
+
+
+class LoadShedStats(Counters):
+    """Contadores do processo para requisições admitidas e descartadas"""
+
+    FIELDS = ('admitted', 'admitted_reserved', 'shed')
+
+
+def request_priority(request):
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return NORMAL
+    return CRITICAL if match.url_name in CRITICAL_URL_NAMES else NORMAL
+
+
+class AdmissionGate:
+    """Vagas de requisições em andamento, com `reserved` só para as críticas"""
+
+    def __init__(self, limit, reserved, stats=None):
+        self.limit = limit
+        self.open_limit = max(0, limit - reserved)
+        self.stats = stats or LoadShedStats()
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def enter(self, request):
+        """Ocupa uma vaga; False se a requisição deve ser descartada"""
+        with self._lock:
+            if self.in_flight < self.open_limit:
+                self.in_flight += 1
+                self.stats.increment('admitted')
+                return True
+        if request_priority(request) == CRITICAL:
+            with self._lock:
+                if self.in_flight < self.limit:
+                    self.in_flight += 1
+                    self.stats.increment('admitted_reserved')
+                    return True
+        self.stats.increment('shed')
+        return False
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+stats = LoadShedStats()
+
+
+def shed_response():
+    retry_after = getattr(settings, 'PAGBANK_SHED_RETRY_AFTER', 1)
+    return HttpResponse(
+        JSONRenderer().render({'error': 'Servidor sobrecarregado, tente novamente', 'retry_after': retry_after}),
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content_type='application/json',
+        headers={'Retry-After': str(retry_after)},
+    )
+
+
+class LoadSheddingMiddleware:
+    """Middleware sync/async; desligado com PAGBANK_SHED_MAX_CONCURRENCY = 0"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        limit = getattr(settings, 'PAGBANK_SHED_MAX_CONCURRENCY', 0)
+        self.gate = AdmissionGate(limit, getattr(settings, 'PAGBANK_SHED_RESERVED', 2), stats) if limit > 0 else None
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if self.gate is None:
+            return self.get_response(request)
+        if not self.gate.enter(request):
+            logger.warning(f"Requisição descartada por sobrecarga: {request.method} {request.path}")
+            return shed_response()
+        try:
+            return self.get_response(request)
+        finally:
+            self.gate.leave()
+
+    async def __acall__(self, request):
+        if self.gate is None:
+            return await self.get_response(request)
+        if not self.gate.enter(request):
+            logger.warning(f"Requisição descartada por sobrecarga: {request.method} {request.path}")
+            return shed_response()
+        try:
+            return await self.get_response(request)
+        finally:
+            self.gate.leave()
@@ -0,0 +1,55 @@
+import json
+import sys
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.services import PagBankService
+
+
+class Command(BaseCommand):
+    help = "Aplica um arquivo JSONL de notificações PagBank v4 (uma por linha) em lotes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Arquivo JSONL ('-' para stdin)")
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Notificações aplicadas por transação'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            stream = sys.stdin if path == '-' else open(path, encoding='utf-8')
+        except OSError as e:
+            raise CommandError(f"Não foi possível abrir {path}: {e}")
+
+        service = PagBankService()
+        totals = Counter()
+        batch = []
+        started = time.monotonic()
+
+        with stream:
+            for line_number, line in enumerate(stream, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    batch.append(json.loads(line))
+                except ValueError:
+                    self.stderr.write(f"Linha {line_number}: JSON inválido, ignorada")
+                    totals['invalid'] += 1
+                    continue
+
+                if len(batch) >= options['batch_size']:
+                    totals.update(service.process_webhooks(batch))
+                    batch = []
+
+            if batch:
+                totals.update(service.process_webhooks(batch))
+
+        elapsed = time.monotonic() - started
+        summary = ', '.join(f"{outcome}: {count}" for outcome, count in sorted(totals.items()))
+        self.stdout.write(self.style.SUCCESS(
+            f"{sum(totals.values())} notificações em {elapsed:.1f}s ({summary or 'nenhuma'})"
+        ))
@@ -0,0 +1,57 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from payments.services import PagBankService
+from payments.webhook_queue import get_webhook_queue, process_batch
+
+
+class Command(BaseCommand):
+    help = "Drena a fila de webhooks do PagBank em lotes e aplica as mudanças de status"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int,
+            default=getattr(settings, 'PAGBANK_WEBHOOK_BATCH_SIZE', 100),
+            help='Eventos reservados por lote'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float,
+            default=getattr(settings, 'PAGBANK_WEBHOOK_POLL_INTERVAL', 1.0),
+            help='Espera (s) quando a fila está vazia'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Drena a fila até esvaziar e termina'
+        )
+
+    def handle(self, *args, **options):
+        queue = get_webhook_queue()
+        service = PagBankService()
+        max_attempts = getattr(settings, 'PAGBANK_WEBHOOK_MAX_ATTEMPTS', 5)
+        visibility_timeout = getattr(settings, 'PAGBANK_WEBHOOK_VISIBILITY_TIMEOUT', 300)
+
+        processed = failed = 0
+        started = time.monotonic()
+        self.stdout.write(f"Processando webhooks em lotes de {options['batch_size']}...")
+
+        try:
+            while True:
+                queue.requeue_stale(visibility_timeout, max_attempts)
+                done, errors = process_batch(queue, service, options['batch_size'], max_attempts)
+                processed += done
+                failed += errors
+
+                if done or errors:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{processed} processados, {failed} com falha em {elapsed:.1f}s"
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from payments.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = "Remove as Idempotency-Keys expiradas (PAGBANK_IDEMPOTENCY_TTL)"
+
+    def handle(self, *args, **options):
+        deleted = purge_expired()
+        self.stdout.write(self.style.SUCCESS(f"{deleted} chaves expiradas removidas"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from payments.webhook_dedupe import purge_expired
+
+
+class Command(BaseCommand):
+    help = "Remove as chaves de deduplicação de webhooks mais antigas que PAGBANK_WEBHOOK_DEDUPE_TTL"
+
+    def handle(self, *args, **options):
+        deleted = purge_expired()
+        self.stdout.write(self.style.SUCCESS(f"{deleted} chaves de webhooks removidas"))
@@ -0,0 +1,83 @@
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from payments.reconcile import FileCheckpoint, Reconciler, stale_pending_chunks
+from payments.services import PagBankService
+
+
+class Command(BaseCommand):
+    help = "Consulta no PagBank os pagamentos pendentes antigos e aplica os status em lote"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than', type=int,
+            default=getattr(settings, 'PAGBANK_RECONCILE_MIN_AGE', 900),
+            help='Só pagamentos pendentes criados há mais de N segundos'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int,
+            default=getattr(settings, 'PAGBANK_RECONCILE_CHUNK_SIZE', 200),
+            help='Pagamentos lidos e aplicados por bloco'
+        )
+        parser.add_argument(
+            '--concurrency', type=int,
+            default=getattr(settings, 'PAGBANK_RECONCILE_CONCURRENCY', 10),
+            help='Consultas simultâneas ao PagBank'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default=getattr(settings, 'PAGBANK_RECONCILE_CHECKPOINT', '.reconcile_checkpoint.json'),
+            help='Arquivo com a posição da varredura'
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Ignora o checkpoint e varre desde o início'
+        )
+
+    def handle(self, *args, **options):
+        checkpoint = FileCheckpoint(options['checkpoint'])
+        position = None if options['restart'] else checkpoint.load()
+        cutoff = timezone.now() - timedelta(seconds=options['older_than'])
+        reconciler = Reconciler(PagBankService(), options['concurrency'])
+
+        if position is not None:
+            self.stdout.write(f"Retomando após {position[0].isoformat()} ({position[1]})")
+
+        scanned = 0
+        totals = Counter()
+        finished = False
+        started = time.monotonic()
+        try:
+            for rows in stale_pending_chunks(cutoff, options['chunk_size'], position):
+                outcomes = reconciler.reconcile_chunk(rows)
+                totals.update(outcomes)
+                scanned += len(rows)
+                if outcomes.get('circuit_open'):
+                    # Checkpoint fica antes deste bloco: a próxima execução o refaz
+                    self.stderr.write("Circuito do PagBank aberto; interrompendo a reconciliação")
+                    break
+                checkpoint.save((rows[-1][1], rows[-1][0]))
+                if options['verbosity'] > 1:
+                    self.stdout.write(f"{scanned} pagamentos verificados")
+            else:
+                finished = True
+        except KeyboardInterrupt:
+            pass
+        finally:
+            reconciler.close()
+
+        if finished:
+            checkpoint.clear()
+
+        elapsed = max(time.monotonic() - started, 1e-9)
+        summary = ', '.join(f"{outcome}: {count}" for outcome, count in sorted(totals.items()))
+        self.stdout.write(self.style.SUCCESS(
+            f"{scanned} pagamentos verificados, {reconciler.gateway_calls} consultas ao PagBank "
+            f"em {elapsed:.1f}s ({scanned / elapsed:.1f} linhas/s, "
+            f"{reconciler.gateway_calls / elapsed:.1f} consultas/s; {summary or 'nenhuma mudança'})"
+        ))
@@ -0,0 +1,386 @@
+"""Métricas no formato texto do Prometheus em GET /api/metrics/.
+
+- Chamadas ao PagBank: histograma de latência, respostas por status e
+  timeouts, por operação (create_order, create_charge, get_order, ...).
+- Views: requisições, latência, queries e tempo de banco por rota.
+- Webhooks: atraso entre o recebimento e a aplicação pelo worker.
+- Contadores do processo de outros módulos (counters.Counters: retry,
+  limites, descarte de carga, logs, traces, perfis).
+
+Cada thread escreve só no próprio shard (um dict), então registrar uma
+métrica não pega lock: a leitura soma os shards. Com vários processos
+(workers do gunicorn/uvicorn, process_webhooks), PAGBANK_METRICS_DIR aponta
+um diretório compartilhado: cada processo grava ali o seu snapshot a cada
+PAGBANK_METRICS_FLUSH_INTERVAL segundos e o endpoint soma todos os
+arquivos. Arquivos de processos que morreram continuam contando (os
+contadores não voltam para trás); limpe o diretório ao subir o deploy.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import load_shedding, profiling, rate_limit, retry, structured_logging, throttling, tracing
+from .counters import Counters
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LAG_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+
+class Registry:
+    """Métricas do processo, com um shard por thread"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    def add_counters(self, name, counters):
+        """Expõe um counters.Counters como <name>_<campo>_total"""
+        if not isinstance(counters, Counters):
+            raise TypeError(f"{name}: esperado counters.Counters, recebido {type(counters).__name__}")
+        self.collectors.append((name, counters))
+
+    def shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                # Threads que terminaram não escrevem mais: o shard vai para _retired
+                alive = []
+                for thread, old in self._shards:
+                    if thread.is_alive():
+                        alive.append((thread, old))
+                    else:
+                        merge(self._retired, old)
+                alive.append((threading.current_thread(), shard))
+                self._shards = alive
+            return shard
+
+    def samples(self):
+        """{(nome, valores dos labels): valor ou [contagens por bucket..., soma]}"""
+        with self._lock:
+            shards = [shard.copy() for _, shard in self._shards]
+            total = {}
+            merge(total, self._retired)
+        for shard in shards:
+            merge(total, shard)
+        for name, counters in self.collectors:
+            for field, value in counters.snapshot().items():
+                total[(f"{name}_{field}_total", ())] = value
+        return total
+
+
+def merge(total, samples):
+    for key, value in samples.items():
+        current = total.get(key)
+        if current is None:
+            total[key] = list(value) if isinstance(value, list) else value
+        elif isinstance(value, list):
+            total[key] = [a + b for a, b in zip(current, value)]
+        else:
+            total[key] = current + value
+
+
+registry = Registry()
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=(), registry=registry):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.registry = registry
+        registry.register(self)
+
+    def inc(self, *label_values, amount=1):
+        shard = self.registry.shard()
+        key = (self.name, label_values)
+        shard[key] = shard.get(key, 0) + amount
+
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS, registry=registry):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.registry = registry
+        registry.register(self)
+
+    def observe(self, value, *label_values):
+        shard = self.registry.shard()
+        key = (self.name, label_values)
+        counts = shard.get(key)
+        if counts is None:
+            # um contador por bucket (+Inf no fim) e a soma
+            counts = shard[key] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+
+gateway_duration = Histogram(
+    'pagbank_request_duration_seconds', 'Latência de cada tentativa de chamada ao PagBank', ('operation',)
+)
+gateway_responses = Counter(
+    'pagbank_responses_total', 'Respostas do PagBank por status HTTP', ('operation', 'status')
+)
+gateway_timeouts = Counter('pagbank_timeouts_total', 'Chamadas ao PagBank que estouraram o timeout', ('operation',))
+gateway_errors = Counter(
+    'pagbank_connection_errors_total', 'Chamadas ao PagBank sem resposta (conexão recusada, reset, ...)',
+    ('operation',)
+)
+view_requests = Counter('http_requests_total', 'Requisições por rota, método e status', ('view', 'method', 'status'))
+view_duration = Histogram('http_request_duration_seconds', 'Latência das requisições por rota', ('view',))
+view_queries = Counter('http_db_queries_total', 'Queries executadas pelas requisições, por rota', ('view',))
+view_db_seconds = Counter('http_db_seconds_total', 'Tempo em queries das requisições, por rota', ('view',))
+webhook_lag = Histogram(
+    'pagbank_webhook_lag_seconds', 'Tempo entre o recebimento do webhook e a aplicação pelo worker',
+    buckets=LAG_BUCKETS
+)
+
+# Contadores do processo de outros módulos, expostos como <nome>_<campo>_total
+for name, counters in (
+    ('pagbank_retry', retry.stats),
+    ('pagbank_rate_limit', rate_limit.stats),
+    ('http_throttle', throttling.stats),
+    ('http_load_shed', load_shedding.stats),
+    ('payments_log', structured_logging.stats),
+    ('http_trace', tracing.stats),
+    ('http_profile', profiling.stats),
+):
+    registry.add_counters(name, counters)
+
+
+def record_gateway_call(operation, started, status):
+    """Uma tentativa de chamada ao PagBank; status é o código HTTP, 'timeout' ou 'error'"""
+    elapsed = time.perf_counter() - started
+    gateway_duration.observe(elapsed, operation)
+    profiling.record_gateway_call(operation, elapsed, status)
+    if status == 'timeout':
+        gateway_timeouts.inc(operation)
+    elif status == 'error':
+        gateway_errors.inc(operation)
+    else:
+        gateway_responses.inc(operation, str(status))
+    ensure_exporter()
+
+
+def observe_webhook_lag(events, now):
+    """Atraso de cada evento aplicado (received_at até agora)"""
+    for event in events:
+        webhook_lag.observe(max(0.0, (now - event.received_at).total_seconds()))
+    ensure_exporter()
+
+
+# [queries, segundos] da requisição atual; sync_to_async copia o contexto,
+# então as queries das views async também caem na requisição certa
+_request_queries = contextvars.ContextVar('pagbank_request_queries', default=None)
+
+
+def query_timer(execute, sql, params, many, context):
+    counter = _request_queries.get()
+    if counter is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        counter[0] += 1
+        counter[1] += time.perf_counter() - started
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """Receiver de connection_created (ligado em PaymentsConfig.ready)"""
+    if query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_timer)
+
+
+class MetricsMiddleware:
+    """Latência, status e queries de cada requisição, pelo nome da rota"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'PAGBANK_METRICS_ENABLED', True)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def record(self, request, response, started, counter):
+        match = getattr(request, 'resolver_match', None)
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        view_duration.observe(time.perf_counter() - started, view)
+        view_requests.inc(view, request.method, str(response.status_code))
+        view_queries.inc(view, amount=counter[0])
+        view_db_seconds.inc(view, amount=counter[1])
+        ensure_exporter()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        counter = [0, 0.0]
+        token = _request_queries.set(counter)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_queries.reset(token)
+        self.record(request, response, started, counter)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        counter = [0, 0.0]
+        token = _request_queries.set(counter)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_queries.reset(token)
+        self.record(request, response, started, counter)
+        return response
+
+
+def encode_samples(samples):
+    return [[name, list(labels), value] for (name, labels), value in samples.items()]
+
+
+def decode_samples(data):
+    return {(name, tuple(labels)): value for name, labels, value in data}
+
+
+class FileExporter:
+    """Grava o snapshot do processo em `directory` a cada `interval` segundos"""
+
+    def __init__(self, directory, interval=5.0, registry=registry):
+        self.directory = Path(directory)
+        self.interval = interval
+        self.registry = registry
+        self.pid = os.getpid()
+        self.path = self.directory / f"{self.pid}-{uuid.uuid4().hex[:8]}.json"
+        self._stop = threading.Event()
+
+    def start(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        threading.Thread(target=self._run, name='metrics-exporter', daemon=True).start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
+
+    def flush(self):
+        temp_path = self.path.with_suffix('.tmp')
+        try:
+            temp_path.write_text(json.dumps(encode_samples(self.registry.samples())), encoding='utf-8')
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Não foi possível gravar as métricas em {self.path}: {str(e)}")
+
+    def collect(self):
+        """Soma dos snapshots de todos os processos; o deste vem da memória"""
+        total = self.registry.samples()
+        for path in self.directory.glob('*.json'):
+            if path == self.path:
+                continue
+            try:
+                merge(total, decode_samples(json.loads(path.read_text(encoding='utf-8'))))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Snapshot de métricas {path} ignorado: {str(e)}")
+        return total
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def ensure_exporter():
+    """Exportador do processo se PAGBANK_METRICS_DIR estiver configurado (um por pid)"""
+    global _exporter
+    directory = getattr(settings, 'PAGBANK_METRICS_DIR', '')
+    if not directory:
+        return None
+    if _exporter is None or _exporter.pid != os.getpid():
+        with _exporter_lock:
+            if _exporter is None or _exporter.pid != os.getpid():
+                _exporter = FileExporter(directory, getattr(settings, 'PAGBANK_METRICS_FLUSH_INTERVAL', 5.0))
+                _exporter.start()
+    return _exporter
+
+
+def collect():
+    exporter = ensure_exporter()
+    return exporter.collect() if exporter else registry.samples()
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(samples=None, registry=registry):
+    """Texto de exposição do Prometheus (versão 0.0.4)"""
+    samples = collect() if samples is None else samples
+    by_name = {}
+    for (name, labels), value in sorted(samples.items()):
+        by_name.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name, entries in by_name.items():
+        metric = registry.metrics.get(name)
+        if isinstance(metric, Histogram):
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, counts in entries:
+                cumulative = 0
+                for bound, count in zip((*metric.buckets, '+Inf'), counts):
+                    cumulative += count
+                    le = (('le', bound if bound == '+Inf' else format_value(float(bound))),)
+                    lines.append(f"{name}_bucket{format_labels(metric.labels, labels, le)} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(metric.labels, labels)} {format_value(counts[-1])}")
+                lines.append(f"{name}_count{format_labels(metric.labels, labels)} {cumulative}")
+            continue
+        if metric is not None:
+            lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} counter")
+        label_names = metric.labels if metric is not None else ()
+        for labels, value in entries:
+            lines.append(f"{name}{format_labels(label_names, labels)} {format_value(value)}")
+    return '\n'.join(lines) + '\n'
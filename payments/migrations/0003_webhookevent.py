@@ -0,0 +1,32 @@
+# Generated by Django 5.2.3 on 2026-10-18 07:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0002_remove_payment_mercadopago_id_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('body', models.TextField()),
+                ('content_type', models.CharField(blank=True, max_length=100)),
+                ('status', models.CharField(choices=[('pending', 'Pendente'), ('processing', 'Processando'), ('done', 'Processado'), ('failed', 'Falhou')], default='pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('claim_token', models.CharField(blank=True, max_length=64, null=True)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['status', 'id'], name='payments_we_status_db1844_idx'), models.Index(fields=['claim_token'], name='payments_we_claim_t_600c12_idx')],
+            },
+        ),
+    ]
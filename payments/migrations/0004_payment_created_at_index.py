@@ -0,0 +1,17 @@
+# Generated by Django 5.2.3 on 2026-10-18 07:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0003_webhookevent'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['created_at'], name='payments_pa_created_b8a300_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.3 on 2026-10-18 07:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0004_payment_created_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='amount_cents',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Número de itens'),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='total_cents',
+            field=models.BigIntegerField(default=0, editable=False, help_text='Soma dos itens em centavos'),
+        ),
+        migrations.AddField(
+            model_name='paymentitem',
+            name='total_cents',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='paymentitem',
+            name='unit_price_cents',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,66 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations, transaction
+
+CHUNK_SIZE = 1000
+
+
+def to_cents(value):
+    return int((Decimal(str(value)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def backfill_cents_totals(apps, schema_editor):
+    """Preenche os campos em centavos em lotes por chave primária.
+
+    Cada lote roda na sua própria transação (a migração não é atômica), então
+    nenhuma transação longa segura a tabela durante o backfill.
+    """
+    Payment = apps.get_model('payments', 'Payment')
+    PaymentItem = apps.get_model('payments', 'PaymentItem')
+    db = schema_editor.connection.alias
+
+    last_id = None
+    while True:
+        payments = Payment.objects.using(db).order_by('id').only('id', 'amount')
+        if last_id is not None:
+            payments = payments.filter(id__gt=last_id)
+        payments = list(payments[:CHUNK_SIZE])
+        if not payments:
+            break
+        last_id = payments[-1].id
+
+        with transaction.atomic(using=db):
+            items = list(
+                PaymentItem.objects.using(db)
+                .filter(payment_id__in=[payment.id for payment in payments])
+                .only('id', 'payment_id', 'quantity', 'unit_price')
+            )
+            totals = {}
+            for item in items:
+                item.unit_price_cents = to_cents(item.unit_price)
+                item.total_cents = item.quantity * item.unit_price_cents
+                total, count = totals.get(item.payment_id, (0, 0))
+                totals[item.payment_id] = (total + item.total_cents, count + 1)
+
+            for payment in payments:
+                payment.amount_cents = to_cents(payment.amount)
+                payment.total_cents, payment.item_count = totals.get(payment.id, (0, 0))
+
+            PaymentItem.objects.using(db).bulk_update(
+                items, ['unit_price_cents', 'total_cents'], batch_size=CHUNK_SIZE
+            )
+            Payment.objects.using(db).bulk_update(
+                payments, ['amount_cents', 'total_cents', 'item_count'], batch_size=CHUNK_SIZE
+            )
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('payments', '0005_payment_cents_totals'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_cents_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.3 on 2026-10-18 07:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0006_backfill_cents_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=50)),
+                ('key', models.CharField(max_length=255)),
+                ('request_hash', models.CharField(max_length=64)),
+                ('status', models.CharField(choices=[('processing', 'Processando'), ('completed', 'Concluída')], default='processing', max_length=20)),
+                ('response_status', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('response_body', models.TextField(blank=True)),
+                ('locked_at', models.DateTimeField()),
+                ('expires_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['expires_at'], name='payments_id_expires_2ca9c9_idx')],
+                'constraints': [models.UniqueConstraint(fields=('scope', 'key'), name='payments_idempotency_scope_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0008_payment_gateway_statuses'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64)),
+                ('processed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['processed_at'], name='payments_we_process_d843c4_idx')],
+                'constraints': [models.UniqueConstraint(fields=('key',), name='payments_webhook_delivery_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.3 on 2026-10-18 09:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0009_webhookdelivery'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='idempotencykey',
+            name='payments_idempotency_scope_key',
+        ),
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='caller',
+            field=models.CharField(default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='payment',
+            field=models.ForeignKey(blank=True, help_text='Pagamento criado com esta chave; reaproveitado pelo retry após um 5xx', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='payments.payment'),
+        ),
+        migrations.AlterField(
+            model_name='idempotencykey',
+            name='status',
+            field=models.CharField(choices=[('processing', 'Processando'), ('completed', 'Concluída'), ('released', 'Liberada')], default='processing', max_length=20),
+        ),
+        migrations.AddConstraint(
+            model_name='idempotencykey',
+            constraint=models.UniqueConstraint(fields=('scope', 'caller', 'key'), name='payments_idempotency_caller_key'),
+        ),
+    ]
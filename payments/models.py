@@ -1,8 +1,145 @@
-from django.db import models
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import models, transaction
+from django.db.models import Case, Count, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 import uuid
 
+from .tracing import traced
+
+def to_cents(value):
+    """Converte um valor em reais (Decimal, str ou número) para centavos inteiros"""
+    return int((Decimal(str(value)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+# Campos de CreatePaymentSerializer gravados no Payment
+PAYMENT_CREATE_FIELDS = ('amount', 'description', 'payer_email')
+
+def gateway_result_status(new_status):
+    """Expressão SQL do status após a resposta do PagBank: só sai de pending_gateway"""
+    return Case(When(status='pending_gateway', then=Value(new_status)), default=F('status'))
+
+class PaymentQuerySet(models.QuerySet):
+    def with_items(self):
+        """Carrega os itens com uma query extra para o lote inteiro (evita N+1 no serializer)"""
+        return self.prefetch_related('items')
+    
+    def _build_with_items(self, items, fields):
+        """Payment (ainda não salvo) e seus itens com os totais em centavos"""
+        items = [PaymentItem(**item) for item in items]
+        for item in items:
+            item.compute_cents()
+        payment = self.model(
+            total_cents=sum(item.total_cents for item in items),
+            item_count=len(items),
+            **fields
+        )
+        payment.amount_cents = to_cents(payment.amount)
+        for item in items:
+            item.payment = payment
+        return payment, items
+    
+    @traced('Payment.objects.create_with_items')
+    def create_with_items(self, items, **fields):
+        """Cria o pagamento e seus itens (bulk_create) com os totais já calculados.
+        
+        `items` são dicts com title, quantity e unit_price. Duas queries para
+        qualquer número de itens, em uma transação.
+        """
+        payment, items = self._build_with_items(items, fields)
+        with transaction.atomic(using=self.db):
+            payment.save(force_insert=True, using=self.db)
+            PaymentItem.objects.using(self.db).bulk_create(items)
+        return payment
+    
+    @traced('Payment.objects.bulk_create_with_items')
+    def bulk_create_with_items(self, payloads, batch_size=500, **defaults):
+        """Cria vários pagamentos e todos os seus itens com dois bulk_create.
+        
+        `payloads` são dicts com os campos do Payment e uma lista `items`
+        (ex.: validated_data de CreatePaymentSerializer(many=True)); `defaults`
+        vale para todos (ex.: status). Retorna os pagamentos na mesma ordem.
+        """
+        payments, all_items = [], []
+        for payload in payloads:
+            fields = {key: value for key, value in payload.items() if key in PAYMENT_CREATE_FIELDS}
+            fields = {**defaults, **fields}
+            payment, items = self._build_with_items(payload['items'], fields)
+            payments.append(payment)
+            all_items.extend(items)
+        
+        with transaction.atomic(using=self.db):
+            self.bulk_create(payments, batch_size=batch_size)
+            PaymentItem.objects.using(self.db).bulk_create(all_items, batch_size=batch_size)
+        return payments
+    
+    @traced('Payment.objects.record_gateway_result')
+    def record_gateway_result(self, payment_id, new_status, **fields):
+        """Grava o resultado da chamada ao PagBank com um único UPDATE.
+        
+        O status só sai de pending_gateway (para pending, gateway_failed ou o
+        status da cobrança); se um webhook já avançou o pagamento, o status
+        dele é mantido e só `fields` são gravados.
+        """
+        return self.filter(id=payment_id).update(
+            status=gateway_result_status(new_status), updated_at=timezone.now(), **fields
+        ) > 0
+    
+    async def arecord_gateway_result(self, payment_id, new_status, **fields):
+        """Versão async de record_gateway_result"""
+        return await self.filter(id=payment_id).aupdate(
+            status=gateway_result_status(new_status), updated_at=timezone.now(), **fields
+        ) > 0
+    
+    def refresh_totals(self):
+        """Recalcula total_cents e item_count a partir dos itens, com um único UPDATE"""
+        items = PaymentItem.objects.filter(payment=OuterRef('pk')).order_by().values('payment')
+        return self.update(
+            total_cents=Coalesce(Subquery(items.annotate(total=Sum('total_cents')).values('total')), 0),
+            item_count=Coalesce(Subquery(items.annotate(count=Count('id')).values('count')), 0),
+        )
+    
+    def _transition_kwargs(self, new_status, gateway_id):
+        """Filtro e campos do UPDATE condicional de transition_status"""
+        predecessors = [
+            old for old, allowed in self.model.STATUS_TRANSITIONS.items() if new_status in allowed
+        ]
+        values = {'status': new_status, 'updated_at': timezone.now()}
+        if gateway_id:
+            values['payment_gateway_id'] = gateway_id
+        return {'status__in': predecessors}, values
+    
+    def transition_status(self, payment_id, new_status, gateway_id=None):
+        """Muda o status com um único UPDATE ... WHERE id=? AND status IN (predecessores).
+        
+        Só toca status, payment_gateway_id e updated_at, sem ler a linha antes,
+        então entregas concorrentes não sobrescrevem umas às outras. Retorna
+        True se a transição aconteceu.
+        """
+        condition, values = self._transition_kwargs(new_status, gateway_id)
+        return self.filter(id=payment_id, **condition).update(**values) > 0
+    
+    async def atransition_status(self, payment_id, new_status, gateway_id=None):
+        """Versão async de transition_status"""
+        condition, values = self._transition_kwargs(new_status, gateway_id)
+        return await self.filter(id=payment_id, **condition).aupdate(**values) > 0
+    
+    def retry_gateway(self, payment_id):
+        """Volta gateway_failed para pending_gateway antes de repetir a chamada ao
+        PagBank para o mesmo pagamento (retry com a mesma Idempotency-Key)"""
+        return self.filter(id=payment_id, status='gateway_failed').update(
+            status='pending_gateway', updated_at=timezone.now()
+        ) > 0
+    
+    def set_gateway_id(self, payment_id, gateway_id):
+        """Grava o id no gateway só se ainda não for esse (UPDATE condicional)"""
+        return self.filter(id=payment_id).exclude(payment_gateway_id=gateway_id).update(
+            payment_gateway_id=gateway_id, updated_at=timezone.now()
+        ) > 0
+
 class Payment(models.Model):
     STATUS_CHOICES = [
+        ('pending_gateway', 'Aguardando PagBank'),
+        ('gateway_failed', 'Falha no PagBank'),
         ('pending', 'Pendente'),
         ('approved', 'Aprovado'),
         ('rejected', 'Rejeitado'),
@@ -10,6 +147,23 @@ class Payment(models.Model):
         ('refunded', 'Reembolsado'),
     ]
     
+    # Transições aceitas; qualquer outra (ex.: approved -> pending) é regressão,
+    # tipicamente uma notificação antiga entregue fora de ordem
+    STATUS_TRANSITIONS = {
+        # Gravado antes da chamada ao PagBank; a resposta (ou um webhook que
+        # chegue antes dela) decide o próximo status
+        'pending_gateway': {'pending', 'gateway_failed', 'approved', 'rejected', 'cancelled'},
+        # Falha ou timeout do nosso lado não quer dizer que o PagBank não criou
+        # a ordem; o webhook (ou a reconciliação) com o reference_id deste
+        # pagamento ainda traz o status real
+        'gateway_failed': {'pending', 'approved', 'rejected', 'cancelled'},
+        'pending': {'approved', 'rejected', 'cancelled'},
+        'approved': {'refunded', 'cancelled'},
+        'rejected': {'approved'},  # nova cobrança na mesma ordem
+        'cancelled': set(),
+        'refunded': set(),
+    }
+    
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     
     # SUGESTÃO: Renomear para ser mais genérico
@@ -23,6 +177,10 @@ class Payment(models.Model):
     )
     
     amount = models.DecimalField(max_digits=10, decimal_places=2)
+    # Valores desnormalizados em centavos: leitura sem cálculo e agregações em SQL
+    amount_cents = models.BigIntegerField(default=0, editable=False)
+    total_cents = models.BigIntegerField(default=0, editable=False, help_text="Soma dos itens em centavos")
+    item_count = models.PositiveIntegerField(default=0, editable=False, help_text="Número de itens")
     description = models.CharField(max_length=255)
     payer_email = models.EmailField()
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
@@ -30,6 +188,8 @@ class Payment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = PaymentQuerySet.as_manager()
+    
     # SUGESTÕES DE MELHORIAS OPCIONAIS:
     
     # 1. Adicionar campo para o gateway usado
@@ -47,6 +207,7 @@ class Payment(models.Model):
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['created_at']),  # paginação por cursor sem filtro de status
             models.Index(fields=['payer_email']),
             models.Index(fields=['payment_gateway_id']),  # ou mercadopago_id
             models.Index(fields=['preference_id']),
@@ -55,6 +216,23 @@ class Payment(models.Model):
     def __str__(self):
         return f"Payment {self.id} - {self.status}"
     
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'amount' in update_fields:
+            self.amount_cents = to_cents(self.amount)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'amount_cents'}
+        super().save(*args, **kwargs)
+    
+    @property
+    def total_amount(self):
+        """Soma dos itens em reais"""
+        return Decimal(self.total_cents).scaleb(-2)
+    
+    def can_transition_to(self, new_status):
+        """True se new_status é um avanço válido a partir do status atual"""
+        return new_status in self.STATUS_TRANSITIONS.get(self.status, ())
+    
     # PROPRIEDADE PARA COMPATIBILIDADE
     @property
     def mercadopago_id(self):
@@ -71,6 +249,8 @@ class PaymentItem(models.Model):
     title = models.CharField(max_length=255)
     quantity = models.PositiveIntegerField(default=1)
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    unit_price_cents = models.BigIntegerField(default=0, editable=False)
+    total_cents = models.BigIntegerField(default=0, editable=False)
     
     # SUGESTÃO: Adicionar campo de SKU/código do produto
     # sku = models.CharField(max_length=100, blank=True, null=True)
@@ -78,7 +258,119 @@ class PaymentItem(models.Model):
     def __str__(self):
         return f"{self.title} - {self.quantity}x R${self.unit_price}"
     
+    def compute_cents(self):
+        self.unit_price_cents = to_cents(self.unit_price)
+        self.total_cents = self.quantity * self.unit_price_cents
+    
+    def save(self, *args, **kwargs):
+        """Salva o item e atualiza total_cents/item_count do pagamento"""
+        self.compute_cents()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            Payment.objects.filter(id=self.payment_id).refresh_totals()
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            Payment.objects.filter(id=self.payment_id).refresh_totals()
+        return result
+    
     @property
     def total_price(self):
-        """Calcula o preço total do item"""
-        return self.quantity * self.unit_price
\ No newline at end of file
+        """Preço total do item"""
+        return Decimal(self.total_cents).scaleb(-2)
+
+class WebhookEvent(models.Model):
+    """Notificação do PagBank recebida e ainda não (ou já) aplicada.
+
+    O webhook só grava o corpo bruto aqui e responde 200; o comando
+    process_webhooks aplica as mudanças de status em lotes.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pendente'),
+        ('processing', 'Processando'),
+        ('done', 'Processado'),
+        ('failed', 'Falhou'),
+    ]
+
+    body = models.TextField()
+    content_type = models.CharField(max_length=100, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    claim_token = models.CharField(max_length=64, null=True, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'id']),
+            models.Index(fields=['claim_token']),
+        ]
+
+    def __str__(self):
+        return f"WebhookEvent {self.id} - {self.status}"
+
+class WebhookDelivery(models.Model):
+    """Notificação do PagBank já aplicada, pela chave de deduplicação
+    (webhook_dedupe.event_key).
+
+    A chave é gravada na mesma transação que aplica a notificação; a unique
+    constraint impede que um reenvio seja aplicado de novo, mesmo com vários
+    workers e processos.
+    """
+    key = models.CharField(max_length=64)
+    processed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['key'], name='payments_webhook_delivery_key'),
+        ]
+        indexes = [
+            models.Index(fields=['processed_at']),
+        ]
+
+    def __str__(self):
+        return f"WebhookDelivery {self.key}"
+
+class IdempotencyKey(models.Model):
+    """Resposta guardada de um POST com header Idempotency-Key.
+
+    A chave vale por cliente (`caller`: usuário autenticado ou IP). A linha
+    é inserida antes de processar a requisição (a unique constraint funciona
+    como trava); ao terminar, a resposta é gravada e devolvida igual aos
+    retries do cliente até expires_at. Um 5xx libera a chave (released) sem
+    esquecer o pagamento criado, que o retry reaproveita.
+    """
+    STATUS_CHOICES = [
+        ('processing', 'Processando'),
+        ('completed', 'Concluída'),
+        ('released', 'Liberada'),
+    ]
+
+    scope = models.CharField(max_length=50)
+    caller = models.CharField(max_length=100, default='')
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='processing')
+    payment = models.ForeignKey(
+        Payment, null=True, blank=True, on_delete=models.SET_NULL, related_name='+',
+        help_text="Pagamento criado com esta chave; reaproveitado pelo retry após um 5xx"
+    )
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.TextField(blank=True)
+    locked_at = models.DateTimeField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'caller', 'key'], name='payments_idempotency_caller_key'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at']),
+        ]
+
+    def __str__(self):
+        return f"IdempotencyKey {self.scope}:{self.caller}:{self.key} - {self.status}"
@@ -0,0 +1,111 @@
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework import serializers
+from rest_framework.pagination import CursorPagination
+
+from .models import Payment
+
+
+class PaymentCursorPagination(CursorPagination):
+    """Paginação keyset por created_at (mais recentes primeiro).
+
+    Cada página é um `WHERE created_at < cursor ORDER BY created_at DESC
+    LIMIT n` sobre os índices de created_at, então o custo não cresce com a
+    profundidade como no OFFSET.
+    """
+    ordering = '-created_at'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+# Colunas necessárias para cada campo de PaymentSerializer em `fields=`
+PROJECTION_COLUMNS = {
+    'status_display': ('status',),
+    'items': (),
+    'total_amount': ('total_cents',),
+}
+
+# Campos que leem payment.items (carregados com prefetch)
+ITEM_FIELDS = {'items'}
+
+# Sempre carregadas: chave primária e posição do cursor
+REQUIRED_COLUMNS = ('id', 'created_at')
+
+
+def parse_fields(value, available):
+    """Lista de `fields=a,b,c`, ou None para todos os campos"""
+    if not value:
+        return None
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = sorted(set(fields) - set(available))
+    if unknown:
+        raise serializers.ValidationError({'fields': f"Campos desconhecidos: {', '.join(unknown)}"})
+    return fields
+
+
+def _parse_moment(value, param, end_of_day=False):
+    """Data/hora ISO 8601; uma data pura vira o início do dia (ou do dia seguinte)"""
+    try:
+        # A data pura primeiro: parse_datetime também aceita 'AAAA-MM-DD'
+        day = parse_date(value)
+        moment = None if day else parse_datetime(value)
+    except ValueError:
+        moment = day = None
+    if day is not None:
+        moment = datetime.combine(day + timedelta(days=1) if end_of_day else day, time.min)
+    if moment is None:
+        raise serializers.ValidationError({param: "Use uma data ou data/hora ISO 8601"})
+    if settings.USE_TZ and timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def filter_payments(queryset, params):
+    """Aplica os filtros de GET /api/payments/: status, payer_email, created_after, created_before"""
+    if params.get('status'):
+        statuses = [value for value in params['status'].split(',') if value]
+        valid = dict(Payment.STATUS_CHOICES)
+        invalid = [value for value in statuses if value not in valid]
+        if invalid:
+            raise serializers.ValidationError({'status': f"Status inválido: {', '.join(invalid)}"})
+        queryset = queryset.filter(status__in=statuses)
+
+    if params.get('payer_email'):
+        queryset = queryset.filter(payer_email=params['payer_email'])
+
+    # Comparações diretas com created_at para continuar usando os índices;
+    # created_before com uma data pura inclui o dia inteiro
+    if params.get('created_after'):
+        queryset = queryset.filter(created_at__gte=_parse_moment(params['created_after'], 'created_after'))
+
+    if params.get('created_before'):
+        queryset = queryset.filter(
+            created_at__lt=_parse_moment(params['created_before'], 'created_before', end_of_day=True)
+        )
+
+    return queryset
+
+
+def project_payments(queryset, fields):
+    """Carrega só as colunas usadas pelos campos pedidos em `fields=`, e os
+    itens só se algum campo pedido precisar deles"""
+    if fields is None:
+        return queryset.with_items()
+    columns = set(REQUIRED_COLUMNS)
+    for name in fields:
+        columns.update(PROJECTION_COLUMNS.get(name, (name,)))
+    queryset = queryset.only(*columns)
+    if ITEM_FIELDS.intersection(fields):
+        queryset = queryset.with_items()
+    return queryset
+
+
+def payment_list_queryset(params, available_fields):
+    """Queryset filtrado e projetado para a listagem, mais os campos pedidos"""
+    fields = parse_fields(params.get('fields'), available_fields)
+    queryset = filter_payments(Payment.objects.all(), params)
+    return project_payments(queryset, fields), fields
@@ -0,0 +1,303 @@
+"""Perfis de requisições lentas ou amostradas, para diagnóstico em produção.
+
+Opt-in (PAGBANK_PROFILING_ENABLED). ProfilingMiddleware guarda um perfil
+quando a requisição:
+
+- está na amostra: PAGBANK_PROFILE_SAMPLE_RATE das requisições cujo path
+  começa com PAGBANK_PROFILE_PATH_PREFIX (as rotas de pagamento) rodam sob
+  o cProfile, e o perfil guarda as funções com maior tempo acumulado e
+  com maior tempo próprio;
+- ou passou de PAGBANK_PROFILE_SLOW_MS. O cProfile precisa estar ligado
+  desde o início da requisição, então uma requisição lenta fora da amostra
+  é guardada só com as queries e as chamadas ao PagBank.
+
+Queries (SQL e duração) e chamadas ao PagBank (operação, status e duração)
+são coletadas em toda requisição enquanto o profiling está ligado. Sob
+ASGI o event loop intercala coroutines de várias requisições, então as
+views async não rodam sob o cProfile (só queries e chamadas).
+
+Só um cProfile fica ativo por processo: uma requisição amostrada enquanto
+outra está sob o profiler segue sem ele (contador `busy`). Falhas do
+profiler ou ao guardar o perfil viram um warning no log; a requisição
+nunca falha por causa do diagnóstico.
+
+Os perfis ficam em um buffer circular de PAGBANK_PROFILE_BUFFER_SIZE
+posições no cache PAGBANK_PROFILE_CACHE_ALIAS e são lidos em
+GET /api/profiles/, só para usuários staff. Sem CACHES configurado, esse
+cache é o LocMemCache padrão do Django, de cada processo: cada worker tem o
+seu buffer e GET /api/profiles/ mostra só o do worker que atendeu. Para ver
+os perfis de todos os workers, aponte o alias para um cache compartilhado
+(Redis, Memcached, banco).
+"""
+import contextvars
+import cProfile
+import logging
+import pstats
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils import timezone
+
+from .counters import Counters
+from .tracing import current_span
+
+logger = logging.getLogger(__name__)
+
+MAX_QUERIES = 200
+MAX_STATEMENT_LENGTH = 1000
+
+# Queries e chamadas ao PagBank da requisição atual; sync_to_async copia o
+# contexto, mas a lista é a mesma
+_capture = contextvars.ContextVar('pagbank_profile_capture', default=None)
+
+# Um cProfile por processo: dois profilers ao mesmo tempo disputam o hook de
+# profiling do interpretador (ValueError no Python 3.12+)
+_profiler_lock = threading.Lock()
+
+
+class ProfileStats(Counters):
+    """Contadores do processo para perfis capturados e guardados"""
+
+    FIELDS = ('sampled', 'slow', 'stored', 'busy', 'errors')
+
+
+stats = ProfileStats()
+
+
+class Capture:
+    __slots__ = ('queries', 'dropped_queries', 'gateway_calls')
+
+    def __init__(self):
+        self.queries = []
+        self.dropped_queries = 0
+        self.gateway_calls = []
+
+
+def query_recorder(execute, sql, params, many, context):
+    """execute_wrapper de todas as conexões: SQL e duração das queries capturadas"""
+    capture = _capture.get()
+    if capture is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if len(capture.queries) < MAX_QUERIES:
+            capture.queries.append({
+                'sql': sql[:MAX_STATEMENT_LENGTH],
+                'ms': round((time.perf_counter() - started) * 1000, 3),
+            })
+        else:
+            capture.dropped_queries += 1
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """Receiver de connection_created (ligado em PaymentsConfig.ready)"""
+    if query_recorder not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_recorder)
+
+
+def record_gateway_call(operation, seconds, status):
+    """Chamada ao PagBank da requisição atual (chamado por metrics.record_gateway_call)"""
+    capture = _capture.get()
+    if capture is not None:
+        capture.gateway_calls.append({'operation': operation, 'status': status, 'ms': round(seconds * 1000, 3)})
+
+
+def top_functions(profiler, limit):
+    """As `limit` funções com maior tempo acumulado e com maior tempo próprio"""
+    profile_stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, line, function), (_, ncalls, tottime, cumtime, _) in profile_stats.stats.items():
+        rows.append({
+            'function': f"{filename}:{line}({function})",
+            'calls': ncalls,
+            'tottime_ms': round(tottime * 1000, 3),
+            'cumtime_ms': round(cumtime * 1000, 3),
+        })
+    return {
+        'cumulative': sorted(rows, key=lambda row: row['cumtime_ms'], reverse=True)[:limit],
+        'tottime': sorted(rows, key=lambda row: row['tottime_ms'], reverse=True)[:limit],
+    }
+
+
+class ProfileBuffer:
+    """Buffer circular de perfis no cache do Django.
+
+    Um contador (add + incr, atômicos no cache) dá a posição de cada perfil;
+    o perfil N ocupa a posição N % size, sobrescrevendo o mais antigo.
+    """
+
+    def __init__(self, alias='default', size=50, timeout=86400, prefix='pagbank:profile'):
+        self.cache = caches[alias]
+        self.size = size
+        self.timeout = timeout
+        self.prefix = prefix
+
+    def _key(self, slot):
+        return f"{self.prefix}:{slot}"
+
+    def append(self, entry):
+        counter = f"{self.prefix}:seq"
+        self.cache.add(counter, 0, None)
+        entry['id'] = self.cache.incr(counter)
+        self.cache.set(self._key(entry['id'] % self.size), entry, self.timeout)
+        return entry['id']
+
+    def entries(self):
+        """Perfis guardados, do mais recente para o mais antigo"""
+        found = self.cache.get_many([self._key(slot) for slot in range(self.size)])
+        return sorted(found.values(), key=lambda entry: entry['id'], reverse=True)
+
+    def get(self, profile_id):
+        entry = self.cache.get(self._key(profile_id % self.size))
+        return entry if entry is not None and entry['id'] == profile_id else None
+
+
+def get_buffer():
+    return ProfileBuffer(
+        getattr(settings, 'PAGBANK_PROFILE_CACHE_ALIAS', 'default'),
+        getattr(settings, 'PAGBANK_PROFILE_BUFFER_SIZE', 50),
+    )
+
+
+def summary(entry):
+    """Campos de um perfil sem as listas (para GET /api/profiles/)"""
+    return {
+        key: value for key, value in entry.items()
+        if key not in ('queries', 'gateway_calls', 'profile')
+    }
+
+
+class ProfilingMiddleware:
+    """Middleware sync/async; desligado com PAGBANK_PROFILING_ENABLED=False"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'PAGBANK_PROFILING_ENABLED', False)
+        self.sample_rate = getattr(settings, 'PAGBANK_PROFILE_SAMPLE_RATE', 0.01)
+        self.path_prefix = getattr(settings, 'PAGBANK_PROFILE_PATH_PREFIX', '/api/payments/')
+        slow_ms = getattr(settings, 'PAGBANK_PROFILE_SLOW_MS', 1000)
+        self.slow_seconds = slow_ms / 1000 if slow_ms > 0 else None
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        if self.enabled:
+            alias = getattr(settings, 'PAGBANK_PROFILE_CACHE_ALIAS', 'default')
+            if isinstance(caches[alias], LocMemCache):
+                logger.warning(
+                    f"Profiling com o cache '{alias}' em memória local: cada processo guarda "
+                    f"os seus perfis e GET /api/profiles/ mostra só os do worker que atender"
+                )
+
+    def sampled(self, request):
+        return request.path_info.startswith(self.path_prefix) and random.random() < self.sample_rate
+
+    def is_slow(self, elapsed):
+        return self.slow_seconds is not None and elapsed >= self.slow_seconds
+
+    def start_profiler(self, request):
+        """cProfile ligado para esta requisição, ou None se ela está fora da
+        amostra, se outro perfil está em andamento no processo ou se o
+        profiler não pôde ser ligado"""
+        if not self.sampled(request):
+            return None
+        if not _profiler_lock.acquire(blocking=False):
+            stats.increment('busy')
+            return None
+        try:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        except Exception as e:
+            _profiler_lock.release()
+            stats.increment('errors')
+            logger.warning(f"Falha ao ligar o cProfile em {request.path}: {str(e)}")
+            return None
+        return profiler
+
+    def stop_profiler(self, profiler):
+        try:
+            profiler.disable()
+        except Exception as e:
+            stats.increment('errors')
+            logger.warning(f"Falha ao desligar o cProfile: {str(e)}")
+        finally:
+            _profiler_lock.release()
+
+    def store(self, request, response, capture, elapsed, profiler):
+        slow = self.is_slow(elapsed)
+        if profiler is None and not slow:
+            return
+        try:
+            self.append(request, response, capture, elapsed, profiler, slow)
+        except Exception as e:
+            # Diagnóstico não derruba a requisição
+            stats.increment('errors')
+            logger.warning(f"Falha ao guardar perfil de {request.path}: {str(e)}")
+            return
+        stats.increment('stored')
+
+    def append(self, request, response, capture, elapsed, profiler, slow):
+        stats.increment('slow' if slow else 'sampled')
+        match = getattr(request, 'resolver_match', None)
+        span_ = current_span()
+        entry = {
+            'timestamp': timezone.now().isoformat(),
+            'method': request.method,
+            'path': request.path,
+            'route': match.url_name if match is not None else None,
+            'status': response.status_code,
+            'duration_ms': round(elapsed * 1000, 3),
+            'reason': 'slow' if slow else 'sampled',
+            'trace_id': span_.trace_id if span_ is not None else None,
+            'query_count': len(capture.queries) + capture.dropped_queries,
+            'query_ms': round(sum(query['ms'] for query in capture.queries), 3),
+            'gateway_call_count': len(capture.gateway_calls),
+            'queries': capture.queries,
+            'gateway_calls': capture.gateway_calls,
+            'profile': top_functions(profiler, getattr(settings, 'PAGBANK_PROFILE_TOP_FUNCTIONS', 30))
+            if profiler is not None else None,
+        }
+        get_buffer().append(entry)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        capture = Capture()
+        token = _capture.set(capture)
+        profiler = self.start_profiler(request)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _capture.reset(token)
+            if profiler is not None:
+                self.stop_profiler(profiler)
+        self.store(request, response, capture, time.perf_counter() - started, profiler)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        capture = Capture()
+        token = _capture.set(capture)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _capture.reset(token)
+        elapsed = time.perf_counter() - started
+        if self.is_slow(elapsed):
+            # O buffer usa a API síncrona do cache: fora do event loop
+            await sync_to_async(self.store)(request, response, capture, elapsed, None)
+        return response
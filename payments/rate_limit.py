@@ -0,0 +1,235 @@
+"""Limite de chamadas ao PagBank por família de endpoint (lado do cliente).
+
+O PagBank responde 429 quando passamos do limite da conta. Em vez de cada
+worker disparar e receber o 429, cada chamada reserva a vez em um token
+bucket da família ('orders', 'charges', 'reads'): se a vez sai dentro de
+PAGBANK_RATE_LIMIT_MAX_WAIT segundos, a chamada espera na fila; senão é
+recusada na hora com RateLimitExceeded (os services respondem como ao
+circuito aberto: 503 com Retry-After). Um 429 com Retry-After bloqueia a família inteira até o
+prazo indicado pelo PagBank.
+
+O estado fica em um backend, como no circuit breaker: 'local' (token bucket
+em memória, por processo), 'cache' (janelas no cache do Django,
+compartilhadas entre workers) ou caminho pontuado.
+"""
+import asyncio
+import logging
+import math
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from .counters import Counters
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitExceeded(Exception):
+    """A vez no limite da família não sairia antes do prazo máximo de espera"""
+
+    def __init__(self, family, retry_after):
+        self.family = family
+        self.retry_after = retry_after
+        super().__init__(
+            f"Limite de chamadas ao PagBank ({family}) atingido, tente novamente em {retry_after}s"
+        )
+
+
+class RateLimitStats(Counters):
+    """Contadores do processo para chamadas liberadas, que esperaram, recusadas e 429"""
+
+    FIELDS = ('acquired', 'delayed', 'rejected', 'throttled')
+
+
+def parse_retry_after(value, now=None):
+    """Segundos de um header Retry-After (número ou data HTTP), ou None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, moment.timestamp() - (now if now is not None else time.time()))
+
+
+class LocalRateLimitBackend:
+    """Token bucket em memória (um por processo).
+
+    Reservas podem deixar o saldo negativo: cada chamada na fila sabe
+    exatamente quando chega a sua vez, sem acordar para tentar de novo.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._blocked = {}
+
+    def reserve(self, family, rate, burst, max_wait, now):
+        """(liberada, espera em segundos); se não liberada, espera estimada"""
+        with self._lock:
+            blocked_for = max(0.0, self._blocked.get(family, 0.0) - now)
+            if not rate:
+                return blocked_for <= max_wait, blocked_for
+
+            tokens, updated_at = self._buckets.get(family, (burst, now))
+            # updated_at no futuro = bucket bloqueado por um Retry-After
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            wait = max(blocked_for, (1 - tokens) / rate if tokens < 1 else 0.0)
+            if wait > max_wait:
+                self._buckets[family] = (tokens, now)
+                return False, wait
+            self._buckets[family] = (tokens - 1, now)
+            return True, wait
+
+    def block(self, family, until):
+        with self._lock:
+            self._blocked[family] = max(until, self._blocked.get(family, 0.0))
+            bucket = self._buckets.get(family)
+            if bucket is not None:
+                # O bucket recomeça vazio no fim do bloqueio (mantendo as
+                # reservas já feitas): a fila volta no ritmo do limite, não
+                # toda de uma vez
+                tokens, updated_at = bucket
+                self._buckets[family] = (min(tokens, 0.0), max(until, updated_at))
+
+
+class CacheRateLimitBackend:
+    """Limite compartilhado entre workers via cache do Django (Redis/Memcached).
+
+    O tempo é dividido em janelas de burst / rate segundos com `burst`
+    chamadas cada; a vez é um incr no contador da janela. Se a atual está
+    cheia, a chamada reserva a próxima que couber no prazo. Com
+    LocMemCache o limite continua sendo por processo.
+    """
+
+    def __init__(self, alias='default', prefix='pagbank:rl'):
+        self.cache = caches[alias]
+        self.prefix = prefix
+
+    def _key(self, family, *parts):
+        return ':'.join((self.prefix, family) + tuple(str(p) for p in parts))
+
+    def reserve(self, family, rate, burst, max_wait, now):
+        start = max(now, self.cache.get(self._key(family, 'blocked'), 0.0))
+        if not rate:
+            return start - now <= max_wait, start - now
+
+        window = burst / rate
+        index = int(start // window)
+        while True:
+            wait = max(start, index * window) - now
+            if wait > max_wait:
+                return False, wait
+            key = self._key(family, index)
+            self.cache.add(key, 0, math.ceil(window + max_wait) + 1)
+            try:
+                count = self.cache.incr(key)
+            except ValueError:
+                # janela expirou entre o add e o incr
+                self.cache.set(key, 1, math.ceil(window + max_wait) + 1)
+                count = 1
+            if count <= burst:
+                return True, max(0.0, wait)
+            index += 1
+
+    def block(self, family, until):
+        key = self._key(family, 'blocked')
+        if until > self.cache.get(key, 0.0):
+            self.cache.set(key, until, math.ceil(until - time.time()) + 1)
+
+
+class RateLimiter:
+    """Limite de uma família de endpoints; `rate` 0 = só honra Retry-After"""
+
+    def __init__(self, family, backend, rate=0.0, burst=None, max_wait=2.0, stats=None,
+                 clock=time.time, sleep=time.sleep):
+        self.family = family
+        self.backend = backend
+        self.rate = rate
+        self.burst = max(1.0, burst if burst is not None else rate)
+        self.max_wait = max_wait
+        self.stats = stats or RateLimitStats()
+        self.clock = clock
+        self.sleep = sleep
+
+    def _reserve(self):
+        granted, wait = self.backend.reserve(self.family, self.rate, self.burst, self.max_wait, self.clock())
+        if not granted:
+            self.stats.increment('rejected')
+            raise RateLimitExceeded(self.family, max(1, math.ceil(wait)))
+        self.stats.increment('acquired')
+        if wait > 0:
+            self.stats.increment('delayed')
+        return wait
+
+    def acquire(self):
+        """Espera a vez da chamada (até max_wait) ou levanta RateLimitExceeded"""
+        wait = self._reserve()
+        if wait > 0:
+            self.sleep(wait)
+
+    async def acquire_async(self):
+        """Versão async de acquire()"""
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def observe(self, response):
+        """Um 429 bloqueia a família pelo Retry-After (ou 1s sem o header)"""
+        if response.status_code != 429:
+            return
+        self.stats.increment('throttled')
+        retry_after = parse_retry_after(response.headers.get('Retry-After'), self.clock())
+        retry_after = 1.0 if retry_after is None else retry_after
+        logger.warning(f"PagBank retornou 429 para {self.family}; pausando por {retry_after:.1f}s")
+        self.backend.block(self.family, self.clock() + retry_after)
+
+
+BACKENDS = {
+    'local': LocalRateLimitBackend,
+    'cache': lambda: CacheRateLimitBackend(getattr(settings, 'PAGBANK_RATE_LIMIT_CACHE_ALIAS', 'default')),
+}
+
+# Chamadas/s de cada família (0 = sem limite, só Retry-After)
+FAMILY_SETTINGS = {
+    'orders': 'PAGBANK_RATE_LIMIT_ORDERS',
+    'charges': 'PAGBANK_RATE_LIMIT_CHARGES',
+    'reads': 'PAGBANK_RATE_LIMIT_READS',
+}
+
+stats = RateLimitStats()
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Backend configurado em PAGBANK_RATE_LIMIT_BACKEND ('local', 'cache' ou caminho pontuado)"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = getattr(settings, 'PAGBANK_RATE_LIMIT_BACKEND', 'local')
+                factory = BACKENDS.get(name) or import_string(name)
+                _backend = factory()
+    return _backend
+
+
+def get_rate_limiter(family):
+    """RateLimiter da família com os limites definidos nos settings"""
+    rate = float(getattr(settings, FAMILY_SETTINGS[family], 0.0))
+    return RateLimiter(
+        family,
+        get_backend(),
+        rate=rate,
+        burst=rate * getattr(settings, 'PAGBANK_RATE_LIMIT_BURST_SECONDS', 1.0),
+        max_wait=getattr(settings, 'PAGBANK_RATE_LIMIT_MAX_WAIT', 2.0),
+        stats=stats,
+    )
@@ -0,0 +1,132 @@
+"""Reconciliação de pagamentos pendentes com o PagBank.
+
+Um pagamento só é atualizado quando chega um webhook ou alguém consulta
+/status/. Se a notificação se perdeu, ele fica 'pending' para sempre.
+reconcile_payments varre os pendentes mais antigos que um limite, em
+blocos pelo índice (status, created_at), consulta cada ordem com get_order
+(em paralelo, no limite de leituras do rate_limit, o mesmo das consultas de
+/status/: PAGBANK_RATE_LIMIT_READS) e aplica os status de cada bloco
+com PagBankService.process_webhooks: um SELECT e um bulk_update por bloco,
+pela mesma máquina de estados dos webhooks.
+
+A posição da varredura (created_at, id do último pagamento) fica em um
+checkpoint, então uma execução interrompida continua de onde parou.
+
+Só 'pending': pending_gateway e gateway_failed ainda não têm
+payment_gateway_id, não há ordem a consultar.
+"""
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .models import Payment
+from .services import map_gateway_status
+
+logger = logging.getLogger(__name__)
+
+
+class FileCheckpoint:
+    """Posição da varredura em um arquivo JSON (escrita atômica)"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """(created_at, id) do último pagamento processado, ou None"""
+        try:
+            with open(self.path, encoding='utf-8') as checkpoint_file:
+                data = json.load(checkpoint_file)
+            return parse_datetime(data['created_at']), data['id']
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Checkpoint {self.path} inválido, recomeçando: {str(e)}")
+            return None
+
+    def save(self, position):
+        created_at, payment_id = position
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as checkpoint_file:
+            json.dump({'created_at': created_at.isoformat(), 'id': str(payment_id)}, checkpoint_file)
+        os.replace(temp_path, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def stale_pending_chunks(cutoff, chunk_size, after=None):
+    """Blocos de (id, created_at, payment_gateway_id) dos pagamentos pending
+    criados antes de `cutoff`, em ordem de (created_at, id), depois de `after`"""
+    queryset = Payment.objects.filter(status='pending', created_at__lt=cutoff).order_by('created_at', 'id')
+    while True:
+        page = queryset
+        if after is not None:
+            created_at, payment_id = after
+            page = page.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=payment_id))
+        rows = list(page.values_list('id', 'created_at', 'payment_gateway_id')[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        after = rows[-1][1], rows[-1][0]
+
+
+class Reconciler:
+    """Consulta e aplica um bloco de pagamentos pendentes por vez"""
+
+    # Consultas recusadas pelo limite de leituras são refeitas após o
+    # Retry-After até este número de vezes (a varredura não tem pressa)
+    RATE_LIMITED_ATTEMPTS = 5
+
+    def __init__(self, service, concurrency=10, sleep=time.sleep):
+        self.service = service
+        self.sleep = sleep
+        self.executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+        self.gateway_calls = 0
+
+    def close(self):
+        self.executor.shutdown()
+
+    def fetch_order(self, gateway_id):
+        """get_order pelo limite de chamadas do service (rate_limit.get_rate_limiter
+        da família de get_order); uma recusa do limite espera a vez em vez de
+        interromper a varredura"""
+        for _ in range(self.RATE_LIMITED_ATTEMPTS):
+            result = self.service.get_order(gateway_id)
+            if not result.get('rate_limited'):
+                break
+            self.sleep(result['retry_after'])
+        return result
+
+    def reconcile_chunk(self, rows):
+        """Consulta as ordens do bloco e aplica os status que mudaram; retorna
+        a contagem por resultado de process_webhooks ('updated', ...), mais
+        'gateway_error' e 'circuit_open' para as consultas que falharam"""
+        rows = [row for row in rows if row[2]]
+        results = list(self.executor.map(self.fetch_order, [gateway_id for _, _, gateway_id in rows]))
+        self.gateway_calls += sum(1 for result in results if not result.get('circuit_open'))
+
+        outcomes = {}
+        notifications = []
+        for (payment_id, _, gateway_id), result in zip(rows, results):
+            if not result['success']:
+                outcome = 'circuit_open' if result.get('circuit_open') else 'gateway_error'
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+                continue
+            order = result['order']
+            if map_gateway_status(order.get('status')) == 'pending':
+                continue
+            # A ordem tem o formato da notificação v4; o id do pagamento é o nosso
+            notifications.append({**order, 'id': order.get('id') or gateway_id, 'reference_id': str(payment_id)})
+
+        if notifications:
+            for outcome in self.service.process_webhooks(notifications):
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        return outcomes
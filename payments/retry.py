@@ -0,0 +1,215 @@
+import asyncio
+import random
+import threading
+import time
+import logging
+
+import requests
+from django.conf import settings
+
+from .counters import Counters
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+# Erros transitórios do gateway. 4xx (exceto 408/429) são erros de validação
+# e repetir a chamada só geraria a mesma resposta.
+RETRYABLE_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504})
+
+RETRYABLE_EXCEPTIONS = (
+    requests.exceptions.ConnectionError,  # inclui ConnectTimeout
+    requests.exceptions.Timeout,          # inclui ReadTimeout
+    requests.exceptions.ChunkedEncodingError,
+)
+if aiohttp is not None:
+    # Equivalentes do cliente async (AsyncPagBankService); inclui timeouts
+    RETRYABLE_EXCEPTIONS += (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)
+
+
+def is_retryable_status(status_code):
+    return status_code in RETRYABLE_STATUS_CODES
+
+
+def is_retryable_exception(exc):
+    return isinstance(exc, RETRYABLE_EXCEPTIONS)
+
+
+class RetryStats(Counters):
+    """Contadores do processo para tentativas, retries e orçamento esgotado"""
+
+    FIELDS = ('calls', 'attempts', 'retries', 'budget_exhausted', 'gave_up')
+
+
+class RetryBudget:
+    """Orçamento de retries por processo.
+
+    Cada chamada respondida normalmente pelo PagBank deposita `ratio` tokens
+    e cada retry consome um token, de modo que os retries ficam limitados a
+    ~ratio * chamadas bem-sucedidas. O orçamento começa só com
+    `initial_tokens` (uma reserva pequena, não o máximo): um processo recém
+    iniciado em meio a uma falha do PagBank não dispara uma rajada de
+    retries. `min_per_second` garante alguns retries mesmo com pouco tráfego.
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=1.0, max_tokens=100.0, initial_tokens=1.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = min(initial_tokens, max_tokens)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.max_tokens, self._tokens + (now - self._updated_at) * self.min_per_second)
+        self._updated_at = now
+
+    def deposit(self):
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    @property
+    def tokens(self):
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+
+class RetryPolicy:
+    """Backoff exponencial com full jitter, limitado pelo orçamento de retries"""
+
+    def __init__(self, max_retries=3, base_delay=0.1, max_delay=2.0, budget=None,
+                 stats=None, sleep=time.sleep):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget or RetryBudget()
+        self.stats = stats or RetryStats()
+        self.sleep = sleep
+
+    def backoff(self, retry_number):
+        """Full jitter: uniforme entre 0 e min(max_delay, base * 2^n)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** retry_number)))
+
+    def _can_retry(self, retry_number, reason):
+        if retry_number >= self.max_retries:
+            self.stats.increment('gave_up')
+            return False
+        if not self.budget.withdraw():
+            self.stats.increment('budget_exhausted')
+            logger.warning(f"Orçamento de retries esgotado ({reason})")
+            return False
+        return True
+
+    def _retry_reason_for_exception(self, error, retry_number):
+        """Motivo do retry, ou None se a exceção deve ser propagada"""
+        reason = type(error).__name__
+        if is_retryable_exception(error) and self._can_retry(retry_number, reason):
+            return reason
+        return None
+
+    def _retry_reason_for_response(self, response, retry_number):
+        """Motivo do retry, ou None se a resposta deve ser devolvida"""
+        if not is_retryable_status(response.status_code):
+            # Só as respostas normais do PagBank rendem tokens ao orçamento
+            self.budget.deposit()
+            return None
+        reason = f"HTTP {response.status_code}"
+        if self._can_retry(retry_number, reason):
+            return reason
+        return None
+
+    def _next_delay(self, retry_number, reason):
+        delay = self.backoff(retry_number)
+        self.stats.increment('retries')
+        logger.warning(f"Retry {retry_number + 1}/{self.max_retries} em {delay:.3f}s ({reason})")
+        return delay
+
+    def call(self, send):
+        """Executa send() repetindo em falhas transitórias.
+
+        Retorna a última resposta (mesmo que com status de erro) ou propaga a
+        última exceção, preservando o contrato dos chamadores.
+        """
+        self.stats.increment('calls')
+        retry_number = 0
+
+        while True:
+            self.stats.increment('attempts')
+            try:
+                response = send()
+            except Exception as e:
+                reason = self._retry_reason_for_exception(e, retry_number)
+                if reason is None:
+                    raise
+            else:
+                reason = self._retry_reason_for_response(response, retry_number)
+                if reason is None:
+                    return response
+
+            self.sleep(self._next_delay(retry_number, reason))
+            retry_number += 1
+
+    async def call_async(self, send):
+        """Versão async de call(); send é uma função que retorna coroutine"""
+        self.stats.increment('calls')
+        retry_number = 0
+
+        while True:
+            self.stats.increment('attempts')
+            try:
+                response = await send()
+            except Exception as e:
+                reason = self._retry_reason_for_exception(e, retry_number)
+                if reason is None:
+                    raise
+            else:
+                reason = self._retry_reason_for_response(response, retry_number)
+                if reason is None:
+                    return response
+
+            await asyncio.sleep(self._next_delay(retry_number, reason))
+            retry_number += 1
+
+
+stats = RetryStats()
+_budget = None
+_budget_lock = threading.Lock()
+
+
+def get_retry_budget():
+    """Orçamento compartilhado pelo processo (criado a partir dos settings)"""
+    global _budget
+    if _budget is None:
+        with _budget_lock:
+            if _budget is None:
+                _budget = RetryBudget(
+                    ratio=getattr(settings, 'PAGBANK_RETRY_BUDGET_RATIO', 0.2),
+                    min_per_second=getattr(settings, 'PAGBANK_RETRY_BUDGET_MIN_PER_SECOND', 1.0),
+                    initial_tokens=getattr(settings, 'PAGBANK_RETRY_BUDGET_INITIAL_TOKENS', 1.0),
+                )
+    return _budget
+
+
+def get_retry_policy():
+    """Política de retry configurada pelos settings, com orçamento e contadores do processo"""
+    return RetryPolicy(
+        max_retries=getattr(settings, 'PAGBANK_MAX_RETRIES', 3),
+        base_delay=getattr(settings, 'PAGBANK_RETRY_BASE_DELAY', 0.1),
+        max_delay=getattr(settings, 'PAGBANK_RETRY_MAX_DELAY', 2.0),
+        budget=get_retry_budget(),
+        stats=stats,
+    )
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from decimal import Decimal
 from .models import Payment, PaymentItem
+from .tracing import TracedValidationMixin
 
 class PaymentItemSerializer(serializers.ModelSerializer):
     total_price = serializers.SerializerMethodField()
@@ -10,8 +11,8 @@ class PaymentItemSerializer(serializers.ModelSerializer):
         fields = ['title', 'quantity', 'unit_price', 'total_price']
     
     def get_total_price(self, obj):
-        """Calcula o preço total do item"""
-        return float(obj.quantity * obj.unit_price)
+        """Preço total do item (gravado em centavos)"""
+        return obj.total_cents / 100
 
 class PaymentSerializer(serializers.ModelSerializer):
     items = PaymentItemSerializer(many=True, read_only=True)
@@ -23,18 +24,25 @@ class PaymentSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'amount', 'description', 'payer_email', 'status', 'status_display',
             'preference_id', 'payment_gateway_id', 'created_at', 'updated_at', 
-            'items', 'total_amount'
+            'items', 'total_amount', 'item_count'
         ]
         read_only_fields = [
             'id', 'status', 'preference_id', 'payment_gateway_id', 
-            'created_at', 'updated_at'
+            'created_at', 'updated_at', 'item_count'
         ]
     
+    def __init__(self, *args, fields=None, **kwargs):
+        """`fields` restringe a saída a um subconjunto (projeção de GET ?fields=)"""
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+    
     def get_total_amount(self, obj):
-        """Calcula o valor total baseado nos itens"""
-        return float(sum(item.quantity * item.unit_price for item in obj.items.all()))
+        """Valor total dos itens (gravado em centavos, sem ler os itens)"""
+        return obj.total_cents / 100
 
-class CreatePaymentSerializer(serializers.Serializer):
+class CreatePaymentSerializer(TracedValidationMixin, serializers.Serializer):
     amount = serializers.DecimalField(max_digits=10, decimal_places=2)
     description = serializers.CharField(max_length=255)
     payer_email = serializers.EmailField()
@@ -52,25 +60,26 @@ class CreatePaymentSerializer(serializers.Serializer):
     def validate_items(self, value):
         if not value:
             raise serializers.ValidationError("Deve haver pelo menos um item.")
-        
+        return value
+    
+    def validate(self, attrs):
+        # Feito aqui (e não em validate_items) para usar o amount já validado;
+        # com many=True o serializer filho não tem initial_data por item
         # CORREÇÃO: Usar Decimal para todos os cálculos
         items_total = sum(
             Decimal(str(item['quantity'])) * Decimal(str(item['unit_price'])) 
-            for item in value
+            for item in attrs['items']
         )
+        declared_amount = attrs['amount']
+        tolerance = Decimal('0.01')  # Tolerância de 1 centavo
         
-        if 'amount' in self.initial_data:
-            # CORREÇÃO: Converter para Decimal também
-            declared_amount = Decimal(str(self.initial_data['amount']))
-            tolerance = Decimal('0.01')  # Tolerância de 1 centavo
-            
-            if abs(items_total - declared_amount) > tolerance:
-                raise serializers.ValidationError(
-                    f"Total dos itens (R$ {items_total:.2f}) não confere "
-                    f"com o valor declarado (R$ {declared_amount:.2f})"
-                )
+        if abs(items_total - declared_amount) > tolerance:
+            raise serializers.ValidationError({'items': [
+                f"Total dos itens (R$ {items_total:.2f}) não confere "
+                f"com o valor declarado (R$ {declared_amount:.2f})"
+            ]})
         
-        return value
+        return attrs
     
     def validate_payer_cpf(self, value):
         """Validação básica de CPF (opcional)"""
@@ -81,7 +90,7 @@ class CreatePaymentSerializer(serializers.Serializer):
                 raise serializers.ValidationError("CPF deve ter 11 dígitos")
         return value
 
-class TransparentPaymentSerializer(serializers.Serializer):
+class TransparentPaymentSerializer(TracedValidationMixin, serializers.Serializer):
     """Serializer específico para pagamento transparente"""
     payment = CreatePaymentSerializer()
     card = serializers.DictField(child=serializers.CharField())
@@ -1,11 +1,68 @@
-import requests
-import json
 import logging
+import time
+import uuid
+import requests
 from django.conf import settings
-from .models import Payment, PaymentItem
+from django.db import transaction
+from django.utils import timezone
+from .circuit_breaker import CircuitOpenError, get_breaker
+from .http_client import get_session, get_timeout
+from .metrics import record_gateway_call
+from .rate_limit import RateLimitExceeded, get_rate_limiter
+from .retry import get_retry_policy
+from .structured_logging import Payload
+from .tracing import span, trace_headers, traced
+from .models import Payment, to_cents
+from .webhook_dedupe import claim_delivery, event_key, processed_keys, record_deliveries
+from . import status_cache, status_events
 
 logger = logging.getLogger(__name__)
 
+# Mapeamento de status PagBank (v4 e códigos legados v2/v3) -> Payment.status
+STATUS_MAP = {
+    '1': 'pending',    # Aguardando pagamento
+    '2': 'pending',    # Em análise
+    '3': 'approved',   # Paga
+    '4': 'approved',   # Disponível
+    '5': 'pending',    # Em disputa
+    '6': 'refunded',   # Devolvida
+    '7': 'cancelled',  # Cancelada
+    # Status PagBank v4
+    'PAID': 'approved',
+    'DECLINED': 'rejected',
+    'CANCELED': 'cancelled',
+    'AUTHORIZED': 'pending',
+    'IN_ANALYSIS': 'pending',
+    'WAITING': 'pending'
+}
+
+def map_gateway_status(gateway_status):
+    """Converte o status do PagBank para Payment.status"""
+    return STATUS_MAP.get(gateway_status, 'pending')
+
+def payments_changed(changes):
+    """Após o commit: descarta o cache de status e avisa os clientes esperando
+    (long-poll/SSE); `changes` é uma lista de (payment_id, status)"""
+    status_cache.invalidate(*(payment_id for payment_id, _ in changes))
+    for payment_id, status in changes:
+        status_events.publish(payment_id, status)
+
+# Endpoint (nome do circuit breaker) de cada operação; None = sem breaker
+CIRCUIT_ENDPOINTS = {
+    'create_order': '/orders',
+    'create_charge': '/charges',
+    'get_order': '/orders/{id}',
+    'public_keys': None,
+}
+
+# Família do limite de chamadas ao PagBank (ver rate_limit) de cada operação
+RATE_LIMIT_FAMILIES = {
+    'create_order': 'orders',
+    'create_charge': 'charges',
+    'get_order': 'reads',
+    'public_keys': 'reads',
+}
+
 class PagBankService:
     """Service para PagBank API v4 - FUNCIONANDO"""
     
@@ -14,10 +71,19 @@ class PagBankService:
         self.token = getattr(settings, 'PAGSEGURO_TOKEN', '')
         self.environment = getattr(settings, 'PAGSEGURO_ENVIRONMENT', 'sandbox')
         
-        if self.environment == 'sandbox':
+        if getattr(settings, 'PAGBANK_API_URL', ''):
+            self.api_url = settings.PAGBANK_API_URL.rstrip('/')
+        elif self.environment == 'sandbox':
             self.api_url = "https://sandbox.api.pagseguro.com"
         else:
             self.api_url = "https://api.pagseguro.com"
+        
+        self.retry_policy = get_retry_policy()
+    
+    @property
+    def session(self):
+        """Session compartilhada pelo processo (pool de conexões keep-alive)"""
+        return get_session()
     
     def _get_headers(self):
         """Headers corretos para PagBank v4"""
@@ -27,14 +93,83 @@ class PagBankService:
             'Accept': 'application/json'
         }
     
+    def _request_headers(self, method, idempotency_key=None):
+        """Headers da chamada; POSTs recebem uma chave de idempotência
+        (a Idempotency-Key do cliente, quando houver)"""
+        headers = self._get_headers()
+        if method == 'POST':
+            # Mesma chave em todas as tentativas: o PagBank não duplica a
+            # ordem/cobrança se um retry repetir um POST que já foi aceito
+            headers['x-idempotency-key'] = idempotency_key or str(uuid.uuid4())
+        return headers
+    
+    @staticmethod
+    def _is_gateway_failure(response):
+        """Respostas que contam como falha para o circuit breaker"""
+        return response.status_code >= 500
+    
+    def _request(self, method, path, operation, idempotency_key=None, **kwargs):
+        """Executa uma chamada HTTP usando o pool de conexões, com retry"""
+        headers = self._request_headers(method, idempotency_key)
+        
+        def send():
+            # Um span por tentativa; o traceparent enviado aponta para ele
+            with span('pagbank.http', **{'http.method': method, 'pagbank.operation': operation}) as http_span:
+                started = time.perf_counter()
+                try:
+                    response = self.session.request(
+                        method,
+                        f"{self.api_url}{path}",
+                        headers=trace_headers(headers),
+                        timeout=get_timeout(operation),
+                        **kwargs
+                    )
+                except requests.Timeout:
+                    record_gateway_call(operation, started, 'timeout')
+                    raise
+                except requests.RequestException:
+                    record_gateway_call(operation, started, 'error')
+                    raise
+                record_gateway_call(operation, started, response.status_code)
+                http_span.set_attribute('http.status_code', response.status_code)
+                return response
+        
+        endpoint = CIRCUIT_ENDPOINTS.get(operation)
+        if endpoint:
+            # Cada tentativa passa pelo breaker: com o circuito aberto o retry para na hora
+            breaker = get_breaker(endpoint)
+            call = lambda: breaker.call(send, self._is_gateway_failure)
+        else:
+            call = send
+        
+        # Cada tentativa também espera a vez no limite da família (fora do
+        # breaker: uma recusa local não é falha do PagBank)
+        limiter = get_rate_limiter(RATE_LIMIT_FAMILIES[operation])
+        
+        def attempt():
+            limiter.acquire()
+            response = call()
+            limiter.observe(response)
+            return response
+        
+        return self.retry_policy.call(attempt)
+    
+    def _circuit_open_result(self, error):
+        """Resultado padrão quando o circuito do endpoint está aberto ou o limite
+        de chamadas recusou a vez (rate_limited)"""
+        logger.warning(str(error))
+        return {
+            "success": False,
+            "error": str(error),
+            "circuit_open": True,
+            "rate_limited": isinstance(error, RateLimitExceeded),
+            "retry_after": error.retry_after
+        }
+    
     def test_connection(self):
         """Testa conexão com PagBank"""
         try:
-            response = requests.get(
-                f"{self.api_url}/public-keys",
-                headers=self._get_headers(),
-                timeout=10
-            )
+            response = self._request('GET', '/public-keys', 'public_keys')
             
             return {
                 "success": response.status_code == 200,
@@ -44,188 +179,212 @@ class PagBankService:
         except Exception as e:
             return {"success": False, "error": str(e)}
     
-    def create_order(self, payment_data):
-        """Cria ordem no PagBank v4"""
-        try:
-            logger.info("Criando ordem PagBank v4...")
-            
-            # Estrutura correta PagBank v4 com todos os campos obrigatórios
-            order_data = {
-                "reference_id": str(payment_data.get('external_reference', '')),
-                "customer": {
-                    "name": payment_data.get('payer_name', 'Cliente Teste'),
-                    "email": payment_data['payer_email'],
-                    "tax_id": payment_data.get('payer_cpf', '12345678909'),  # CPF obrigatório
-                    "phones": [
-                        {
-                            "country": "55",
-                            "area": "11", 
-                            "number": "999999999",
-                            "type": "MOBILE"
-                        }
-                    ]
-                },
-                "items": [
+    def _build_order_data(self, payment_data):
+        """Monta o payload de POST /orders"""
+        # Estrutura correta PagBank v4 com todos os campos obrigatórios
+        order_data = {
+            "reference_id": str(payment_data.get('external_reference', '')),
+            "customer": {
+                "name": payment_data.get('payer_name', 'Cliente Teste'),
+                "email": payment_data['payer_email'],
+                "tax_id": payment_data.get('payer_cpf', '12345678909'),  # CPF obrigatório
+                "phones": [
                     {
-                        "reference_id": str(idx),
-                        "name": item['title'],
-                        "quantity": item['quantity'],
-                        "unit_amount": int(float(item['unit_price']) * 100)  # Centavos
+                        "country": "55",
+                        "area": "11", 
+                        "number": "999999999",
+                        "type": "MOBILE"
                     }
-                    for idx, item in enumerate(payment_data['items'], 1)
                 ]
+            },
+            "items": [
+                {
+                    "reference_id": str(idx),
+                    "name": item['title'],
+                    "quantity": item['quantity'],
+                    "unit_amount": item.get('unit_price_cents') or to_cents(item['unit_price'])
+                }
+                for idx, item in enumerate(payment_data['items'], 1)
+            ]
+        }
+        
+        # Adicionar notification_urls apenas se configurado e válido
+        notification_url = getattr(settings, 'PAGSEGURO_NOTIFICATION_URL', '')
+        if notification_url and notification_url.startswith('https://'):
+            order_data["notification_urls"] = [notification_url]
+        
+        return order_data
+    
+    def _error_message(self, response):
+        """Extrai (mensagem, payload) de uma resposta de erro do PagBank"""
+        error_data = response.json() if response.content else {}
+        error_messages = error_data.get('error_messages', [])
+        
+        if error_messages:
+            error_msg = "; ".join([f"{err.get('code')}: {err.get('description')}" for err in error_messages])
+        else:
+            error_msg = response.text
+        
+        return error_msg, error_data
+    
+    def _order_result(self, response):
+        """Converte a resposta de POST /orders no resultado do service"""
+        if response.status_code == 201:
+            order = response.json()
+            
+            # Extrair URL de pagamento
+            payment_url = None
+            for link in order.get('links', []):
+                if link.get('rel') == 'PAY':
+                    payment_url = link.get('href')
+                    break
+            
+            return {
+                "success": True,
+                "order_id": order['id'],
+                "checkout_url": payment_url,
+                "payment_url": payment_url,
+                "links": order.get('links', []),
+                "order_data": order
+            }
+        else:
+            error_msg, error_data = self._error_message(response)
+            
+            return {
+                "success": False,
+                "error": error_msg,
+                "status_code": response.status_code,
+                "response_data": error_data  # Para debug
+            }
+    
+    def _get_order_result(self, response):
+        """Converte a resposta de GET /orders/{id} no resultado do service"""
+        if response.status_code == 200:
+            return {
+                "success": True,
+                "order": response.json()
+            }
+        else:
+            return {
+                "success": False,
+                "error": f"HTTP {response.status_code}: {response.text}"
+            }
+    
+    def _build_charge_data(self, payment_data, card_data):
+        """Monta o payload de POST /charges"""
+        return {
+            "reference_id": str(payment_data.get('external_reference', '')),
+            "description": payment_data.get('description', 'Pagamento'),
+            "amount": {
+                "value": payment_data.get('amount_cents') or to_cents(payment_data['amount']),
+                "currency": "BRL"
+            },
+            "payment_method": {
+                "type": "CREDIT_CARD",
+                "installments": card_data.get('installments', 1),
+                "capture": True,
+                "card": {
+                    "encrypted": card_data['encrypted_card'],
+                    "security_code": card_data['security_code'],
+                    "holder": {
+                        "name": card_data['holder_name'],
+                    }
+                }
+            },
+            "customer": {
+                "name": payment_data.get('payer_name', 'Cliente'),
+                "email": payment_data['payer_email'],
+                "tax_id": payment_data.get('payer_cpf', '12345678909'),
+            },
+            "notification_urls": [
+                getattr(settings, 'PAGSEGURO_NOTIFICATION_URL', 'http://localhost:8000/api/payments/webhook/')
+            ]
+        }
+    
+    def _charge_result(self, response):
+        """Converte a resposta de POST /charges no resultado do service"""
+        if response.status_code == 201:
+            charge = response.json()
+            
+            return {
+                "success": True,
+                "charge_id": charge['id'],
+                "status": charge['status'],
+                "payment_response": charge.get('payment_response', {}),
+                "amount": charge.get('amount', {})
             }
+        else:
+            error_msg, error_data = self._error_message(response)
             
-            # Adicionar notification_urls apenas se configurado e válido
-            notification_url = getattr(settings, 'PAGSEGURO_NOTIFICATION_URL', '')
-            if notification_url and notification_url.startswith('https://'):
-                order_data["notification_urls"] = [notification_url]
+            return {
+                "success": False,
+                "error": error_msg,
+                "status_code": response.status_code
+            }
+    
+    @traced('PagBankService.create_order')
+    def create_order(self, payment_data):
+        """Cria ordem no PagBank v4"""
+        try:
+            logger.info("Criando ordem PagBank v4...")
             
-            logger.info(f"Dados da ordem: {json.dumps(order_data, indent=2)}")
+            order_data = self._build_order_data(payment_data)
+            logger.info("Dados da ordem", extra={'payload': Payload(order_data, payment_data.get('external_reference'))})
             
-            response = requests.post(
-                f"{self.api_url}/orders",
-                headers=self._get_headers(),
-                json=order_data,
-                timeout=30
+            response = self._request(
+                'POST', '/orders', 'create_order',
+                idempotency_key=payment_data.get('idempotency_key'), json=order_data
             )
             
-            logger.info(f"Status: {response.status_code}")
-            logger.info(f"Resposta: {response.text}")
+            logger.info(f"Resposta PagBank - Status: {response.status_code}", extra={
+                'status_code': response.status_code,
+                'payload': Payload(response, payment_data.get('external_reference')),
+            })
             
-            if response.status_code == 201:
-                order = response.json()
-                
-                # Extrair URL de pagamento
-                payment_url = None
-                for link in order.get('links', []):
-                    if link.get('rel') == 'PAY':
-                        payment_url = link.get('href')
-                        break
-                
-                return {
-                    "success": True,
-                    "order_id": order['id'],
-                    "checkout_url": payment_url,
-                    "payment_url": payment_url,
-                    "links": order.get('links', []),
-                    "order_data": order
-                }
-            else:
-                error_data = response.json() if response.content else {}
-                error_messages = error_data.get('error_messages', [])
-                
-                if error_messages:
-                    error_msg = "; ".join([f"{err.get('code')}: {err.get('description')}" for err in error_messages])
-                else:
-                    error_msg = response.text
-                
-                return {
-                    "success": False,
-                    "error": error_msg,
-                    "status_code": response.status_code,
-                    "response_data": error_data  # Para debug
-                }
+            return self._order_result(response)
                 
+        except (CircuitOpenError, RateLimitExceeded) as e:
+            return self._circuit_open_result(e)
         except Exception as e:
             logger.error(f"Erro ao criar ordem: {str(e)}")
             return {"success": False, "error": str(e)}
     
+    @traced('PagBankService.get_order')
     def get_order(self, order_id):
         """Busca ordem no PagBank"""
         try:
-            response = requests.get(
-                f"{self.api_url}/orders/{order_id}",
-                headers=self._get_headers(),
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                return {
-                    "success": True,
-                    "order": response.json()
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": f"HTTP {response.status_code}: {response.text}"
-                }
+            response = self._request('GET', f'/orders/{order_id}', 'get_order')
+            return self._get_order_result(response)
                 
+        except (CircuitOpenError, RateLimitExceeded) as e:
+            return self._circuit_open_result(e)
         except Exception as e:
             logger.error(f"Erro ao buscar ordem: {str(e)}")
             return {"success": False, "error": str(e)}
     
+    @traced('PagBankService.create_charge_credit_card')
     def create_charge_credit_card(self, payment_data, card_data):
         """Cria cobrança com cartão de crédito"""
         try:
             logger.info("Criando cobrança com cartão...")
             
-            charge_data = {
-                "reference_id": str(payment_data.get('external_reference', '')),
-                "description": payment_data.get('description', 'Pagamento'),
-                "amount": {
-                    "value": int(float(payment_data['amount']) * 100),  # Centavos
-                    "currency": "BRL"
-                },
-                "payment_method": {
-                    "type": "CREDIT_CARD",
-                    "installments": card_data.get('installments', 1),
-                    "capture": True,
-                    "card": {
-                        "encrypted": card_data['encrypted_card'],
-                        "security_code": card_data['security_code'],
-                        "holder": {
-                            "name": card_data['holder_name'],
-                        }
-                    }
-                },
-                "customer": {
-                    "name": payment_data.get('payer_name', 'Cliente'),
-                    "email": payment_data['payer_email'],
-                    "tax_id": payment_data.get('payer_cpf', '12345678909'),
-                },
-                "notification_urls": [
-                    getattr(settings, 'PAGSEGURO_NOTIFICATION_URL', 'http://localhost:8000/api/payments/webhook/')
-                ]
-            }
-            
-            logger.info(f"Dados da cobrança: {json.dumps(charge_data, indent=2)}")
+            charge_data = self._build_charge_data(payment_data, card_data)
+            logger.info("Dados da cobrança", extra={'payload': Payload(charge_data, payment_data.get('external_reference'))})
             
-            response = requests.post(
-                f"{self.api_url}/charges",
-                headers=self._get_headers(),
-                json=charge_data,
-                timeout=30
+            response = self._request(
+                'POST', '/charges', 'create_charge',
+                idempotency_key=payment_data.get('idempotency_key'), json=charge_data
             )
             
-            logger.info(f"Status: {response.status_code}")
-            logger.info(f"Resposta: {response.text}")
+            logger.info(f"Resposta PagBank - Status: {response.status_code}", extra={
+                'status_code': response.status_code,
+                'payload': Payload(response, payment_data.get('external_reference')),
+            })
             
-            if response.status_code == 201:
-                charge = response.json()
-                
-                return {
-                    "success": True,
-                    "charge_id": charge['id'],
-                    "status": charge['status'],
-                    "payment_response": charge.get('payment_response', {}),
-                    "amount": charge.get('amount', {})
-                }
-            else:
-                error_data = response.json() if response.content else {}
-                error_messages = error_data.get('error_messages', [])
-                
-                if error_messages:
-                    error_msg = "; ".join([f"{err.get('code')}: {err.get('description')}" for err in error_messages])
-                else:
-                    error_msg = response.text
-                
-                return {
-                    "success": False,
-                    "error": error_msg,
-                    "status_code": response.status_code
-                }
+            return self._charge_result(response)
                 
+        except (CircuitOpenError, RateLimitExceeded) as e:
+            return self._circuit_open_result(e)
         except Exception as e:
             logger.error(f"Erro na cobrança: {str(e)}")
             return {"success": False, "error": str(e)}
@@ -233,7 +392,7 @@ class PagBankService:
     def process_webhook(self, webhook_data):
         """Processa webhook PagBank v4"""
         try:
-            logger.info(f"Processando webhook: {webhook_data}")
+            logger.info("Processando webhook", extra={'payload': Payload(webhook_data, webhook_data.get('reference_id'))})
             
             # Na API v4, o webhook já vem com os dados completos
             order_id = webhook_data.get('id')
@@ -241,8 +400,17 @@ class PagBankService:
             status = webhook_data.get('status')
             
             if order_id and reference_id:
-                self.update_local_payment(reference_id, order_id, status)
-                return {"success": True, "message": "Webhook processado"}
+                with transaction.atomic():
+                    # PagBank reenvia notificações; o reenvio não precisa nem ler o Payment
+                    if not claim_delivery(webhook_data):
+                        logger.info(f"Webhook duplicado ignorado - Ordem: {order_id}, Status: {status}")
+                        return {"success": True, "message": "Webhook duplicado", "outcome": "duplicate"}
+                    
+                    outcome = self.update_local_payment(reference_id, order_id, status)
+                    if outcome == 'error':
+                        # Desfaz a chave: o reenvio desta notificação ainda é aplicado
+                        transaction.set_rollback(True)
+                return {"success": True, "message": "Webhook processado", "outcome": outcome}
             else:
                 return {"success": False, "error": "Dados incompletos no webhook"}
                 
@@ -250,31 +418,130 @@ class PagBankService:
             logger.error(f"Erro no webhook: {str(e)}")
             return {"success": False, "error": str(e)}
     
+    def process_webhooks(self, webhooks):
+        """Aplica um lote de webhooks PagBank v4 de uma vez.
+        
+        Carrega todos os Payments referenciados com uma query (id__in),
+        aplica os eventos de cada pagamento em ordem pela máquina de estados
+        (Payment.STATUS_TRANSITIONS) e grava só os que mudaram com um único
+        bulk_update, tudo em uma transação junto com as chaves de
+        deduplicação (ver webhook_dedupe). Retorna o resultado de cada
+        webhook na mesma ordem da entrada ('updated', 'unchanged',
+        'rejected', 'duplicate', 'not_found' ou 'invalid').
+        """
+        outcomes = [None] * len(webhooks)
+        keys = [None] * len(webhooks)
+        payment_ids = {}
+        
+        for index, webhook_data in enumerate(webhooks):
+            order_id = webhook_data.get('id') if isinstance(webhook_data, dict) else None
+            reference_id = webhook_data.get('reference_id') if order_id else None
+            try:
+                payment_id = uuid.UUID(str(reference_id)) if reference_id else None
+            except ValueError:
+                payment_id = None
+            
+            if payment_id is None:
+                outcomes[index] = 'invalid'
+            else:
+                payment_ids[index] = payment_id
+                keys[index] = event_key(webhook_data)
+        
+        changed = []
+        with transaction.atomic():
+            payments = Payment.objects.select_for_update().only(
+                'id', 'status', 'payment_gateway_id'
+            ).in_bulk(list(set(payment_ids.values())))
+            
+            # Lidas depois de travar os pagamentos: um lote concorrente com as
+            # mesmas notificações espera o commit deste e as vê como aplicadas
+            seen = processed_keys(keys)
+            events_by_payment = {}
+            for index, payment_id in payment_ids.items():
+                if keys[index] in seen:
+                    outcomes[index] = 'duplicate'
+                    continue
+                if keys[index]:
+                    seen.add(keys[index])
+                events_by_payment.setdefault(payment_id, []).append(index)
+            
+            for payment_id, indexes in events_by_payment.items():
+                payment = payments.get(payment_id)
+                if payment is None:
+                    logger.error(f"Payment com reference {payment_id} não encontrado")
+                    for index in indexes:
+                        outcomes[index] = 'not_found'
+                    continue
+                
+                dirty = False
+                for index in indexes:
+                    webhook_data = webhooks[index]
+                    new_status = map_gateway_status(webhook_data.get('status'))
+                    outcome = 'unchanged'
+                    if payment.mercadopago_id != webhook_data['id']:
+                        payment.mercadopago_id = webhook_data['id']
+                        outcome = 'updated'
+                        dirty = True
+                    if new_status != payment.status:
+                        if payment.can_transition_to(new_status):
+                            payment.status = new_status
+                            outcome = 'updated'
+                            dirty = True
+                        else:
+                            outcome = 'rejected'
+                    outcomes[index] = outcome
+                
+                if dirty:
+                    payment.updated_at = timezone.now()
+                    changed.append(payment)
+            
+            if changed:
+                # bulk_update não aplica auto_now; updated_at é definido acima
+                Payment.objects.bulk_update(changed, ['status', 'payment_gateway_id', 'updated_at'])
+                changes = [(payment.id, payment.status) for payment in changed]
+                transaction.on_commit(lambda: payments_changed(changes))
+            
+            record_deliveries([
+                key for key, outcome in zip(keys, outcomes) if outcome not in ('invalid', 'duplicate', 'not_found')
+            ])
+        
+        logger.info(f"Lote de {len(webhooks)} webhooks aplicado - {len(changed)} pagamentos atualizados")
+        return outcomes
+    
     def update_local_payment(self, reference_id, order_id, status):
-        """Atualiza pagamento local com dados do PagBank"""
+        """Atualiza pagamento local com dados do PagBank.
+        
+        A transição é um UPDATE condicional (Payment.objects.transition_status):
+        regressões de status (ver Payment.STATUS_TRANSITIONS) e entregas sem
+        mudança não gravam nada. Retorna 'updated', 'unchanged', 'rejected',
+        'not_found' ou 'error'.
+        """
         try:
-            payment = Payment.objects.get(id=reference_id)
-            payment.mercadopago_id = order_id
-            
-            # Mapeamento de status PagBank v4
-            status_map = {
-                'PAID': 'approved',
-                'DECLINED': 'rejected',
-                'CANCELED': 'cancelled',
-                'AUTHORIZED': 'pending',
-                'IN_ANALYSIS': 'pending',
-                'WAITING': 'pending'
-            }
+            new_status = map_gateway_status(status)
+            if Payment.objects.transition_status(reference_id, new_status, gateway_id=order_id):
+                logger.info(f"Payment {reference_id} atualizado - Status: {new_status}")
+                transaction.on_commit(lambda: payments_changed([(reference_id, new_status)]))
+                return 'updated'
             
-            payment.status = status_map.get(status, 'pending')
-            payment.save()
+            # Sem transição: ainda pode ser a primeira notificação com o id da ordem
+            gateway_updated = bool(order_id) and Payment.objects.set_gateway_id(reference_id, order_id)
+            if gateway_updated:
+                transaction.on_commit(lambda: status_cache.invalidate(reference_id))
             
-            logger.info(f"Payment {payment.id} atualizado - Status: {payment.status}")
+            current_status = Payment.objects.filter(id=reference_id).values_list('status', flat=True).first()
+            if current_status is None:
+                logger.error(f"Payment com reference {reference_id} não encontrado")
+                return 'not_found'
+            if current_status != new_status:
+                logger.warning(
+                    f"Payment {reference_id}: transição {current_status} -> {new_status} recusada"
+                )
+                return 'rejected'
+            return 'updated' if gateway_updated else 'unchanged'
             
-        except Payment.DoesNotExist:
-            logger.error(f"Payment com reference {reference_id} não encontrado")
         except Exception as e:
             logger.error(f"Erro ao atualizar pagamento: {str(e)}")
+            return 'error'
     
     # Métodos de compatibilidade
     def create_checkout_session(self, payment_data):
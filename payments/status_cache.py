@@ -0,0 +1,172 @@
+"""Cache read-through da resposta de GET /api/payments/<id>/status/.
+
+Cada entrada guarda a representação do pagamento com o TTL do seu status:
+pendentes expiram em segundos (o PagBank ainda pode mudar), os demais ficam
+em cache por muito mais tempo e são invalidados quando um webhook muda o
+pagamento. Polls simultâneos do mesmo pagamento no processo esperam uma
+única consulta (single-flight) em vez de cada um chamar o PagBank.
+
+Para uma consulta iniciada antes da invalidação não regravar dados velhos,
+cada pagamento tem um contador de geração: a invalidação o incrementa e
+entradas de gerações anteriores são ignoradas.
+"""
+import asyncio
+import logging
+import threading
+import weakref
+from concurrent.futures import Future
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+# Status que o PagBank ainda pode mudar a qualquer momento
+TRANSIENT_STATUSES = frozenset({'pending_gateway', 'pending'})
+
+
+def _cache():
+    return caches[getattr(settings, 'PAGBANK_STATUS_CACHE_ALIAS', 'default')]
+
+
+def data_key(payment_id):
+    return f"pagbank:payment-status:{payment_id}"
+
+
+def generation_key(payment_id):
+    return f"pagbank:payment-status-gen:{payment_id}"
+
+
+def ttl_for(status):
+    """TTL da entrada conforme o status do pagamento"""
+    if status in TRANSIENT_STATUSES:
+        return getattr(settings, 'PAGBANK_STATUS_CACHE_TTL', 5)
+    return getattr(settings, 'PAGBANK_STATUS_CACHE_FINAL_TTL', 3600)
+
+
+def lookup(payment_id):
+    """(dados em cache ou None, geração atual) com uma ida ao cache"""
+    keys = (data_key(payment_id), generation_key(payment_id))
+    values = _cache().get_many(keys)
+    generation = values.get(keys[1], 0)
+    entry = values.get(keys[0])
+    if entry is not None and entry[0] == generation:
+        return entry[1], generation
+    return None, generation
+
+
+def store(payment_id, generation, data):
+    if data is not None:
+        _cache().set(data_key(payment_id), (generation, data), ttl_for(data.get('status')))
+
+
+def invalidate(*payment_ids):
+    """Descarta as entradas dos pagamentos (chamado quando um webhook os muda)"""
+    cache = _cache()
+    timeout = getattr(settings, 'PAGBANK_STATUS_CACHE_FINAL_TTL', 3600) * 2
+    for payment_id in payment_ids:
+        key = generation_key(payment_id)
+        cache.add(key, 0, timeout)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # expirou entre o add e o incr
+            cache.set(key, 1, timeout)
+    cache.delete_many([data_key(payment_id) for payment_id in payment_ids])
+
+
+class SingleFlight:
+    """Execuções concorrentes com a mesma chave compartilham uma única chamada"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class AsyncSingleFlight:
+    """Versão async de SingleFlight; chamadas em andamento por event loop"""
+
+    def __init__(self):
+        self._calls = weakref.WeakKeyDictionary()
+
+    async def do(self, key, fn):
+        calls = self._calls.setdefault(asyncio.get_running_loop(), {})
+        future = calls.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+        except BaseException as e:
+            future.set_exception(e)
+            # ninguém mais esperando: evita o aviso de exceção não lida
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del calls[key]
+
+
+_flight = SingleFlight()
+_async_flight = AsyncSingleFlight()
+
+
+def get_status(payment_id, load):
+    """Representação do pagamento via cache; `load(payment_id)` consulta
+    banco/PagBank e retorna os dados (ou None se não existe)"""
+    if not getattr(settings, 'PAGBANK_STATUS_CACHE_ENABLED', True):
+        return load(payment_id)
+
+    data, generation = lookup(payment_id)
+    if data is not None:
+        return data
+
+    def load_and_store():
+        data = load(payment_id)
+        store(payment_id, generation, data)
+        return data
+
+    return _flight.do(str(payment_id), load_and_store)
+
+
+async def aget_status(payment_id, load):
+    """Versão async de get_status; `load` é uma coroutine function"""
+    if not getattr(settings, 'PAGBANK_STATUS_CACHE_ENABLED', True):
+        return await load(payment_id)
+
+    data, generation = await sync_to_async(lookup)(payment_id)
+    if data is not None:
+        return data
+
+    async def load_and_store():
+        data = await load(payment_id)
+        await sync_to_async(store)(payment_id, generation, data)
+        return data
+
+    return await _async_flight.do(str(payment_id), load_and_store)
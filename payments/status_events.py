@@ -0,0 +1,197 @@
+"""Pub/sub de mudanças de status de pagamento para long-poll e SSE.
+
+O processamento de webhooks publica (payment_id, status) depois do commit.
+No processo, StatusBroker entrega a mudança às requisições esperando por
+aquele pagamento; cada uma espera em uma asyncio.Queue do seu event loop,
+sem ocupar thread. O backend leva as mudanças de um processo para outro
+(ex.: do worker process_webhooks para os workers ASGI):
+
+- 'local': só o próprio processo
+- 'database': cada processo com clientes esperando consulta, a cada
+  PAGBANK_STATUS_EVENTS_POLL_INTERVAL, os pagamentos assinados que mudaram
+  (uma query por intervalo, não por cliente)
+- caminho pontuado para outro backend (ex.: Redis pub/sub), com
+  publish(payment_id, status) e a coroutine listen(broker)
+"""
+import asyncio
+import logging
+import threading
+import weakref
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Payment
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """Mudanças de status de um pagamento recebidas por uma requisição"""
+
+    def __init__(self, broker, payment_id):
+        self.broker = broker
+        self.payment_id = str(payment_id)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    async def get(self, timeout):
+        """Próximo status publicado, ou None se o timeout acabar antes"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+
+class StatusBroker:
+    """Assinaturas do processo por pagamento; publish pode vir de qualquer thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+
+    def subscribe(self, payment_id):
+        """Assina as mudanças do pagamento (chamar dentro do event loop da requisição)"""
+        subscription = Subscription(self, payment_id)
+        with self._lock:
+            self._subscriptions.setdefault(subscription.payment_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.payment_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.payment_id]
+
+    def subscribed_ids(self):
+        with self._lock:
+            return list(self._subscriptions)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def deliver(self, payment_id, status):
+        """Entrega o status às assinaturas do pagamento neste processo"""
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(str(payment_id), ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.queue.put_nowait, status)
+            except RuntimeError:
+                # event loop já encerrado; a assinatura sai no __aexit__
+                pass
+
+
+class LocalStatusBackend:
+    """Sem entrega entre processos"""
+
+    def publish(self, payment_id, status):
+        pass
+
+    async def listen(self, broker):
+        pass
+
+
+class DatabaseStatusBackend:
+    """Entrega entre processos lendo os Payments assinados que mudaram.
+
+    Não precisa publicar nada: a linha do Payment (status, updated_at) já
+    é a mensagem. Entregas repetidas do mesmo status são descartadas por
+    quem espera.
+    """
+
+    def publish(self, payment_id, status):
+        pass
+
+    def changed_since(self, payment_ids, since):
+        close_old_connections()
+        return list(
+            Payment.objects.filter(id__in=payment_ids, updated_at__gt=since)
+            .values_list('id', 'status')
+        )
+
+    async def listen(self, broker):
+        interval = getattr(settings, 'PAGBANK_STATUS_EVENTS_POLL_INTERVAL', 1.0)
+        # Janela com folga para commits que terminam depois do updated_at gravado
+        lookback = timedelta(seconds=max(interval, 1.0))
+        checked_at = timezone.now()
+        while True:
+            await asyncio.sleep(interval)
+            payment_ids = broker.subscribed_ids()
+            now = timezone.now()
+            if not payment_ids:
+                checked_at = now
+                continue
+            try:
+                # Fora da thread de alguma requisição: a tarefa vive mais que ela
+                rows = await sync_to_async(self.changed_since, thread_sensitive=False)(
+                    payment_ids, checked_at - lookback
+                )
+            except Exception as e:
+                logger.error(f"Erro ao buscar mudanças de status: {str(e)}")
+                continue
+            checked_at = now
+            for payment_id, status in rows:
+                broker.deliver(payment_id, status)
+
+
+BACKENDS = {
+    'local': LocalStatusBackend,
+    'database': DatabaseStatusBackend,
+}
+
+broker = StatusBroker()
+_backend = None
+_backend_lock = threading.Lock()
+# Uma tarefa listen() do backend por event loop com clientes esperando
+_listeners = weakref.WeakKeyDictionary()
+
+
+def get_backend():
+    """Backend configurado em PAGBANK_STATUS_EVENTS_BACKEND"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = getattr(settings, 'PAGBANK_STATUS_EVENTS_BACKEND', 'database')
+                backend_class = BACKENDS.get(name) or import_string(name)
+                _backend = backend_class()
+    return _backend
+
+
+def _ensure_listener():
+    loop = asyncio.get_running_loop()
+    task = _listeners.get(loop)
+    if task is None or task.done():
+        _listeners[loop] = loop.create_task(get_backend().listen(broker))
+
+
+def subscribe(payment_id):
+    """Assinatura (async context manager) das mudanças de um pagamento"""
+    _ensure_listener()
+    return broker.subscribe(payment_id)
+
+
+def publish(payment_id, status):
+    """Publica a mudança neste processo e no backend (chamar após o commit)"""
+    broker.deliver(payment_id, status)
+    try:
+        get_backend().publish(payment_id, status)
+    except Exception as e:
+        logger.error(f"Erro ao publicar status de {payment_id}: {str(e)}")
@@ -0,0 +1,210 @@
+"""Logs estruturados (JSON) do logger 'payments', escritos fora das requisições.
+
+Três peças, ligadas em settings.LOGGING:
+
+- Payload: embrulha o corpo enviado/recebido do PagBank (dict, texto JSON ou
+  a própria resposta HTTP). Nada é lido, serializado ou mascarado na
+  chamada ao logger: se o nível está desligado o registro nem é criado, e
+  se está ligado o trabalho fica com a thread de escrita.
+- PayloadSampleFilter: só uma fração dos registros com payload passa
+  (WARNING ou acima sempre passam). A decisão usa o hash da `key` do
+  Payload (ex.: a referência do pagamento), então a ordem e a resposta do
+  mesmo pagamento entram ou saem juntas.
+- QueueFileHandler: a requisição só põe o registro em uma fila em memória;
+  uma thread do processo formata (JsonFormatter) e grava no arquivo. Com a
+  fila cheia o registro é descartado e contado em `stats`, em vez de
+  segurar a requisição.
+
+Campos de cartão e tax_id são mascarados na formatação (redact).
+"""
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import zlib
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from .counters import Counters
+
+REDACTED = '[REDACTED]'
+# Mascarados em qualquer nível do payload
+SENSITIVE_KEYS = frozenset({
+    'tax_id', 'payer_cpf', 'security_code', 'cvv', 'encrypted', 'encrypted_card', 'card_number',
+})
+# Mascarados dentro de um objeto 'card'
+CARD_KEYS = frozenset({'number', 'exp_month', 'exp_year'})
+# Números de cartão soltos em texto (respostas que não são JSON)
+CARD_NUMBER_RE = re.compile(r'\b\d{13,19}\b')
+MAX_TEXT_LENGTH = 4096
+
+# Atributos de todo LogRecord; o resto veio de `extra=` e vai para o JSON
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class LogStats(Counters):
+    """Contadores do processo para registros descartados (fila cheia ou amostragem)"""
+
+    FIELDS = ('dropped', 'sampled_out')
+
+
+stats = LogStats()
+
+
+def luhn_valid(digits):
+    total = 0
+    for i, digit in enumerate(reversed(digits)):
+        digit = int(digit)
+        if i % 2:
+            digit = digit * 2 - 9 if digit > 4 else digit * 2
+        total += digit
+    return total % 10 == 0
+
+
+def mask_card_numbers(text):
+    """Troca sequências de 13 a 19 dígitos que passam no Luhn por REDACTED"""
+    return CARD_NUMBER_RE.sub(lambda m: REDACTED if luhn_valid(m.group()) else m.group(), text)
+
+
+def redact(value, in_card=False):
+    """Cópia de `value` com campos de cartão e tax_id mascarados"""
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if key in SENSITIVE_KEYS or (in_card and key in CARD_KEYS)
+            else redact(item, key == 'card')
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [redact(item, in_card) for item in value]
+    if isinstance(value, str):
+        return mask_card_numbers(value)
+    return value
+
+
+class Payload:
+    """Corpo de requisição/resposta serializado só quando o registro é formatado.
+
+    `source` não deve ser alterado depois do log: a leitura acontece na
+    thread de escrita.
+    """
+
+    __slots__ = ('source', 'key')
+
+    def __init__(self, source, key=None):
+        self.source = source
+        self.key = key
+
+    def value(self):
+        source = self.source
+        if hasattr(source, 'status_code'):
+            # resposta HTTP (requests ou GatewayResponse): .text só é decodificado aqui
+            source = source.text
+        if isinstance(source, bytes):
+            source = source.decode('utf-8', errors='replace')
+        if isinstance(source, str):
+            try:
+                source = json.loads(source)
+            except ValueError:
+                return redact(source[:MAX_TEXT_LENGTH])
+        return redact(source)
+
+    def __str__(self):
+        return json.dumps(self.value(), ensure_ascii=False, default=str)
+
+
+class PayloadSampleFilter(logging.Filter):
+    """Deixa passar só `rate` (0 a 1) dos registros INFO/DEBUG com payload"""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        payload = getattr(record, 'payload', None)
+        if payload is None or self.rate >= 1 or record.levelno >= logging.WARNING:
+            return True
+        if payload.key is not None:
+            sampled = zlib.crc32(str(payload.key).encode()) % 10000 < self.rate * 10000
+        else:
+            sampled = random.random() < self.rate
+        if not sampled:
+            stats.increment('sampled_out')
+        return sampled
+
+
+class JsonFormatter(logging.Formatter):
+    """Um objeto JSON por linha: campos do registro, `extra=` e exceção"""
+
+    def format(self, record):
+        data = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'process': record.process,
+            'thread': record.thread,
+            'message': mask_card_numbers(record.getMessage()),
+        }
+        for name, value in vars(record).items():
+            if name not in RECORD_ATTRIBUTES:
+                data[name] = value.value() if isinstance(value, Payload) else value
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            data['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class QueueFileHandler(QueueHandler):
+    """Põe os registros em uma fila; uma thread formata e grava em `filename`.
+
+    A thread é (re)iniciada no primeiro registro de cada processo, então o
+    handler sobrevive ao fork dos workers (gunicorn --preload).
+    """
+
+    def __init__(self, filename, queue_size=10000, encoding='utf-8'):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.target = logging.FileHandler(filename, encoding=encoding, delay=True)
+        self.listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def setFormatter(self, fmt):
+        # A formatação acontece na thread de escrita
+        self.target.setFormatter(fmt)
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self.listener = QueueListener(self.queue, self.target)
+                self.listener.start()
+                self._pid = os.getpid()
+
+    def prepare(self, record):
+        # Fila em memória: o registro vai como está (sem formatar nem copiar)
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            stats.increment('dropped')
+
+    def flush(self):
+        """Espera a fila esvaziar (testes, benchmarks, shutdown)"""
+        with self._start_lock:
+            if self._pid == os.getpid():
+                self.listener.stop()
+                self._pid = None
+        self.target.flush()
+
+    def close(self):
+        self.flush()
+        self.target.close()
+        super().close()
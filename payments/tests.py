@@ -1,3 +1,1722 @@
-from django.test import TestCase
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .counters import Counters
+from .reconcile import FileCheckpoint, Reconciler
+from .retry import (
+    RetryBudget, RetryPolicy, RetryStats, is_retryable_exception, is_retryable_status,
+)
+from .models import IdempotencyKey, Payment, PaymentItem, WebhookDelivery, WebhookEvent, to_cents
+from . import (
+    async_services, async_views, circuit_breaker, load_shedding, metrics, profiling, rate_limit, status_cache,
+    status_events, structured_logging, throttling, tracing, webhook_queue,
+)
+from .services import PagBankService
+
+
+# Os testes provocam falhas do PagBank e respostas 4xx/5xx de propósito; sem
+# isso os logs de `payments` e `django.request` poluem a saída dos testes e
+# vão para logs/pagbank.log
+QUIET_LOGGERS = ('payments', 'django.request')
+_logger_levels = {}
+
+
+def setUpModule():
+    for name in QUIET_LOGGERS:
+        logger = logging.getLogger(name)
+        _logger_levels[name] = logger.level
+        logger.setLevel(logging.CRITICAL)
+
+
+def tearDownModule():
+    for name, level in _logger_levels.items():
+        logging.getLogger(name).setLevel(level)
+
+
+def create_payments(count, items_per_payment=3, **kwargs):
+    return [
+        Payment.objects.create_with_items(
+            [{'title': f'Item {j}', 'quantity': 1, 'unit_price': Decimal('10.00')}
+             for j in range(items_per_payment)],
+            amount=Decimal('10.00') * items_per_payment,
+            description=f'Pagamento {i}',
+            payer_email='teste@example.com',
+            **kwargs
+        )
+        for i in range(count)
+    ]
+
+
+class PaymentQueryCountTests(TestCase):
+    """Número de queries por endpoint não pode crescer com o número de pagamentos/itens"""
+
+    def test_list_query_count_does_not_depend_on_page_size(self):
+        create_payments(100)
+        for page_size in (10, 100):
+            # página + prefetch dos itens
+            with self.assertNumQueries(2):
+                response = self.client.get('/api/payments/', {'page_size': page_size})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()['results']), page_size)
+            self.assertEqual(len(response.json()['results'][0]['items']), 3)
+
+    def test_list_projection_without_items_skips_prefetch(self):
+        create_payments(20)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/payments/', {'fields': 'id,status'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'status'})
+
+    def test_list_projection_with_total_amount_reads_only_the_column(self):
+        create_payments(20)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/payments/', {'fields': 'id,total_amount'})
+        self.assertEqual(response.json()['results'][0]['total_amount'], 30.0)
+
+    def test_detail_query_count(self):
+        payment = create_payments(1, items_per_payment=10)[0]
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/payments/{payment.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['items']), 10)
+        self.assertEqual(response.json()['total_amount'], 100.0)
+
+    def test_status_query_count_without_gateway_id(self):
+        payment = create_payments(1, items_per_payment=10)[0]
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/payments/{payment.id}/status/')
+        self.assertEqual(response.status_code, 200)
+
+    @mock.patch('payments.views.PagSeguroService.get_order')
+    def test_status_query_count_with_transition(self, get_order):
+        get_order.return_value = {'success': True, 'order': {'status': 'PAID'}}
+        payment = create_payments(1, items_per_payment=10, payment_gateway_id='ORDE_TESTE')[0]
+        # leitura + prefetch + UPDATE condicional + refresh de status/updated_at
+        with self.assertNumQueries(4):
+            response = self.client.get(f'/api/payments/{payment.id}/status/')
+        self.assertEqual(response.json()['status'], 'approved')
+        self.assertEqual(len(response.json()['items']), 10)
+
+
+class PaymentTotalsTests(TestCase):
+    """Totais em centavos mantidos pela camada de modelo"""
+
+    def test_to_cents_is_exact(self):
+        self.assertEqual(to_cents('0.29'), 29)
+        self.assertEqual(to_cents(Decimal('1234.565')), 123457)
+        self.assertEqual(to_cents(19.99), 1999)
+
+    def test_create_with_items_stores_totals(self):
+        payment = Payment.objects.create_with_items(
+            [{'title': 'A', 'quantity': 3, 'unit_price': Decimal('0.29')},
+             {'title': 'B', 'quantity': 1, 'unit_price': Decimal('10.00')}],
+            amount=Decimal('10.87'), description='Teste', payer_email='teste@example.com'
+        )
+        payment.refresh_from_db()
+        self.assertEqual((payment.amount_cents, payment.total_cents, payment.item_count), (1087, 1087, 2))
+        self.assertEqual(payment.total_amount, Decimal('10.87'))
+        self.assertEqual(
+            sorted(payment.items.values_list('unit_price_cents', 'total_cents')), [(29, 87), (1000, 1000)]
+        )
+
+    def test_item_save_and_delete_keep_payment_totals(self):
+        payment = create_payments(1, items_per_payment=2)[0]
+        item = PaymentItem.objects.create(payment=payment, title='C', quantity=2, unit_price=Decimal('5.50'))
+        payment.refresh_from_db()
+        self.assertEqual((payment.total_cents, payment.item_count), (3100, 3))
+
+        item.quantity = 1
+        item.save()
+        payment.refresh_from_db()
+        self.assertEqual(payment.total_cents, 2550)
+
+        item.delete()
+        payment.refresh_from_db()
+        self.assertEqual((payment.total_cents, payment.item_count), (2000, 2))
+        self.assertEqual(item.total_price, Decimal('5.50'))
+
+
+class PaymentBulkCreateTests(TestCase):
+    """POST /api/payments/bulk/ com número fixo de queries por lote"""
+
+    def setUp(self):
+        # cada pagamento do lote conta no limite de escritas do cliente
+        cache.clear()
+
+    def payload(self, items=2):
+        return {
+            'amount': str(Decimal('10.00') * items),
+            'description': 'Bulk',
+            'payer_email': 'teste@example.com',
+            'items': [{'title': f'Item {i}', 'quantity': 1, 'unit_price': '10.00'} for i in range(items)],
+        }
+
+    @mock.patch('payments.views.PagSeguroService.create_checkout_session')
+    def test_bulk_create_query_count_does_not_depend_on_batch_size(self, create_checkout):
+        create_checkout.return_value = {'success': True}
+        for count in (5, 50):
+            # insert dos pagamentos + insert dos itens (SAVEPOINT/RELEASE dentro do
+            # TestCase) + um UPDATE com o resultado de todos os checkouts
+            with self.assertNumQueries(5):
+                response = self.client.post(
+                    '/api/payments/bulk/', {'payments': [self.payload()] * count}, content_type='application/json'
+                )
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(response.json()['results']), count)
+        self.assertEqual(PaymentItem.objects.count(), 110)
+        self.assertEqual(set(Payment.objects.values_list('total_cents', 'item_count')), {(2000, 2)})
+
+    @mock.patch('payments.views.PagSeguroService.create_checkout_session')
+    def test_bulk_create_partial_failure_keeps_failed_payments(self, create_checkout):
+        create_checkout.side_effect = lambda data: {'success': data['items'][0]['title'] != 'Falha'}
+        failing = self.payload()
+        failing['items'][0]['title'] = 'Falha'
+        response = self.client.post(
+            '/api/payments/bulk/', {'payments': [self.payload(), failing]}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['success'] for result in response.json()['results']], [True, False])
+        self.assertEqual(sorted(Payment.objects.values_list('status', flat=True)), ['gateway_failed', 'pending'])
+
+    def test_each_bulk_order_uses_its_payment_id_as_pagbank_idempotency_key(self):
+        def order(*args, **kwargs):
+            return mock.Mock(status_code=201, text='{}', json=lambda: {'id': f'ORDE_{uuid.uuid4().hex}', 'links': []})
+
+        with mock.patch('payments.services.get_session') as get_session:
+            get_session.return_value.request.side_effect = order
+            response = self.client.post(
+                '/api/payments/bulk/', {'payments': [self.payload()] * 3}, content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 201)
+        keys = [call.kwargs['headers']['x-idempotency-key'] for call in get_session.return_value.request.call_args_list]
+        self.assertEqual(sorted(keys), sorted(str(result['payment_id']) for result in response.json()['results']))
+
+    @mock.patch('payments.views.PagSeguroService.create_checkout_session')
+    def test_bulk_retry_with_same_key_is_replayed(self, create_checkout):
+        create_checkout.return_value = {'success': True}
+        data = {'payments': [self.payload()] * 2}
+        first = self.client.post('/api/payments/bulk/', data, content_type='application/json', HTTP_IDEMPOTENCY_KEY='lote-1')
+        retry = self.client.post('/api/payments/bulk/', data, content_type='application/json', HTTP_IDEMPOTENCY_KEY='lote-1')
+        self.assertEqual((retry.status_code, retry.json()), (201, first.json()))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual((Payment.objects.count(), create_checkout.call_count), (2, 2))
+
+    def test_bulk_create_reports_validation_errors_per_payment(self):
+        invalid = self.payload()
+        invalid['amount'] = '1.00'
+        response = self.client.post(
+            '/api/payments/bulk/', {'payments': [self.payload(), invalid]}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'][0], {})
+        self.assertIn('items', response.json()['errors'][1])
+        self.assertFalse(Payment.objects.exists())
+
+
+class PaymentGatewayLifecycleTests(TestCase):
+    """Pagamento gravado uma vez como pending_gateway; a resposta do PagBank só faz um UPDATE"""
+
+    payload = {
+        'amount': '20.00',
+        'description': 'Checkout',
+        'payer_email': 'teste@example.com',
+        'items': [{'title': 'Item', 'quantity': 2, 'unit_price': '10.00'}],
+    }
+
+    def post(self):
+        return self.client.post('/api/payments/', self.payload, content_type='application/json')
+
+    @mock.patch('payments.views.PagSeguroService.create_checkout_session')
+    def test_failed_checkout_is_recorded_not_deleted(self, create_checkout):
+        create_checkout.return_value = {'success': False, 'error': 'invalid_parameter'}
+        # SAVEPOINT + insert do pagamento + insert dos itens + RELEASE + UPDATE do status
+        with self.assertNumQueries(5):
+            response = self.post()
+        self.assertEqual(response.status_code, 400)
+        payment = Payment.objects.get(id=response.json()['payment_id'])
+        self.assertEqual((payment.status, payment.item_count), ('gateway_failed', 1))
+
+    @mock.patch('payments.views.PagSeguroService.create_checkout_session')
+    def test_successful_checkout_stores_order_id(self, create_checkout):
+        create_checkout.return_value = {'success': True, 'order_id': 'ORDE_1'}
+        response = self.post()
+        payment = Payment.objects.get(id=response.json()['payment_id'])
+        self.assertEqual((payment.status, payment.payment_gateway_id), ('pending', 'ORDE_1'))
+
+    @mock.patch('payments.views.PagSeguroService.create_checkout_session')
+    def test_timed_out_checkout_is_approved_by_webhook(self, create_checkout):
+        # o PagBank criou a ordem, mas a resposta não chegou a tempo
+        create_checkout.return_value = {'success': False, 'error': 'Read timed out'}
+        payment_id = self.post().json()['payment_id']
+        self.assertEqual(Payment.objects.get(id=payment_id).status, 'gateway_failed')
+
+        result = PagBankService().process_webhook({'id': 'ORDE_TIMEOUT', 'reference_id': str(payment_id), 'status': 'PAID'})
+        self.assertEqual(result['outcome'], 'updated')
+        payment = Payment.objects.get(id=payment_id)
+        self.assertEqual((payment.status, payment.payment_gateway_id), ('approved', 'ORDE_TIMEOUT'))
+
+    def test_gateway_result_does_not_overwrite_webhook_status(self):
+        payment = create_payments(1, status='pending_gateway')[0]
+        # webhook PAID chegou antes da resposta de POST /orders
+        self.assertTrue(Payment.objects.transition_status(payment.id, 'approved', 'ORDE_2'))
+        Payment.objects.record_gateway_result(payment.id, 'pending', payment_gateway_id='ORDE_2')
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'approved')
+
+
+class IdempotencyKeyTests(TestCase):
+    """Header Idempotency-Key em POST /api/payments/ e /api/payments/transparent/"""
+
+    payload = {
+        'amount': '20.00',
+        'description': 'Idempotente',
+        'payer_email': 'teste@example.com',
+        'items': [{'title': 'Item', 'quantity': 2, 'unit_price': '10.00'}],
+    }
+
+    def post(self, url, data, key):
+        return self.client.post(url, data, content_type='application/json', HTTP_IDEMPOTENCY_KEY=key)
+
+    @mock.patch('payments.views.PagSeguroService.create_checkout_session')
+    def test_retry_returns_original_response_without_calling_gateway(self, create_checkout):
+        create_checkout.return_value = {'success': True, 'checkout_url': 'https://pagbank/checkout'}
+        first = self.post('/api/payments/', self.payload, 'chave-1')
+        retry = self.post('/api/payments/', self.payload, 'chave-1')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((retry.status_code, retry.json()), (201, first.json()))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Payment.objects.count(), 1)
+        create_checkout.assert_called_once()
+        # o PagBank recebe o id do pagamento como x-idempotency-key
+        self.assertEqual(create_checkout.call_args.args[0]['idempotency_key'], first.json()['payment_id'])
+
+    @mock.patch('payments.views.PagSeguroService.create_checkout_session')
+    def test_same_key_with_different_body_is_rejected(self, create_checkout):
+        create_checkout.return_value = {'success': True}
+        self.post('/api/payments/', self.payload, 'chave-2')
+        response = self.post('/api/payments/', {**self.payload, 'description': 'Outro'}, 'chave-2')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Payment.objects.count(), 1)
+
+    @mock.patch('payments.views.PagSeguroService.create_checkout_session')
+    def test_request_in_flight_returns_conflict(self, create_checkout):
+        create_checkout.return_value = {'success': True}
+        self.post('/api/payments/', self.payload, 'chave-3')
+        # primeira requisição ainda em andamento
+        IdempotencyKey.objects.update(status='processing', locked_at=timezone.now())
+        response = self.post('/api/payments/', self.payload, 'chave-3')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Retry-After'], '1')
+        create_checkout.assert_called_once()
+
+    @mock.patch('payments.views.PagSeguroService.create_checkout_session')
+    def test_lock_outlives_the_slowest_gateway_call(self, create_checkout):
+        create_checkout.return_value = {'success': True}
+        self.post('/api/payments/', self.payload, 'chave-8')
+        # Todas as tentativas esgotando PAGBANK_TIMEOUT: o lock ainda vale
+        slowest_call = timedelta(seconds=settings.PAGBANK_TIMEOUT * (settings.PAGBANK_MAX_RETRIES + 1))
+        IdempotencyKey.objects.update(status='processing', locked_at=timezone.now() - slowest_call)
+        response = self.post('/api/payments/', self.payload, 'chave-8')
+        self.assertEqual(response.status_code, 409)
+        create_checkout.assert_called_once()
+
+    @mock.patch('payments.views.PagSeguroService.create_checkout_session')
+    def test_stale_lock_is_taken_over(self, create_checkout):
+        create_checkout.return_value = {'success': True}
+        self.post('/api/payments/', self.payload, 'chave-7')
+        IdempotencyKey.objects.update(status='processing', locked_at=timezone.now() - timedelta(minutes=5))
+        response = self.post('/api/payments/', self.payload, 'chave-7')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(IdempotencyKey.objects.get().status, 'completed')
+
+    @mock.patch('payments.views.PagSeguroService.create_checkout_session')
+    def test_gateway_unavailable_releases_key(self, create_checkout):
+        create_checkout.return_value = {'success': False, 'circuit_open': True, 'retry_after': 5}
+        response = self.post('/api/payments/', self.payload, 'chave-4')
+        self.assertEqual(response.status_code, 503)
+        # a chave fica liberada, ainda presa ao pagamento criado
+        record, payment = IdempotencyKey.objects.get(), Payment.objects.get()
+        self.assertEqual((record.status, record.payment_id), ('released', payment.id))
+        self.assertEqual(payment.status, 'gateway_failed')
+
+    @mock.patch('payments.views.PagSeguroService.create_checkout_session')
+    def test_retry_after_5xx_reuses_the_same_payment(self, create_checkout):
+        create_checkout.return_value = {'success': False, 'circuit_open': True, 'retry_after': 5}
+        self.post('/api/payments/', self.payload, 'chave-8')
+        payment = Payment.objects.get()
+
+        create_checkout.return_value = {'success': True, 'order_id': 'ORDE_RETRY', 'checkout_code': 'CHEC_1'}
+        retry = self.post('/api/payments/', self.payload, 'chave-8')
+
+        self.assertEqual((retry.status_code, retry.json()['payment_id']), (201, str(payment.id)))
+        # nenhum pagamento órfão, e a mesma x-idempotency-key nas duas chamadas
+        self.assertEqual(Payment.objects.count(), 1)
+        keys = [call.args[0]['idempotency_key'] for call in create_checkout.call_args_list]
+        self.assertEqual(keys, [str(payment.id)] * 2)
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.payment_gateway_id), ('pending', 'ORDE_RETRY'))
+        self.assertEqual(IdempotencyKey.objects.get().status, 'completed')
+
+    @mock.patch('payments.views.PagSeguroService.create_checkout_session')
+    def test_released_key_with_different_body_is_rejected(self, create_checkout):
+        create_checkout.return_value = {'success': False, 'circuit_open': True, 'retry_after': 5}
+        self.post('/api/payments/', self.payload, 'chave-9')
+        response = self.post('/api/payments/', {**self.payload, 'description': 'Outro'}, 'chave-9')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Payment.objects.count(), 1)
+
+    @mock.patch('payments.views.PagSeguroService.create_checkout_session')
+    def test_same_key_from_different_callers_is_independent(self, create_checkout):
+        create_checkout.return_value = {'success': True}
+        first = self.client.post('/api/payments/', self.payload, content_type='application/json',
+                                 HTTP_IDEMPOTENCY_KEY='chave-10', REMOTE_ADDR='10.0.0.1')
+        other = self.client.post('/api/payments/', self.payload, content_type='application/json',
+                                 HTTP_IDEMPOTENCY_KEY='chave-10', REMOTE_ADDR='10.0.0.2')
+        self.assertEqual((first.status_code, other.status_code), (201, 201))
+        self.assertNotIn('Idempotent-Replayed', other)
+        self.assertNotEqual(first.json()['payment_id'], other.json()['payment_id'])
+        self.assertEqual(
+            sorted(IdempotencyKey.objects.values_list('caller', flat=True)), ['ip:10.0.0.1', 'ip:10.0.0.2']
+        )
+
+    @mock.patch('payments.views.PagSeguroService.create_checkout_session')
+    def test_replay_reads_the_key_without_inserting(self, create_checkout):
+        create_checkout.return_value = {'success': True}
+        self.post('/api/payments/', self.payload, 'chave-11')
+        with CaptureQueriesContext(connection) as queries:
+            self.post('/api/payments/', self.payload, 'chave-11')
+        statements = [query['sql'] for query in queries.captured_queries if 'payments_idempotencykey' in query['sql']]
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(statements[0].startswith('SELECT'))
+
+    @mock.patch('payments.views.PagSeguroService.create_transparent_payment')
+    def test_transparent_payment_retry_is_replayed(self, create_transparent):
+        create_transparent.return_value = {'success': True, 'charge_id': 'CHAR_1', 'status': 'PAID'}
+        data = {'payment': {'amount': '10.00', 'payer_email': 'teste@example.com'}, 'card': {'encrypted': 'x'}}
+        first = self.post('/api/payments/transparent/', data, 'chave-5')
+        retry = self.post('/api/payments/transparent/', data, 'chave-5')
+        self.assertEqual((first.status_code, retry.status_code), (201, 201))
+        self.assertEqual(retry.json()['payment_id'], first.json()['payment_id'])
+        create_transparent.assert_called_once()
+        self.assertEqual(create_transparent.call_args.args[0]['idempotency_key'], first.json()['payment_id'])
+
+    def test_key_is_forwarded_as_pagbank_idempotency_header(self):
+        headers = PagBankService()._request_headers('POST', 'chave-6')
+        self.assertEqual(headers['x-idempotency-key'], 'chave-6')
+
+
+class PaymentStatusCacheTests(TestCase):
+    """Cache read-through de GET /api/payments/<id>/status/"""
+
+    def setUp(self):
+        cache.clear()
+
+    @mock.patch('payments.views.PagSeguroService.get_order')
+    def test_repeated_polls_are_served_from_cache(self, get_order):
+        get_order.return_value = {'success': True, 'order': {'status': 'WAITING'}}
+        payment = create_payments(1, payment_gateway_id='ORDE_CACHE')[0]
+        self.client.get(f'/api/payments/{payment.id}/status/')
+        with self.assertNumQueries(0):
+            response = self.client.get(f'/api/payments/{payment.id}/status/')
+        self.assertEqual(response.json()['status'], 'pending')
+        get_order.assert_called_once()
+
+    @mock.patch('payments.views.PagSeguroService.get_order')
+    def test_webhook_invalidates_cached_status(self, get_order):
+        get_order.return_value = {'success': True, 'order': {'status': 'WAITING'}}
+        payment = create_payments(1, payment_gateway_id='ORDE_WEBHOOK')[0]
+        self.client.get(f'/api/payments/{payment.id}/status/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PagBankService().process_webhook({'id': 'ORDE_WEBHOOK', 'reference_id': str(payment.id), 'status': 'PAID'})
+
+        get_order.return_value = {'success': True, 'order': {'status': 'PAID'}}
+        response = self.client.get(f'/api/payments/{payment.id}/status/')
+        self.assertEqual(response.json()['status'], 'approved')
+        self.assertEqual(get_order.call_count, 2)
+
+    def test_load_started_before_invalidation_is_not_stored(self):
+        payment = create_payments(1)[0]
+        data, generation = status_cache.lookup(payment.id)
+        status_cache.invalidate(payment.id)
+        status_cache.store(payment.id, generation, {'status': 'pending'})
+        self.assertEqual(status_cache.lookup(payment.id)[0], None)
+
+    def test_ttl_depends_on_status(self):
+        self.assertLess(status_cache.ttl_for('pending'), status_cache.ttl_for('approved'))
+
+    def test_single_flight_coalesces_concurrent_calls(self):
+        flight = status_cache.SingleFlight()
+        calls = []
+
+        def load():
+            calls.append(1)
+            time.sleep(0.05)
+            return 'ok'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('k', load))) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((len(calls), results), (1, ['ok'] * 20))
+
+
+@mock.patch.object(status_events, '_backend', status_events.LocalStatusBackend())
+class PaymentStatusEventsTests(TransactionTestCase):
+    """Long-poll e SSE de mudanças de status (views async).
+
+    TransactionTestCase: as views leem em threads do executor, com outra conexão.
+    """
+
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+
+    async def wait(self, payment, **params):
+        request = self.factory.get(f'/api/payments/{payment.id}/status/wait/', params)
+        response = await async_views.payment_status_wait(request, payment.id)
+        return response.status_code, json.loads(response.content)
+
+    async def test_long_poll_returns_immediately_when_status_differs(self):
+        payment = (await sync_to_async(create_payments)(1))[0]
+        status_code, data = await self.wait(payment, status='approved', timeout=5)
+        self.assertEqual((status_code, data['status']), (200, 'pending'))
+
+    async def test_long_poll_times_out_with_current_status(self):
+        payment = (await sync_to_async(create_payments)(1))[0]
+        status_code, data = await self.wait(payment, status='pending', timeout=0.05)
+        self.assertEqual((status_code, data['status']), (200, 'pending'))
+
+    async def test_long_poll_wakes_up_on_webhook(self):
+        payment = (await sync_to_async(create_payments)(1, payment_gateway_id='ORDE_WAIT'))[0]
+
+        def deliver_webhook():
+            PagBankService().process_webhook({'id': 'ORDE_WAIT', 'reference_id': str(payment.id), 'status': 'PAID'})
+
+        waiting = asyncio.ensure_future(self.wait(payment, status='pending', timeout=5))
+        while not status_events.broker.subscriber_count():
+            await asyncio.sleep(0.01)
+        await sync_to_async(deliver_webhook)()
+        status_code, data = await asyncio.wait_for(waiting, 1)
+        self.assertEqual((status_code, data['status']), (200, 'approved'))
+        self.assertEqual(status_events.broker.subscriber_count(), 0)
+
+    async def test_long_poll_unknown_payment(self):
+        payment = Payment(id=uuid.uuid4())
+        status_code, _ = await self.wait(payment, status='pending', timeout=0)
+        self.assertEqual(status_code, 404)
+
+    async def test_event_stream_ends_on_final_status(self):
+        payment = (await sync_to_async(create_payments)(1, status='cancelled'))[0]
+        request = self.factory.get(f'/api/payments/{payment.id}/events/')
+        response = await async_views.payment_events(request, payment.id)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(len(chunks), 1)
+        self.assertTrue(chunks[0].startswith(b'event: status\ndata: {'))
+        self.assertIn(b'"status":"cancelled"', chunks[0])
+
+    async def test_event_stream_unsubscribes_when_loading_fails(self):
+        payment = (await sync_to_async(create_payments)(1))[0]
+        request = self.factory.get(f'/api/payments/{payment.id}/events/')
+        with mock.patch('payments.async_views.load_payment', side_effect=RuntimeError('db')):
+            with self.assertRaises(RuntimeError):
+                await async_views.payment_events(request, payment.id)
+        self.assertEqual(status_events.broker.subscriber_count(), 0)
+
+    @mock.patch('payments.status_events._ensure_listener')
+    def test_routes_answer_501_under_wsgi(self, ensure_listener):
+        payment = create_payments(1, status='cancelled')[0]
+        for url in (f'/api/payments/{payment.id}/status/wait/', f'/api/payments/{payment.id}/events/'):
+            response = self.client.get(url, {'status': 'pending', 'timeout': 0})
+            self.assertEqual(response.status_code, 501)
+            # middlewares do projeto rodaram
+            self.assertEqual(response['X-Frame-Options'], 'DENY')
+        ensure_listener.assert_not_called()
+
+    async def test_routes_go_through_the_django_handler_under_asgi(self):
+        payment = (await sync_to_async(create_payments)(1))[0]
+        response = await self.async_client.get(
+            f'/api/payments/{payment.id}/status/wait/', {'status': 'approved', 'timeout': 0}
+        )
+        self.assertEqual((response.status_code, response.json()['status']), (200, 'pending'))
+        self.assertEqual(response['X-Frame-Options'], 'DENY')
+
+        await Payment.objects.filter(id=payment.id).aupdate(status='cancelled')
+        response = await self.async_client.get(f'/api/payments/{payment.id}/events/')
+        self.assertEqual((response.status_code, response['Content-Type']), (200, 'text/event-stream'))
+        self.assertEqual(len([chunk async for chunk in response.streaming_content]), 1)
+        self.assertEqual(status_events.broker.subscriber_count(), 0)
+
+
+class ReconcilePaymentsTests(TestCase):
+    """manage.py reconcile_payments"""
+
+    def setUp(self):
+        cache.clear()
+        self.checkpoint = os.path.join(tempfile.mkdtemp(), 'checkpoint.json')
+        self.addCleanup(lambda: os.path.exists(self.checkpoint) and os.remove(self.checkpoint))
+        self.payments = create_payments(4, items_per_payment=1)
+        for i, payment in enumerate(self.payments):
+            Payment.objects.filter(id=payment.id).update(
+                payment_gateway_id=f'ORDE_REC_{i}', created_at=timezone.now() - timedelta(hours=2, minutes=-i)
+            )
+
+    def reconcile(self, *args):
+        output = StringIO()
+        call_command(
+            'reconcile_payments', '--checkpoint', self.checkpoint, *args, stdout=output
+        )
+        return output.getvalue()
+
+    @mock.patch('payments.services.PagBankService.get_order')
+    def test_stale_pending_payments_are_updated_in_bulk(self, get_order):
+        statuses = {'ORDE_REC_0': 'PAID', 'ORDE_REC_1': 'WAITING', 'ORDE_REC_2': 'DECLINED', 'ORDE_REC_3': 'PAID'}
+        get_order.side_effect = lambda order_id: {
+            'success': True, 'order': {'id': order_id, 'status': statuses[order_id]}
+        }
+        output = self.reconcile('--chunk-size', '3')
+        self.assertEqual(
+            [Payment.objects.get(id=payment.id).status for payment in self.payments],
+            ['approved', 'pending', 'rejected', 'approved']
+        )
+        self.assertEqual(get_order.call_count, 4)
+        self.assertIn('4 pagamentos verificados', output)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    @mock.patch('payments.services.PagBankService.get_order')
+    def test_payments_without_an_order_are_not_scanned(self, get_order):
+        Payment.objects.filter(id=self.payments[0].id).update(status='pending_gateway', payment_gateway_id=None)
+        Payment.objects.filter(id=self.payments[1].id).update(status='gateway_failed', payment_gateway_id=None)
+        get_order.return_value = {'success': True, 'order': {'status': 'WAITING'}}
+        output = self.reconcile()
+        self.assertEqual(
+            sorted(call.args[0] for call in get_order.call_args_list), ['ORDE_REC_2', 'ORDE_REC_3']
+        )
+        self.assertIn('2 pagamentos verificados', output)
+
+    @mock.patch('payments.services.PagBankService.get_order')
+    def test_recent_payments_are_skipped(self, get_order):
+        get_order.return_value = {'success': True, 'order': {'status': 'WAITING'}}
+        self.reconcile('--older-than', str(3 * 3600))
+        get_order.assert_not_called()
+
+    @mock.patch('payments.services.PagBankService.get_order')
+    def test_resumes_after_checkpoint(self, get_order):
+        get_order.return_value = {'success': True, 'order': {'status': 'WAITING'}}
+        first = Payment.objects.get(id=self.payments[1].id)
+        FileCheckpoint(self.checkpoint).save((first.created_at, first.id))
+        self.reconcile()
+        self.assertEqual(
+            sorted(call.args[0] for call in get_order.call_args_list), ['ORDE_REC_2', 'ORDE_REC_3']
+        )
+
+    @mock.patch('payments.services.PagBankService.get_order')
+    def test_open_circuit_stops_before_checkpoint(self, get_order):
+        get_order.return_value = {'success': False, 'error': 'aberto', 'circuit_open': True, 'retry_after': 1}
+        call_command(
+            'reconcile_payments', '--checkpoint', self.checkpoint, '--chunk-size', '2',
+            stdout=StringIO(), stderr=StringIO()
+        )
+        self.assertEqual(get_order.call_count, 2)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_rate_limited_query_waits_for_its_turn(self):
+        service = mock.Mock()
+        limited = {'success': False, 'circuit_open': True, 'rate_limited': True, 'retry_after': 2}
+        service.get_order.side_effect = [limited, {'success': True, 'order': {'status': 'PAID'}}]
+        service.process_webhooks.return_value = ['updated']
+        sleeps = []
+        reconciler = Reconciler(service, concurrency=1, sleep=sleeps.append)
+        try:
+            outcomes = reconciler.reconcile_chunk([(self.payments[0].id, None, 'ORDE_REC_0')])
+        finally:
+            reconciler.close()
+        self.assertEqual((sleeps, service.get_order.call_count), ([2], 2))
+        self.assertEqual(outcomes, {'updated': 1})
+
+    @mock.patch.object(rate_limit, '_backend', rate_limit.LocalRateLimitBackend())
+    @override_settings(PAGBANK_RATE_LIMIT_READS=5.0, PAGBANK_RATE_LIMIT_BURST_SECONDS=1.0)
+    def test_queries_use_the_shared_reads_limit(self):
+        with mock.patch('payments.services.get_session') as get_session, \
+                mock.patch.object(rate_limit.RateLimiter, 'acquire') as acquire:
+            get_session.return_value.request.return_value = mock.Mock(
+                status_code=200, headers={}, text='{}', json=lambda: {'status': 'WAITING'}
+            )
+            self.reconcile()
+        self.assertEqual(acquire.call_count, 4)
+        self.assertEqual(get_session.return_value.request.call_count, 4)
+
+
+class RateLimiterTests(TestCase):
+    """Limite de chamadas ao PagBank por família (token bucket + Retry-After)"""
+
+    def setUp(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def limiter(self, rate=10.0, burst=1.0, max_wait=0.5):
+        return rate_limit.RateLimiter(
+            'orders', rate_limit.LocalRateLimitBackend(), rate=rate, burst=burst, max_wait=max_wait,
+            clock=lambda: self.now, sleep=self.sleeps.append
+        )
+
+    def test_calls_over_the_rate_wait_their_turn(self):
+        limiter = self.limiter()
+        for _ in range(3):
+            limiter.acquire()
+        self.assertEqual([round(wait, 3) for wait in self.sleeps], [0.1, 0.2])
+
+    def test_call_beyond_max_wait_is_rejected(self):
+        limiter = self.limiter(max_wait=0.15)
+        limiter.acquire()
+        limiter.acquire()
+        with self.assertRaises(rate_limit.RateLimitExceeded):
+            limiter.acquire()
+
+    def test_retry_after_blocks_the_family(self):
+        limiter = self.limiter(rate=0.0, max_wait=2.0)
+        limiter.observe(mock.Mock(status_code=429, headers={'Retry-After': '1.5'}))
+        limiter.acquire()
+        self.assertEqual(self.sleeps, [1.5])
+        limiter.observe(mock.Mock(status_code=429, headers={'Retry-After': '5'}))
+        with self.assertRaises(rate_limit.RateLimitExceeded) as raised:
+            limiter.acquire()
+        self.assertEqual(raised.exception.retry_after, 5)
+
+    def test_parse_retry_after_http_date(self):
+        self.assertEqual(rate_limit.parse_retry_after('Thu, 01 Jan 1970 00:00:30 GMT', now=10), 20)
+        self.assertIsNone(rate_limit.parse_retry_after('amanhã'))
+
+    def test_cache_backend_shares_windows(self):
+        backend = rate_limit.CacheRateLimitBackend()
+        cache.clear()
+        # janelas de 0.2s com 2 chamadas: a terceira fica para a próxima janela
+        results = [backend.reserve('reads', 10.0, 2.0, 0.5, 1000.05) for _ in range(3)]
+        self.assertEqual([granted for granted, _ in results], [True, True, True])
+        self.assertEqual([round(wait, 3) for _, wait in results], [0.0, 0.0, 0.15])
+
+    @mock.patch.object(rate_limit, '_backend', rate_limit.LocalRateLimitBackend())
+    def test_gateway_429_becomes_unavailable_result(self):
+        response = mock.Mock(status_code=429, headers={'Retry-After': '30'}, text='')
+        with mock.patch('payments.services.get_session') as get_session:
+            get_session.return_value.request.return_value = response
+            result = PagBankService().get_order('ORDE_429')
+        self.assertTrue(result['circuit_open'] and result['rate_limited'])
+        self.assertEqual(result['retry_after'], 30)
+        self.assertEqual(get_session.return_value.request.call_count, 1)
+
+    def test_rejection_is_not_a_circuit_open_error(self):
+        error = rate_limit.RateLimitExceeded('reads', 3)
+        self.assertNotIsInstance(error, circuit_breaker.CircuitOpenError)
+        self.assertEqual((error.family, error.retry_after), ('reads', 3))
+        self.assertIn('(reads)', str(error))
+
+
+class InboundThrottleTests(TestCase):
+    """Limites de requisições recebidas e descarte de carga por prioridade"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_sliding_window_weights_previous_window(self):
+        throttle = throttling.WindowThrottle()
+        limits = [('writes:global', 4, 10, 'throttled_global')]
+        for _ in range(4):
+            self.assertIsNone(throttle.hit(limits, now=995.0))
+        self.assertEqual(throttle.hit(limits, now=999.0), ('throttled_global', 1))
+        # Metade da janela anterior ainda conta: 4 * 0.5 + 2 novas = limite
+        self.assertIsNone(throttle.hit(limits, now=1005.0))
+        self.assertIsNone(throttle.hit(limits, now=1005.0))
+        self.assertEqual(throttle.hit(limits, now=1005.0), ('throttled_global', 3))
+
+    def test_rejected_request_counts_in_no_limit(self):
+        throttle = throttling.WindowThrottle()
+        limits = [('reads:client:a', 5, 60, 'throttled_client'), ('reads:global', 1, 60, 'throttled_global')]
+        self.assertIsNone(throttle.hit(limits, now=0.0))
+        self.assertEqual(throttle.hit(limits, now=1.0), ('throttled_global', 59))
+        self.assertEqual(cache.get('pagbank:throttle:reads:client:a:60:0'), 1)
+
+    @override_settings(PAGBANK_THROTTLE_CLIENT_WRITES='1/min', PAGBANK_THROTTLE_GLOBAL_WRITES='')
+    def test_client_over_limit_gets_429(self):
+        url = '/api/payments/transparent/'
+        self.assertEqual(self.client.post(url, {}, content_type='application/json').status_code, 400)
+        response = self.client.post(url, {}, content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], str(response.json()['retry_after']))
+        # Outro cliente tem o próprio limite
+        other = self.client.post(url, {}, content_type='application/json', REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(other.status_code, 400)
+
+    @override_settings(PAGBANK_THROTTLE_CLIENT_WRITES='5/min', PAGBANK_THROTTLE_GLOBAL_WRITES='')
+    def test_bulk_counts_each_payment_as_a_write(self):
+        url = '/api/payments/bulk/'
+        batch = {'payments': [{}] * 3}
+        self.assertEqual(self.client.post(url, batch, content_type='application/json').status_code, 400)
+        response = self.client.post(url, batch, content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], str(response.json()['retry_after']))
+        # ainda cabem 2 escritas de peso 1
+        transparent = '/api/payments/transparent/'
+        self.assertEqual(self.client.post(transparent, {}, content_type='application/json').status_code, 400)
+        self.assertEqual(self.client.post(transparent, {}, content_type='application/json').status_code, 400)
+        self.assertEqual(self.client.post(transparent, {}, content_type='application/json').status_code, 429)
+
+    @override_settings(PAGBANK_THROTTLE_CLIENT_WRITES='5/min', PAGBANK_THROTTLE_GLOBAL_WRITES='')
+    def test_async_bulk_larger_than_the_limit_fits_an_empty_window(self):
+        view = async_views.AsyncPaymentBulkCreateView.as_view()
+
+        def post():
+            request = AsyncRequestFactory().post(
+                '/api/payments/bulk/', {'payments': [{}] * 8}, content_type='application/json'
+            )
+            return asyncio.run(view(request)).status_code
+
+        self.assertEqual([post(), post()], [400, 429])
+
+    @override_settings(PAGBANK_THROTTLE_CLIENT_READS='', PAGBANK_THROTTLE_GLOBAL_READS='2/min')
+    def test_global_limit_is_shared_by_clients(self):
+        statuses = [
+            self.client.get(f'/api/payments/{uuid.uuid4()}/status/', REMOTE_ADDR=f'10.0.0.{i}').status_code
+            for i in range(3)
+        ]
+        self.assertEqual(statuses, [404, 404, 429])
+
+    @override_settings(PAGBANK_THROTTLE_CLIENT_READS='1/min', PAGBANK_THROTTLE_GLOBAL_READS='')
+    def test_async_views_share_the_counters(self):
+        throttling.WindowThrottle().hit([('reads:client:127.0.0.1', 1, 60, 'throttled_client')])
+        request = AsyncRequestFactory().get(f'/api/payments/{uuid.uuid4()}/status/')
+        response = asyncio.run(async_views.payment_status(request, payment_id=uuid.uuid4()))
+        self.assertEqual(response.status_code, 429)
+
+    def test_gate_reserves_slots_for_critical_routes(self):
+        factory = RequestFactory()
+        gate = load_shedding.AdmissionGate(limit=2, reserved=1)
+        self.assertTrue(gate.enter(factory.get('/api/payments/')))
+        self.assertFalse(gate.enter(factory.get('/api/payments/')))
+        self.assertTrue(gate.enter(factory.post('/api/payments/webhook/')))
+        self.assertFalse(gate.enter(factory.get('/api/')))
+        gate.leave()
+        self.assertTrue(gate.enter(factory.get('/api/')))
+        self.assertEqual(gate.stats.snapshot(), {'admitted': 1, 'admitted_reserved': 2, 'shed': 2})
+
+    @override_settings(PAGBANK_SHED_MAX_CONCURRENCY=1, PAGBANK_SHED_RESERVED=1)
+    def test_saturated_worker_sheds_payment_endpoints(self):
+        response = self.client.get('/api/payments/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(self.client.get('/api/').status_code, 200)
+        webhook = self.client.post('/api/payments/webhook/', 'notificationCode=ABC',
+                                   content_type='application/x-www-form-urlencoded')
+        self.assertEqual(webhook.status_code, 200)
+
+
+class StructuredLoggingTests(TestCase):
+    """Logs JSON com payload preguiçoso, amostragem, máscara e escrita em fila"""
+
+    def record(self, payload, level=logging.INFO):
+        record = logging.LogRecord('payments.services', level, __file__, 1, 'Dados da ordem', (), None)
+        record.payload = payload
+        return record
+
+    def test_card_and_tax_id_fields_are_redacted(self):
+        payload = structured_logging.Payload({
+            'customer': {'name': 'Cliente', 'tax_id': '12345678909'},
+            'payment_method': {'card': {'number': '4111111111111111', 'exp_month': 12, 'security_code': '123',
+                                        'holder': {'name': 'Cliente'}}},
+            'description': 'cartão 4111111111111111, pedido 1718900000000',
+        })
+        value = payload.value()
+        self.assertEqual(value['customer'], {'name': 'Cliente', 'tax_id': '[REDACTED]'})
+        card = value['payment_method']['card']
+        self.assertEqual(card['number'], '[REDACTED]')
+        self.assertEqual(card['security_code'], '[REDACTED]')
+        self.assertEqual(card['holder'], {'name': 'Cliente'})
+        self.assertEqual(value['description'], 'cartão [REDACTED], pedido 1718900000000')
+
+    def test_payload_is_not_read_when_level_is_disabled(self):
+        response = mock.Mock(status_code=201)
+        type(response).text = mock.PropertyMock(side_effect=AssertionError('texto lido'))
+        logger = logging.getLogger('payments.tests.disabled')
+        logger.setLevel(logging.WARNING)
+        logger.info("Resposta", extra={'payload': structured_logging.Payload(response)})
+
+    def test_sampling_keeps_order_and_response_together(self):
+        sample = structured_logging.PayloadSampleFilter(rate=0.5)
+        keys = [str(uuid.uuid4()) for _ in range(200)]
+        kept = [key for key in keys if sample.filter(self.record(structured_logging.Payload({}, key)))]
+        self.assertTrue(0 < len(kept) < len(keys))
+        self.assertEqual(kept, [key for key in kept if sample.filter(self.record(structured_logging.Payload([], key)))])
+        self.assertTrue(sample.filter(self.record(structured_logging.Payload({}, keys[0]), logging.ERROR)))
+
+    def test_queue_handler_writes_json_lines_off_thread(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'pagbank.log')
+            handler = structured_logging.QueueFileHandler(path)
+            handler.setFormatter(structured_logging.JsonFormatter())
+            handler.handle(self.record(structured_logging.Payload('{"customer": {"tax_id": "1"}}')))
+            handler.close()
+            with open(path, encoding='utf-8') as log_file:
+                line = json.loads(log_file.read())
+        self.assertEqual(line['message'], 'Dados da ordem')
+        self.assertEqual(line['payload'], {'customer': {'tax_id': '[REDACTED]'}})
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        handler = structured_logging.QueueFileHandler(os.devnull, queue_size=1)
+        handler._ensure_listener = lambda: None
+        before = structured_logging.stats.snapshot()['dropped']
+        handler.handle(self.record(None))
+        handler.handle(self.record(None))
+        self.assertEqual(structured_logging.stats.snapshot()['dropped'], before + 1)
+        handler.close()
+
+
+class MetricsTests(TestCase):
+    """Registro de métricas por thread, exposição Prometheus e agregação entre processos"""
+
+    def sample(self, name, *labels):
+        return metrics.registry.samples().get((name, labels), 0)
+
+    def test_histogram_renders_cumulative_buckets(self):
+        registry = metrics.Registry()
+        histogram = metrics.Histogram('t_seconds', 'Teste', ('op',), buckets=(0.1, 1.0), registry=registry)
+        counter = metrics.Counter('t_total', 'Teste', ('path',), registry=registry)
+        for value in (0.05, 0.5, 5.0):
+            histogram.observe(value, 'get')
+        counter.inc('a"b')
+        text = metrics.render(registry.samples(), registry)
+        self.assertIn('t_seconds_bucket{op="get",le="0.1"} 1\n', text)
+        self.assertIn('t_seconds_bucket{op="get",le="1.0"} 2\n', text)
+        self.assertIn('t_seconds_bucket{op="get",le="+Inf"} 3\n', text)
+        self.assertIn('t_seconds_sum{op="get"} 5.55\n', text)
+        self.assertIn('t_seconds_count{op="get"} 3\n', text)
+        self.assertIn('t_total{path="a\\"b"} 1\n', text)
+
+    def test_threads_write_to_their_own_shards(self):
+        registry = metrics.Registry()
+        counter = metrics.Counter('t_total', 'Teste', registry=registry)
+
+        def work():
+            for _ in range(1000):
+                counter.inc()
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.inc()
+        self.assertEqual(registry.samples()[('t_total', ())], 8001)
+
+    def test_snapshots_of_other_processes_are_summed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            workers = []
+            for observed in (0.2, 3.0):
+                registry = metrics.Registry()
+                histogram = metrics.Histogram('t_seconds', 'Teste', buckets=(1.0,), registry=registry)
+                histogram.observe(observed)
+                workers.append(metrics.FileExporter(directory, registry=registry))
+            workers[1].path = workers[1].path.with_name('outro-processo.json')
+            workers[1].flush()
+            self.assertEqual(workers[0].collect()[('t_seconds', ())], [1, 1, 3.2])
+
+    def test_gateway_calls_are_counted_by_operation_and_status(self):
+        before = self.sample('pagbank_responses_total', 'get_order', '200')
+        timeouts = self.sample('pagbank_timeouts_total', 'get_order')
+        with mock.patch('payments.services.get_session') as get_session:
+            get_session.return_value.request.return_value = mock.Mock(status_code=200, json=lambda: {'status': 'PAID'})
+            PagBankService().get_order('ORDE_METRICS')
+            get_session.return_value.request.side_effect = requests.ReadTimeout()
+            PagBankService().get_order('ORDE_METRICS')
+        self.assertEqual(self.sample('pagbank_responses_total', 'get_order', '200'), before + 1)
+        self.assertGreater(self.sample('pagbank_timeouts_total', 'get_order'), timeouts)
+
+    def test_views_record_requests_and_queries(self):
+        create_payments(2)
+        queries = self.sample('http_db_queries_total', 'payment-list-create')
+        self.client.get('/api/payments/')
+        self.assertGreater(self.sample('http_db_queries_total', 'payment-list-create'), queries)
+
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        self.assertIn('http_requests_total{view="payment-list-create",method="GET",status="200"}',
+                      response.content.decode())
+
+    def test_webhook_lag_is_observed_when_applied(self):
+        from .webhook_queue import get_webhook_queue, process_batch
+
+        payment = create_payments(1, status='pending')[0]
+        before = self.sample('pagbank_webhook_lag_seconds') or [0]
+        get_webhook_queue().enqueue(json.dumps({'id': 'ORDE_LAG', 'reference_id': str(payment.id), 'status': 'PAID'}),
+                                    'application/json')
+        self.assertEqual(process_batch(get_webhook_queue(), PagBankService(), 10, 3), (1, 0))
+        lag = self.sample('pagbank_webhook_lag_seconds')
+        self.assertEqual(sum(lag[:-1]) - sum(before[:-1]), 1)
+
+    def test_process_counters_are_exposed(self):
+        registry = metrics.Registry()
+        registry.add_counters('http_throttle', throttling.ThrottleStats())
+        with self.assertRaises(TypeError):
+            registry.add_counters('outro', {'allowed': 1})
+        self.assertEqual(registry.samples()[('http_throttle_allowed_total', ())], 0)
+
+        self.assertTrue(all(isinstance(counters, Counters) for _, counters in metrics.registry.collectors))
+        text = metrics.render()
+        for name, counters in metrics.registry.collectors:
+            for field in counters.FIELDS:
+                self.assertIn(f"\n{name}_{field}_total ", text)
+
+    @override_settings(PAGBANK_METRICS_TOKEN='segredo')
+    def test_token_protects_endpoint(self):
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 401)
+        response = self.client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer segredo')
+        self.assertEqual(response.status_code, 200)
+
+
+class TracingTests(TestCase):
+    """Spans aninhados por requisição, propagação do trace id e exportação"""
+
+    payload = PaymentGatewayLifecycleTests.payload
+    traceparent = '00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01'
+
+    def post(self, **headers):
+        with mock.patch('payments.services.get_session') as get_session, \
+                mock.patch('payments.tracing.get_processor') as get_processor:
+            get_session.return_value.request.return_value = mock.Mock(
+                status_code=201, text='{}', json=lambda: {'id': 'ORDE_TRACE', 'links': []}
+            )
+            response = self.client.post('/api/payments/', self.payload, content_type='application/json', **headers)
+        submitted = get_processor.return_value.submit.call_args
+        return response, submitted[0][0] if submitted else None, get_session.return_value.request.call_args
+
+    @override_settings(PAGBANK_TRACE_TRUST_INBOUND_SAMPLED=True)
+    def test_sampled_request_records_nested_spans(self):
+        response, spans, gateway_call = self.post(HTTP_TRACEPARENT=self.traceparent)
+        trace_id = self.traceparent.split('-')[1]
+        self.assertEqual(response['X-Trace-Id'], trace_id)
+
+        by_name = {}
+        for span_ in spans:
+            by_name.setdefault(span_.name, span_)
+        root = by_name['HTTP POST payment-list-create']
+        self.assertEqual(root.parent_id, 'b7ad6b7169203331')
+        self.assertEqual(root.attributes['http.status_code'], response.status_code)
+        for name in ('serializer.CreatePaymentSerializer.is_valid', 'Payment.objects.create_with_items',
+                     'PagBankService.create_order', 'pagbank.http', 'db.query'):
+            self.assertIn(name, by_name)
+        self.assertEqual(by_name['pagbank.http'].parent_id, by_name['PagBankService.create_order'].span_id)
+        self.assertTrue(all(span_.end_ns >= span_.start_ns for span_ in spans))
+
+        # O PagBank recebe o traceparent do span da chamada HTTP
+        sent = gateway_call.kwargs['headers'][tracing.TRACEPARENT_HEADER]
+        self.assertEqual(sent, f"00-{trace_id}-{by_name['pagbank.http'].span_id}-01")
+
+    @override_settings(PAGBANK_TRACE_SAMPLE_RATE=0.0)
+    def test_unsampled_request_propagates_trace_id_without_spans(self):
+        response, spans, gateway_call = self.post()
+        self.assertIsNone(spans)
+        trace_id = response['X-Trace-Id']
+        self.assertEqual(len(trace_id), 32)
+        self.assertTrue(gateway_call.kwargs['headers'][tracing.TRACEPARENT_HEADER].startswith(f'00-{trace_id}-'))
+        self.assertTrue(gateway_call.kwargs['headers'][tracing.TRACEPARENT_HEADER].endswith('-00'))
+
+    @override_settings(PAGBANK_TRACE_SAMPLE_RATE=0.0)
+    def test_inbound_sampled_flag_does_not_override_local_rate(self):
+        response, spans, gateway_call = self.post(HTTP_TRACEPARENT=self.traceparent)
+        self.assertIsNone(spans)
+        # O trace id do cliente continua, sem a amostragem forçada
+        trace_id = self.traceparent.split('-')[1]
+        self.assertEqual(response['X-Trace-Id'], trace_id)
+        self.assertTrue(gateway_call.kwargs['headers'][tracing.TRACEPARENT_HEADER].endswith('-00'))
+
+    def test_inbound_trace_is_sampled_at_the_local_rate(self):
+        with tracing.start_trace('raiz', self.traceparent, sample_rate=1.0) as root:
+            self.assertEqual((root.trace_id, root.parent_id, root.trace.sampled), (
+                self.traceparent.split('-')[1], 'b7ad6b7169203331', True
+            ))
+        unsampled = self.traceparent[:-2] + '00'
+        with override_settings(PAGBANK_TRACE_TRUST_INBOUND_SAMPLED=True):
+            with tracing.start_trace('raiz', unsampled, sample_rate=1.0) as root:
+                self.assertFalse(root.trace.sampled)
+
+    def test_log_records_carry_trace_id(self):
+        record = logging.LogRecord('payments', logging.INFO, __file__, 1, 'mensagem', None, None)
+        with tracing.start_trace('teste', sample_rate=0.0) as root:
+            tracing.TraceContextFilter().filter(record)
+            self.assertIs(tracing.span('filho'), tracing.NOOP_SPAN)
+        self.assertEqual(record.trace_id, root.trace_id)
+        self.assertIn(root.trace_id, structured_logging.JsonFormatter().format(record))
+
+    def test_processor_exports_to_file_and_otlp(self):
+        with tracing.start_trace('raiz', sample_rate=1.0) as root:
+            with tracing.span('filho', valor=1):
+                pass
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'traces.jsonl')
+            processor = tracing.BatchSpanProcessor(tracing.FileSpanExporter(path))
+            processor.queue.put(root.trace.spans)
+            processor.flush()
+            with open(path) as trace_file:
+                lines = [json.loads(line) for line in trace_file]
+        self.assertEqual([line['name'] for line in lines], ['filho', 'raiz'])
+        self.assertEqual(lines[0]['parent_id'], root.span_id)
+
+        spans = tracing.otlp_payload(root.trace.spans, 'teste')['resourceSpans'][0]['scopeSpans'][0]['spans']
+        self.assertEqual(spans[0]['attributes'], [{'key': 'valor', 'value': {'intValue': '1'}}])
+        self.assertEqual(spans[1]['kind'], 2)
+
+
+@override_settings(PAGBANK_PROFILING_ENABLED=True, PAGBANK_PROFILE_SAMPLE_RATE=1.0, PAGBANK_PROFILE_SLOW_MS=0)
+class ProfilingTests(TestCase):
+    """Perfis de requisições amostradas/lentas no buffer circular e endpoint só para staff"""
+
+    def setUp(self):
+        cache.clear()
+        from django.contrib.auth.models import User
+        self.staff = User.objects.create_user('admin', password='x', is_staff=True)
+
+    def post_payment(self, gateway_latency=0.0):
+        response = mock.Mock(status_code=201, text='{}', json=lambda: {'id': f'ORDE_{uuid.uuid4().hex}', 'links': []})
+
+        def request(*args, **kwargs):
+            time.sleep(gateway_latency)
+            return response
+
+        with mock.patch('payments.services.get_session') as get_session:
+            get_session.return_value.request.side_effect = request
+            return self.client.post('/api/payments/', PaymentGatewayLifecycleTests.payload,
+                                    content_type='application/json')
+
+    @override_settings(PAGBANK_PROFILE_TOP_FUNCTIONS=200)
+    def test_sampled_request_stores_profile_queries_and_gateway_calls(self):
+        self.post_payment()
+        self.client.get('/api/')  # fora de PATH_PREFIX: não é amostrada
+
+        self.client.force_login(self.staff)
+        results = self.client.get('/api/profiles/').json()['results']
+        self.assertEqual([entry['route'] for entry in results], ['payment-list-create'])
+        self.assertNotIn('profile', results[0])
+
+        entry = self.client.get(f"/api/profiles/{results[0]['id']}/").json()
+        self.assertEqual(entry['reason'], 'sampled')
+        self.assertEqual(entry['query_count'], len(entry['queries']))
+        self.assertTrue(any(query['sql'].startswith('INSERT') for query in entry['queries']))
+        self.assertEqual([call['operation'] for call in entry['gateway_calls']], ['create_order'])
+        self.assertTrue(any('create_order' in row['function'] for row in entry['profile']['cumulative']))
+
+    @override_settings(PAGBANK_PROFILE_SAMPLE_RATE=0.0, PAGBANK_PROFILE_SLOW_MS=20)
+    def test_slow_request_is_stored_without_cpu_profile(self):
+        self.post_payment()
+        self.assertEqual(profiling.get_buffer().entries(), [])
+        self.post_payment(gateway_latency=0.03)
+        [entry] = profiling.get_buffer().entries()
+        self.assertEqual((entry['reason'], entry['profile']), ('slow', None))
+        self.assertGreaterEqual(entry['gateway_calls'][0]['ms'], 30)
+
+    def test_sampled_request_waits_for_no_other_profiler(self):
+        busy = profiling.stats.snapshot()['busy']
+        # outra requisição do processo está sob o cProfile
+        with profiling._profiler_lock:
+            response = self.post_payment()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(profiling.get_buffer().entries(), [])
+        self.assertEqual(profiling.stats.snapshot()['busy'], busy + 1)
+
+    def test_profiler_errors_do_not_fail_the_request(self):
+        with mock.patch('payments.profiling.cProfile.Profile') as profile:
+            profile.return_value.enable.side_effect = ValueError('Another profiling tool is already active')
+            self.assertEqual(self.post_payment().status_code, 201)
+        self.assertFalse(profiling._profiler_lock.locked())
+
+        with mock.patch('payments.profiling.top_functions', side_effect=RuntimeError('falhou')):
+            self.assertEqual(self.post_payment().status_code, 201)
+        self.assertFalse(profiling._profiler_lock.locked())
+        self.assertEqual(profiling.get_buffer().entries(), [])
+
+    @override_settings(PAGBANK_PROFILE_SLOW_MS=10)
+    async def test_async_slow_request_is_stored_off_the_event_loop(self):
+        async def view(request):
+            await asyncio.sleep(0.02)
+            return HttpResponse('ok')
+
+        middleware = profiling.ProfilingMiddleware(view)
+        store, threads = middleware.store, []
+
+        def store_in_thread(*args):
+            threads.append(threading.get_ident())
+            return store(*args)
+
+        with mock.patch.object(middleware, 'store', store_in_thread):
+            response = await middleware(AsyncRequestFactory().get('/api/payments/'))
+        self.assertEqual(response.status_code, 200)
+        # a API síncrona do cache roda fora da thread do event loop
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], threading.get_ident())
+        [entry] = await sync_to_async(profiling.get_buffer().entries)()
+        self.assertEqual((entry['reason'], entry['profile']), ('slow', None))
+
+    def test_buffer_keeps_only_the_latest_entries(self):
+        buffer = profiling.ProfileBuffer(size=3)
+        ids = [buffer.append({'path': f'/{i}'}) for i in range(5)]
+        self.assertEqual([entry['path'] for entry in buffer.entries()], ['/4', '/3', '/2'])
+        self.assertIsNone(buffer.get(ids[0]))
+        self.assertEqual(buffer.get(ids[4])['path'], '/4')
+
+    def test_endpoint_requires_staff(self):
+        self.assertEqual(self.client.get('/api/profiles/').status_code, 403)
+        with override_settings(PAGBANK_PROFILING_ENABLED=False):
+            self.client.force_login(self.staff)
+            self.assertEqual(self.client.get('/api/profiles/').status_code, 404)
+
+
+class RetryPolicyTests(TestCase):
+    """Classificação de falhas, backoff com full jitter e orçamento de retries"""
+
+    def policy(self, tokens=10.0, **kwargs):
+        budget = RetryBudget(ratio=0.5, min_per_second=0.0, initial_tokens=tokens)
+        return RetryPolicy(budget=budget, stats=RetryStats(), sleep=lambda delay: None, **kwargs)
+
+    def test_only_transient_failures_are_retryable(self):
+        for status_code in (408, 429, 500, 502, 503, 504):
+            self.assertTrue(is_retryable_status(status_code))
+        for status_code in (200, 400, 401, 404, 422):
+            self.assertFalse(is_retryable_status(status_code))
+        self.assertTrue(is_retryable_exception(requests.exceptions.ConnectTimeout()))
+        self.assertTrue(is_retryable_exception(requests.exceptions.ReadTimeout()))
+        self.assertFalse(is_retryable_exception(ValueError()))
+
+    def test_backoff_is_full_jitter_capped_by_max_delay(self):
+        policy = self.policy(base_delay=0.1, max_delay=0.5)
+        with mock.patch('payments.retry.random.uniform', side_effect=lambda low, high: (low, high)):
+            self.assertEqual([policy.backoff(n) for n in range(4)], [(0, 0.1), (0, 0.2), (0, 0.4), (0, 0.5)])
+
+    def test_transient_errors_are_retried_until_success(self):
+        policy = self.policy(max_retries=3)
+        send = mock.Mock(side_effect=[
+            requests.exceptions.ConnectTimeout(), mock.Mock(status_code=503), mock.Mock(status_code=201),
+        ])
+        self.assertEqual(policy.call(send).status_code, 201)
+        self.assertEqual(policy.stats.snapshot(), {
+            'calls': 1, 'attempts': 3, 'retries': 2, 'budget_exhausted': 0, 'gave_up': 0,
+        })
+
+    def test_validation_errors_are_not_retried(self):
+        policy = self.policy()
+        send = mock.Mock(return_value=mock.Mock(status_code=400))
+        self.assertEqual(policy.call(send).status_code, 400)
+        send.assert_called_once()
+        with self.assertRaises(ValueError):
+            policy.call(mock.Mock(side_effect=ValueError('corpo inválido')))
+
+    def test_last_response_is_returned_when_retries_run_out(self):
+        policy = self.policy(max_retries=2)
+        send = mock.Mock(return_value=mock.Mock(status_code=502))
+        self.assertEqual(policy.call(send).status_code, 502)
+        self.assertEqual(send.call_count, 3)
+        self.assertEqual(policy.stats.snapshot()['gave_up'], 1)
+
+    def test_budget_starts_with_a_small_reserve_and_earns_from_successes(self):
+        policy = self.policy(tokens=1.0, max_retries=5)
+        failing = mock.Mock(return_value=mock.Mock(status_code=503))
+        policy.call(failing)
+        # a reserva paga um retry; falhas não rendem tokens
+        self.assertEqual(failing.call_count, 2)
+        self.assertEqual(policy.stats.snapshot()['budget_exhausted'], 1)
+        self.assertLess(policy.budget.tokens, 1)
+
+        for _ in range(2):
+            policy.call(mock.Mock(return_value=mock.Mock(status_code=200)))
+        self.assertAlmostEqual(policy.budget.tokens, 1.0)
+
+    def test_async_call_retries_transient_errors(self):
+        policy = self.policy()
+        responses = iter([requests.exceptions.ReadTimeout(), mock.Mock(status_code=200)])
+
+        async def send():
+            response = next(responses)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        with mock.patch('payments.retry.asyncio.sleep', new=mock.AsyncMock()):
+            response = asyncio.run(policy.call_async(send))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(policy.stats.snapshot()['retries'], 1)
+
+
+class CircuitBreakerTests(TestCase):
+    """closed -> open -> half_open -> closed/open, com backend local e no cache"""
+
+    def setUp(self):
+        cache.clear()
+        self.now = 1000.0
+
+    def breakers(self):
+        for backend in (circuit_breaker.LocalBreakerBackend(), circuit_breaker.CacheBreakerBackend()):
+            with self.subTest(backend=type(backend).__name__):
+                yield circuit_breaker.CircuitBreaker(
+                    'orders', backend, minimum_calls=4, window_seconds=10, open_seconds=15,
+                    clock=lambda: self.now,
+                )
+
+    def call(self, breaker, status_code):
+        response = mock.Mock(status_code=status_code)
+        return breaker.call(lambda: response, lambda result: result.status_code >= 500)
+
+    def open(self, breaker):
+        for status_code in (200, 500, 500, 500):
+            self.call(breaker, status_code)
+        self.assertEqual(breaker.state, circuit_breaker.OPEN)
+
+    def test_failure_rate_opens_only_after_minimum_calls(self):
+        for breaker in self.breakers():
+            for _ in range(3):
+                self.call(breaker, 500)
+            self.assertEqual(breaker.state, circuit_breaker.CLOSED)
+            self.call(breaker, 500)
+            self.assertEqual(breaker.state, circuit_breaker.OPEN)
+
+    def test_open_circuit_fails_fast_with_retry_after(self):
+        for breaker in self.breakers():
+            self.open(breaker)
+            self.now += 5
+            func = mock.Mock()
+            with self.assertRaises(circuit_breaker.CircuitOpenError) as raised:
+                breaker.call(func, lambda result: False)
+            func.assert_not_called()
+            self.assertEqual(raised.exception.retry_after, 10)
+
+    def test_single_half_open_probe_closes_on_success(self):
+        for breaker in self.breakers():
+            self.open(breaker)
+            self.now += 15
+            self.assertTrue(breaker.before_call())
+            self.assertEqual(breaker.state, circuit_breaker.HALF_OPEN)
+            # só um probe por vez
+            with self.assertRaises(circuit_breaker.CircuitOpenError):
+                breaker.before_call()
+            breaker.after_call(True, False, 0.1)
+            self.assertEqual(breaker.state, circuit_breaker.CLOSED)
+            # falhas de antes do fechamento não contam na janela
+            self.call(breaker, 500)
+            self.assertEqual(breaker.state, circuit_breaker.CLOSED)
+
+    def test_failed_probe_reopens(self):
+        for breaker in self.breakers():
+            self.open(breaker)
+            self.now += 15
+            self.call(breaker, 503)
+            self.assertEqual(breaker.state, circuit_breaker.OPEN)
+            with self.assertRaises(circuit_breaker.CircuitOpenError):
+                breaker.before_call()
+
+    def test_slow_calls_open_the_circuit(self):
+        for breaker in self.breakers():
+            for _ in range(4):
+                breaker.after_call(False, False, breaker.slow_call_threshold)
+            self.assertEqual(breaker.state, circuit_breaker.OPEN)
+
+
+class AsyncPagBankServiceTests(TestCase):
+    """Cliente aiohttp contra um servidor HTTP local fazendo o papel do PagBank"""
+
+    async def call(self, responses, call):
+        """call(service) com o service apontando para um servidor que devolve `responses` em ordem"""
+        from aiohttp import web
+        from aiohttp.test_utils import TestServer
+
+        self.received = []
+
+        async def handler(request):
+            self.received.append((request.method, request.path, dict(request.headers)))
+            status_code, body = responses.pop(0)
+            return web.json_response(body, status=status_code)
+
+        app = web.Application()
+        app.router.add_route('*', '/{tail:.*}', handler)
+        server = TestServer(app)
+        await server.start_server(access_log=None)
+        service = async_services.AsyncPagBankService()
+        service.api_url = str(server.make_url('')).rstrip('/')
+        service.retry_policy = RetryPolicy(base_delay=0, budget=RetryBudget(initial_tokens=5), stats=RetryStats())
+        try:
+            return await call(service)
+        finally:
+            await async_services.get_async_session().close()
+            await server.close()
+
+    async def test_create_order_retries_transient_error_with_same_idempotency_key(self):
+        result = await self.call(
+            [(503, {}), (201, {'id': 'ORDE_ASYNC', 'links': [{'rel': 'PAY', 'href': 'https://pagbank/pay'}]})],
+            lambda service: service.create_order({
+                'items': [{'title': 'Item', 'quantity': 1, 'unit_price': Decimal('10.00')}],
+                'payer_email': 'teste@example.com',
+                'external_reference': str(uuid.uuid4()),
+                'idempotency_key': 'chave-async',
+            }),
+        )
+        self.assertEqual((result['success'], result['order_id'], result['payment_url']),
+                         (True, 'ORDE_ASYNC', 'https://pagbank/pay'))
+        self.assertEqual([method for method, _, _ in self.received], ['POST', 'POST'])
+        self.assertEqual({headers['x-idempotency-key'] for _, _, headers in self.received}, {'chave-async'})
+
+    async def test_get_order_error_is_returned_not_raised(self):
+        result = await self.call([(404, {'error': 'not found'})], lambda service: service.get_order('ORDE_X'))
+        self.assertFalse(result['success'])
+        self.assertEqual(self.received[0][:2], ('GET', '/orders/ORDE_X'))
+
+
+class AsyncPaymentViewsTests(TestCase):
+    """Views async (PAGBANK_ASYNC_VIEWS) respondem como as síncronas"""
+
+    payload = {
+        'amount': '20.00',
+        'description': 'Async',
+        'payer_email': 'teste@example.com',
+        'items': [{'title': 'Item', 'quantity': 2, 'unit_price': '10.00'}],
+    }
+    checkout_result = {'success': True, 'order_id': 'ORDE_VIEW', 'checkout_url': 'https://pagbank/pay'}
+
+    def setUp(self):
+        cache.clear()
+        self.factory = AsyncRequestFactory()
+
+    async def post_async(self, view, path, data):
+        request = self.factory.post(path, json.dumps(data), content_type='application/json')
+        response = await view(request)
+        return response.status_code, json.loads(response.content)
+
+    @mock.patch('payments.async_views.AsyncPagBankService.create_checkout_session', new_callable=mock.AsyncMock)
+    @mock.patch('payments.views.PagSeguroService.create_checkout_session')
+    async def test_create_matches_sync_view(self, create_sync, create_async):
+        create_sync.return_value = create_async.return_value = {**self.checkout_result, 'order_id': 'ORDE_SYNC'}
+        sync = await sync_to_async(self.client.post)('/api/payments/', self.payload, content_type='application/json')
+        create_sync.return_value = create_async.return_value = self.checkout_result
+        status_code, data = await self.post_async(
+            async_views.AsyncPaymentListCreateView.as_view(), '/api/payments/', self.payload
+        )
+
+        self.assertEqual((status_code, sync.status_code), (201, 201))
+        self.assertEqual(set(data), set(sync.json()))
+        payment = await Payment.objects.aget(id=data['payment_id'])
+        self.assertEqual((payment.status, payment.payment_gateway_id, payment.item_count), ('pending', 'ORDE_VIEW', 1))
+        self.assertEqual(create_async.call_args.args[0]['external_reference'], data['payment_id'])
+
+    @mock.patch('payments.async_views.AsyncPagBankService.create_checkout_session', new_callable=mock.AsyncMock)
+    async def test_open_circuit_records_failure_and_returns_503(self, create_checkout):
+        create_checkout.return_value = {'success': False, 'error': 'aberto', 'circuit_open': True, 'retry_after': 3}
+        view = async_views.AsyncPaymentListCreateView.as_view()
+        request = self.factory.post('/api/payments/', json.dumps(self.payload), content_type='application/json')
+        response = await view(request)
+
+        self.assertEqual((response.status_code, response['Retry-After']), (503, '3'))
+        self.assertEqual(await Payment.objects.values_list('status', flat=True).aget(), 'gateway_failed')
+
+    async def test_invalid_body_is_rejected_without_gateway_call(self):
+        view = async_views.AsyncPaymentListCreateView.as_view()
+        request = self.factory.post('/api/payments/', b'{nao e json', content_type='application/json')
+        self.assertEqual((await view(request)).status_code, 400)
+        status_code, errors = await self.post_async(view, '/api/payments/', {**self.payload, 'items': []})
+        self.assertEqual(status_code, 400)
+        self.assertIn('items', errors)
+        self.assertFalse(await Payment.objects.aexists())
+
+    @mock.patch('payments.async_views.AsyncPagBankService.create_transparent_payment', new_callable=mock.AsyncMock)
+    async def test_transparent_payment_records_charge_status(self, create_transparent):
+        create_transparent.return_value = {'success': True, 'charge_id': 'CHAR_ASYNC', 'status': 'PAID'}
+        status_code, data = await self.post_async(async_views.create_transparent_payment, '/api/payments/transparent/', {
+            'payment': {'amount': '20.00', 'payer_email': 'teste@example.com'},
+            'card': {'encrypted_card': 'x', 'security_code': '123'},
+        })
+
+        self.assertEqual((status_code, data['transaction_code']), (201, 'CHAR_ASYNC'))
+        payment = await Payment.objects.aget(id=data['payment_id'])
+        self.assertEqual((payment.status, payment.payment_gateway_id), ('approved', 'CHAR_ASYNC'))
+        sent = create_transparent.call_args.args[0]
+        self.assertEqual((sent['external_reference'], sent['amount_cents']), (data['payment_id'], 2000))
+
+
+class WebhookQueueTests(TestCase):
+    """Outbox de webhooks: ack imediato, reserva exclusiva e devolução de reservas vencidas"""
+
+    def setUp(self):
+        cache.clear()
+        self.queue = webhook_queue.DatabaseWebhookQueue()
+
+    def enqueue(self, payment, status='PAID'):
+        body = json.dumps({'id': f'ORDE_{uuid.uuid4().hex[:8]}', 'reference_id': str(payment.id), 'status': status})
+        return self.queue.enqueue(body, 'application/json')
+
+    def test_webhook_is_queued_and_acknowledged_without_applying(self):
+        payment = create_payments(1)[0]
+        response = self.client.post('/api/payments/webhook/', {'id': 'ORDE_ACK', 'reference_id': str(payment.id),
+                                                              'status': 'PAID'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(WebhookEvent.objects.get().status, 'pending')
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'pending')
+
+    def test_claim_is_exclusive(self):
+        payment = create_payments(1)[0]
+        for _ in range(3):
+            self.enqueue(payment)
+        first = self.queue.claim(2)
+        second = self.queue.claim(10)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse({event.id for event in first} & {event.id for event in second})
+        self.assertEqual(self.queue.claim(10), [])
+        self.assertEqual(set(WebhookEvent.objects.values_list('status', 'attempts')), {('processing', 1)})
+
+    def test_stale_claims_are_requeued_until_attempts_run_out(self):
+        payment = create_payments(1)[0]
+        retried, exhausted = self.enqueue(payment), self.enqueue(payment)
+        self.queue.claim(10)
+        WebhookEvent.objects.filter(id=exhausted.id).update(attempts=5)
+        WebhookEvent.objects.update(claimed_at=timezone.now() - timedelta(seconds=301))
+        # reserva recente (worker ainda vivo) não é devolvida
+        fresh = self.enqueue(payment)
+        self.queue.claim(10)
+
+        self.assertEqual(self.queue.requeue_stale(visibility_timeout=300, max_attempts=5), 2)
+        statuses = dict(WebhookEvent.objects.values_list('id', 'status'))
+        self.assertEqual(statuses, {retried.id: 'pending', exhausted.id: 'failed', fresh.id: 'processing'})
+
+    def test_batch_failure_returns_events_to_queue(self):
+        payment = create_payments(1)[0]
+        self.enqueue(payment)
+        invalid = self.queue.enqueue('{não é json', 'application/json')
+        service = mock.Mock(process_webhooks=mock.Mock(side_effect=RuntimeError('banco fora')))
+
+        self.assertEqual(webhook_queue.process_batch(self.queue, service, 10, 5), (0, 2))
+        events = {event.id: event for event in WebhookEvent.objects.all()}
+        self.assertEqual(events.pop(invalid.id).status, 'failed')
+        [event] = events.values()
+        self.assertEqual((event.status, event.last_error, event.claim_token), ('pending', 'banco fora', None))
+
+    def test_batch_is_applied_and_marked_done(self):
+        payment = create_payments(1, payment_gateway_id='ORDE_QUEUE')[0]
+        self.queue.enqueue(json.dumps({'id': 'ORDE_QUEUE', 'reference_id': str(payment.id), 'status': 'PAID'}))
+        self.assertEqual(webhook_queue.process_batch(self.queue, PagBankService(), 10, 5), (1, 0))
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'approved')
+        self.assertEqual(WebhookEvent.objects.get().status, 'done')
+        self.assertEqual(self.queue.pending_count(), 0)
+
+
+class WebhookDedupeTests(TestCase):
+    """Reenvios descartados pela chave em WebhookDelivery e regressões de status recusadas"""
+
+    def setUp(self):
+        self.payment = create_payments(1, payment_gateway_id='ORDE_DEDUPE')[0]
+
+    def webhook(self, status='PAID', **fields):
+        return {'id': 'ORDE_DEDUPE', 'reference_id': str(self.payment.id), 'status': status, **fields}
+
+    def test_redelivery_is_skipped(self):
+        service = PagBankService()
+        self.assertEqual(service.process_webhook(self.webhook())['outcome'], 'updated')
+        self.assertEqual(service.process_webhook(self.webhook())['outcome'], 'duplicate')
+        self.assertEqual(WebhookDelivery.objects.count(), 1)
+        # mesmo status em outro momento é outro evento
+        self.assertEqual(service.process_webhook(self.webhook(updated_at='2026-01-02T10:00:00-03:00'))['outcome'],
+                         'unchanged')
+
+    def test_failed_application_does_not_record_the_key(self):
+        service = PagBankService()
+        with mock.patch.object(PagBankService, 'update_local_payment', return_value='error'):
+            service.process_webhook(self.webhook())
+        self.assertFalse(WebhookDelivery.objects.exists())
+        self.assertEqual(service.process_webhook(self.webhook())['outcome'], 'updated')
+
+    def test_backward_status_change_is_rejected(self):
+        service = PagBankService()
+        service.process_webhook(self.webhook('PAID'))
+        # notificação antiga (WAITING) entregue fora de ordem
+        self.assertEqual(service.process_webhook(self.webhook('WAITING'))['outcome'], 'rejected')
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'approved')
+
+    def test_batch_skips_keys_already_applied_and_repeated_in_the_batch(self):
+        service = PagBankService()
+        service.process_webhook(self.webhook('PAID'))
+        other = create_payments(1)[0]
+        outcomes = service.process_webhooks([
+            self.webhook('PAID'),
+            {'id': 'ORDE_OTHER', 'reference_id': str(other.id), 'status': 'DECLINED'},
+            {'id': 'ORDE_OTHER', 'reference_id': str(other.id), 'status': 'DECLINED'},
+            self.webhook('WAITING'),
+        ])
+        self.assertEqual(outcomes, ['duplicate', 'updated', 'duplicate', 'rejected'])
+        self.assertEqual(WebhookDelivery.objects.count(), 3)
+
+    def test_purge_removes_expired_keys(self):
+        PagBankService().process_webhook(self.webhook())
+        WebhookDelivery.objects.update(processed_at=timezone.now() - timedelta(days=2))
+        out = StringIO()
+        call_command('purge_webhook_deliveries', stdout=out)
+        self.assertFalse(WebhookDelivery.objects.exists())
+        self.assertIn('1 chaves', out.getvalue())
+
+
+class ConditionalStatusUpdateTests(TestCase):
+    """transition_status: um UPDATE ... WHERE status IN (predecessores), sem ler a linha"""
+
+    def test_transition_is_a_single_update(self):
+        payment = create_payments(1)[0]
+        with self.assertNumQueries(1):
+            self.assertTrue(Payment.objects.transition_status(payment.id, 'approved', 'ORDE_UPDATE'))
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.payment_gateway_id), ('approved', 'ORDE_UPDATE'))
+
+    def test_update_matching_no_rows_writes_nothing(self):
+        payment = create_payments(1, status='refunded')[0]
+        updated_at = payment.updated_at
+        with self.assertNumQueries(1):
+            self.assertFalse(Payment.objects.transition_status(payment.id, 'approved', 'ORDE_LATE'))
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.payment_gateway_id, payment.updated_at),
+                         ('refunded', None, updated_at))
+        self.assertFalse(Payment.objects.transition_status(uuid.uuid4(), 'approved'))
+
+    def test_second_of_two_racing_deliveries_is_a_no_op(self):
+        payment = create_payments(1)[0]
+        # as duas entregas leram 'pending'; só a primeira casa com o WHERE
+        self.assertTrue(Payment.objects.transition_status(payment.id, 'cancelled'))
+        self.assertFalse(Payment.objects.transition_status(payment.id, 'approved'))
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'cancelled')
+
+    def test_update_local_payment_outcomes(self):
+        payment = create_payments(1)[0]
+        service = PagBankService()
+        self.assertEqual(service.update_local_payment(str(payment.id), 'ORDE_LOCAL', 'WAITING'), 'updated')
+        self.assertEqual(service.update_local_payment(str(payment.id), 'ORDE_LOCAL', 'WAITING'), 'unchanged')
+        self.assertEqual(service.update_local_payment(str(payment.id), 'ORDE_LOCAL', 'PAID'), 'updated')
+        self.assertEqual(service.update_local_payment(str(payment.id), 'ORDE_LOCAL', 'WAITING'), 'rejected')
+        self.assertEqual(service.update_local_payment(str(uuid.uuid4()), 'ORDE_NONE', 'PAID'), 'not_found')
+
+
+class WebhookBatchTests(TestCase):
+    """process_webhooks: uma leitura e um bulk_update por lote, e o comando backfill_webhooks"""
+
+    def notifications(self, payments, status='PAID'):
+        return [
+            {'id': f'ORDE_{payment.id.hex[:12]}', 'reference_id': str(payment.id), 'status': status}
+            for payment in payments
+        ]
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        service = PagBankService()
+        small, large = create_payments(2), create_payments(20)
+        # SAVEPOINT, leitura dos pagamentos, chaves já aplicadas, bulk_update, chaves novas, RELEASE
+        with self.assertNumQueries(6):
+            service.process_webhooks(self.notifications(small))
+        with self.assertNumQueries(6):
+            service.process_webhooks(self.notifications(large))
+        self.assertEqual(Payment.objects.filter(status='approved').count(), 22)
+
+    def test_events_of_a_payment_are_applied_in_order(self):
+        payment = create_payments(1)[0]
+        other = Payment(id=uuid.uuid4())
+        outcomes = PagBankService().process_webhooks([
+            {'id': 'ORDE_ORDER', 'reference_id': str(payment.id), 'status': 'PAID', 'updated_at': '1'},
+            {'id': 'ORDE_ORDER', 'reference_id': str(payment.id), 'status': 'CANCELED', 'updated_at': '2'},
+            {'id': 'ORDE_ORDER', 'reference_id': str(payment.id), 'status': 'WAITING', 'updated_at': '3'},
+            {'id': 'ORDE_MISSING', 'reference_id': str(other.id), 'status': 'PAID'},
+            {'reference_id': str(payment.id), 'status': 'PAID'},
+            'não é um objeto',
+        ])
+        self.assertEqual(outcomes, ['updated', 'updated', 'rejected', 'not_found', 'invalid', 'invalid'])
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.payment_gateway_id), ('cancelled', 'ORDE_ORDER'))
+
+    def test_backfill_command_applies_jsonl_in_batches(self):
+        payments = create_payments(3)
+        lines = [json.dumps(notification) for notification in self.notifications(payments)]
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False, encoding='utf-8') as jsonl:
+            jsonl.write('\n'.join([lines[0], '', '{quebrado', *lines[1:], lines[0]]) + '\n')
+        self.addCleanup(os.unlink, jsonl.name)
+
+        out, err = StringIO(), StringIO()
+        with mock.patch.object(PagBankService, 'process_webhooks', wraps=PagBankService().process_webhooks) as batch:
+            call_command('backfill_webhooks', jsonl.name, '--batch-size', '2', stdout=out, stderr=err)
+        self.assertEqual([len(call.args[0]) for call in batch.call_args_list], [2, 2])
+        self.assertIn('Linha 3: JSON inválido', err.getvalue())
+        self.assertIn('duplicate: 1, invalid: 1, updated: 3', out.getvalue())
+        self.assertEqual(Payment.objects.filter(status='approved').count(), 3)
+
+
+class PaymentCursorPaginationTests(TestCase):
+    """GET /api/payments/: cursor estável, filtros e projeção de campos"""
+
+    def setUp(self):
+        cache.clear()
+        self.payments = create_payments(5, items_per_payment=1)
+        start = timezone.now() - timedelta(days=5)
+        for offset, payment in enumerate(self.payments):
+            Payment.objects.filter(id=payment.id).update(created_at=start + timedelta(days=offset))
+
+    def get(self, url='/api/payments/', params=None):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def ids(self, page):
+        return [row['id'] for row in page['results']]
+
+    def test_new_payments_do_not_shift_the_next_page(self):
+        first = self.get(params={'page_size': 2})
+        self.assertEqual(self.ids(first), [str(payment.id) for payment in self.payments[:2:-1]])
+        create_payments(1)
+        second = self.get(first['next'])
+        self.assertEqual(self.ids(second), [str(payment.id) for payment in self.payments[2:0:-1]])
+        third = self.get(second['next'])
+        self.assertEqual(self.ids(third), [str(self.payments[0].id)])
+        self.assertIsNone(third['next'])
+
+    def test_filters(self):
+        Payment.objects.filter(id=self.payments[0].id).update(status='approved', payer_email='outro@example.com')
+        Payment.objects.filter(id=self.payments[1].id).update(status='cancelled')
+
+        self.assertEqual(len(self.get(params={'status': 'approved,cancelled'})['results']), 2)
+        self.assertEqual(self.ids(self.get(params={'payer_email': 'outro@example.com'})),
+                         [str(self.payments[0].id)])
+        # created_before com uma data pura inclui o dia inteiro
+        day = timezone.localdate(Payment.objects.get(id=self.payments[1].id).created_at).isoformat()
+        page = self.get(params={'created_after': day, 'created_before': day})
+        self.assertEqual(self.ids(page), [str(self.payments[1].id)])
+
+    def test_invalid_filters_are_rejected(self):
+        self.assertEqual(self.client.get('/api/payments/', {'status': 'pago'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/payments/', {'created_after': 'ontem'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/payments/', {'fields': 'id,senha'}).status_code, 400)
+
+    def test_fields_projection(self):
+        with self.assertNumQueries(1):
+            page = self.get(params={'fields': 'id,status,amount', 'page_size': 3})
+        self.assertEqual([set(row) for row in page['results']], [{'id', 'status', 'amount'}] * 3)
+        self.assertEqual(len(self.get(params={'fields': 'id,items'})['results'][0]['items']), 1)
@@ -0,0 +1,202 @@
+"""Limite de requisições recebidas nos endpoints de pagamento.
+
+Todas as views rodam com AllowAny: sem limite, um cliente com bug (ou um
+loop de polling) ocupa os workers sozinho. Cada requisição passa por dois
+limites da família ('reads' ou 'writes'): um por cliente (IP, honrando
+NUM_PROXIES do DRF) e um global. Acima de qualquer um, a resposta é 429
+com Retry-After.
+
+Os contadores são janelas deslizantes aproximadas no cache do Django: a
+contagem da janela atual mais a da anterior, ponderada pelo quanto dela
+ainda cai no período. Cada requisição faz um get_many com as janelas de
+todos os limites e um add + incr por limite, independente do volume, e com
+Redis/Memcached o limite vale para todos os processos. Requisições recusadas não contam, então um
+cliente que respeita o Retry-After volta a ser atendido. Uma requisição pode
+pesar mais que uma (`cost`, ex.: o número de pagamentos de um POST bulk);
+o peso é limitado ao próprio limite, para um lote grande ainda caber numa
+janela vazia.
+"""
+import asyncio
+import logging
+import math
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.throttling import BaseThrottle
+
+from .counters import Counters
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# (limite por cliente, limite global) de cada família, no formato do DRF ('60/min')
+FAMILY_SETTINGS = {
+    'reads': ('PAGBANK_THROTTLE_CLIENT_READS', 'PAGBANK_THROTTLE_GLOBAL_READS'),
+    'writes': ('PAGBANK_THROTTLE_CLIENT_WRITES', 'PAGBANK_THROTTLE_GLOBAL_WRITES'),
+}
+
+
+class ThrottleStats(Counters):
+    """Contadores do processo para requisições liberadas e recusadas por limite"""
+
+    FIELDS = ('allowed', 'throttled_client', 'throttled_global')
+
+
+def parse_rate(rate):
+    """'60/min' -> (60, 60); vazio ou '0/...' -> None (sem limite)"""
+    if not rate:
+        return None
+    num, period = str(rate).split('/')
+    if int(num) <= 0:
+        return None
+    return int(num), PERIODS[period.strip()[0]]
+
+
+def window_estimate(previous, current, elapsed, period):
+    """Contagem na janela deslizante que termina agora"""
+    return previous * (1 - elapsed / period) + current
+
+
+def retry_after(limit, previous, current, elapsed, period, cost=1):
+    """Segundos até a janela deslizante ter espaço para uma requisição de peso `cost`"""
+    if current + cost > limit or not previous:
+        # Só abre na próxima janela, quando a atual passa a ser a anterior
+        return period - elapsed
+    # O peso da anterior cai até previous * (1 - t / period) <= limit - current - cost
+    return max(0.0, period * (1 - (limit - current - cost) / previous) - elapsed)
+
+
+class WindowThrottle:
+    """Janelas deslizantes aproximadas no cache do Django"""
+
+    def __init__(self, alias='default', prefix='pagbank:throttle'):
+        self.cache = caches[alias]
+        self.prefix = prefix
+
+    def _windows(self, limits, now):
+        """(limite, período, contador, chave anterior, chave atual, segundos na
+        janela atual) de cada limite"""
+        windows = []
+        for key, limit, period, counter in limits:
+            index = int(now // period)
+            base = f"{self.prefix}:{key}:{period}"
+            windows.append((limit, period, counter, f"{base}:{index - 1}", f"{base}:{index}", now - index * period))
+        return windows
+
+    def _check(self, windows, counts, cost):
+        """(contador, Retry-After) do primeiro limite estourado, ou None"""
+        for limit, period, counter, previous_key, current_key, elapsed in windows:
+            previous, current = counts.get(previous_key, 0), counts.get(current_key, 0)
+            weight = min(cost, limit)
+            if window_estimate(previous, current, elapsed, period) + weight > limit:
+                return counter, max(1, math.ceil(retry_after(limit, previous, current, elapsed, period, weight)))
+        return None
+
+    def hit(self, limits, now=None, cost=1):
+        """Conta a requisição (com peso `cost`) em todos os limites se couber em
+        todos; senão retorna (contador, Retry-After em segundos) do limite estourado"""
+        windows = self._windows(limits, time.time() if now is None else now)
+        keys = [key for window in windows for key in window[3:5]]
+        rejected = self._check(windows, self.cache.get_many(keys), cost)
+        if rejected:
+            return rejected
+        for limit, period, counter, previous_key, current_key, elapsed in windows:
+            weight = min(cost, limit)
+            self.cache.add(current_key, 0, period * 2 + 1)
+            try:
+                self.cache.incr(current_key, weight)
+            except ValueError:
+                # janela expirou entre o add e o incr
+                self.cache.set(current_key, weight, period * 2 + 1)
+        return None
+
+    async def ahit(self, limits, now=None, cost=1):
+        """Versão async de hit() (API async do cache)"""
+        windows = self._windows(limits, time.time() if now is None else now)
+        keys = [key for window in windows for key in window[3:5]]
+        rejected = self._check(windows, await self.cache.aget_many(keys), cost)
+        if rejected:
+            return rejected
+        for limit, period, counter, previous_key, current_key, elapsed in windows:
+            weight = min(cost, limit)
+            await self.cache.aadd(current_key, 0, period * 2 + 1)
+            try:
+                await self.cache.aincr(current_key, weight)
+            except ValueError:
+                await self.cache.aset(current_key, weight, period * 2 + 1)
+        return None
+
+
+stats = ThrottleStats()
+_ident = BaseThrottle()
+
+
+def get_throttle():
+    return WindowThrottle(getattr(settings, 'PAGBANK_THROTTLE_CACHE_ALIAS', 'default'))
+
+
+def family_limits(family, request):
+    """[(chave, limite, período, contador)] dos limites ativos da família"""
+    if not getattr(settings, 'PAGBANK_THROTTLE_ENABLED', True):
+        return []
+    client_setting, global_setting = FAMILY_SETTINGS[family]
+    limits = []
+    client_rate = parse_rate(getattr(settings, client_setting, None))
+    if client_rate:
+        limits.append((f"{family}:client:{_ident.get_ident(request)}", *client_rate, 'throttled_client'))
+    global_rate = parse_rate(getattr(settings, global_setting, None))
+    if global_rate:
+        limits.append((f"{family}:global", *global_rate, 'throttled_global'))
+    return limits
+
+
+def throttled_response(family, counter, wait):
+    stats.increment(counter)
+    logger.warning(f"Limite de requisições ({family}) atingido; Retry-After {wait}s")
+    return HttpResponse(
+        JSONRenderer().render({'error': 'Muitas requisições, tente novamente mais tarde', 'retry_after': wait}),
+        status=status.HTTP_429_TOO_MANY_REQUESTS,
+        content_type='application/json',
+        headers={'Retry-After': str(wait)},
+    )
+
+
+def throttle(family, cost=None):
+    """Decorator de views (funções ou métodos, sync ou async) que aplica os
+    limites da família. A requisição é o último argumento posicional;
+    `cost(request)`, se informado, dá o peso da requisição nos limites."""
+    def weight(request):
+        return max(1, cost(request)) if cost is not None else 1
+
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(*args, **kwargs):
+                limits = family_limits(family, args[-1])
+                if limits:
+                    rejected = await get_throttle().ahit(limits, cost=weight(args[-1]))
+                    if rejected:
+                        return throttled_response(family, *rejected)
+                    stats.increment('allowed')
+                return await view(*args, **kwargs)
+
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            limits = family_limits(family, args[-1])
+            if limits:
+                rejected = get_throttle().hit(limits, cost=weight(args[-1]))
+                if rejected:
+                    return throttled_response(family, *rejected)
+                stats.increment('allowed')
+            return view(*args, **kwargs)
+
+        return wrapper
+    return decorator
@@ -0,0 +1,434 @@
+"""Tracing por requisição: spans aninhados de view, serializer, banco e PagBank.
+
+TracingMiddleware abre o span raiz de cada requisição (continuando um
+`traceparent` W3C recebido, se houver). Dentro dele, `span()` e o decorator
+`traced()` abrem spans filhos; o span atual fica em uma ContextVar, então
+funciona igual em views síncronas, async e dentro de sync_to_async.
+
+O trace id existe em toda requisição: vai no header `traceparent` das
+chamadas ao PagBank, no header X-Trace-Id da resposta e, via
+TraceContextFilter, em cada linha de log. Já os spans só são guardados
+para a fração PAGBANK_TRACE_SAMPLE_RATE das requisições: fora da amostra,
+`span()` devolve um span vazio compartilhado, sem relógio nem alocação.
+
+Traces amostrados vão, ao terminar, para uma fila; uma thread os exporta
+pelo exporter de PAGBANK_TRACE_EXPORTER: 'file' (um span JSON por linha),
+'otlp' (OTLP/HTTP JSON, ex.: um OpenTelemetry Collector em
+:4318/v1/traces) ou caminho pontuado.
+"""
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+
+import requests
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .counters import Counters
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_HEADER = 'traceparent'
+TRACE_ID_HEADER = 'X-Trace-Id'
+MAX_STATEMENT_LENGTH = 500
+
+_current_span = ContextVar('pagbank_current_span', default=None)
+
+
+class TraceStats(Counters):
+    """Contadores do processo para traces iniciados, amostrados, exportados e descartados"""
+
+    FIELDS = ('started', 'sampled', 'exported_spans', 'dropped', 'export_errors')
+
+
+stats = TraceStats()
+
+
+class Trace:
+    __slots__ = ('trace_id', 'sampled', 'spans')
+
+    def __init__(self, trace_id, sampled):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans = []
+
+
+class Span:
+    """Span com início/fim em ns desde a época; use como context manager"""
+
+    __slots__ = ('trace', 'name', 'span_id', 'parent_id', 'attributes', 'start_ns', 'end_ns', 'error', '_token')
+
+    def __init__(self, trace, name, parent_id=None, attributes=None):
+        self.trace = trace
+        self.name = name
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.attributes = attributes or {}
+        self.start_ns = self.end_ns = None
+        self.error = None
+
+    @property
+    def trace_id(self):
+        return self.trace.trace_id
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def traceparent(self):
+        return f"00-{self.trace.trace_id}-{self.span_id}-{'01' if self.trace.sampled else '00'}"
+
+    def __enter__(self):
+        self.start_ns = time.time_ns()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.time_ns()
+        _current_span.reset(self._token)
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        if self.trace.sampled:
+            self.trace.spans.append(self)
+        return False
+
+
+class NoopSpan:
+    """Span fora da amostra: não mede nem guarda nada"""
+
+    __slots__ = ()
+
+    def set_attribute(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+
+
+def parse_traceparent(value):
+    """(trace_id, amostrado) de um header traceparent W3C válido, ou None"""
+    parts = (value or '').strip().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    if parts[1] == '0' * 32:
+        return None
+    return parts[1], parts[2], sampled
+
+
+def start_trace(name, traceparent=None, sample_rate=None, attributes=None):
+    """Span raiz de um trace novo, ou continuação do `traceparent` recebido.
+
+    O trace id recebido é mantido, mas a amostragem segue a taxa local: o
+    flag sampled do cliente só vale com PAGBANK_TRACE_TRUST_INBOUND_SAMPLED
+    (senão qualquer cliente forçaria 100% de amostragem).
+    """
+    rate = getattr(settings, 'PAGBANK_TRACE_SAMPLE_RATE', 0.0) if sample_rate is None else sample_rate
+    parent = parse_traceparent(traceparent)
+    if parent is not None:
+        trace_id, parent_id, sampled = parent
+        if not getattr(settings, 'PAGBANK_TRACE_TRUST_INBOUND_SAMPLED', False):
+            sampled = random.random() < rate
+    else:
+        trace_id, parent_id, sampled = f"{random.getrandbits(128):032x}", None, random.random() < rate
+    stats.increment('started')
+    if sampled:
+        stats.increment('sampled')
+    return Span(Trace(trace_id, sampled), name, parent_id, attributes)
+
+
+def current_span():
+    return _current_span.get()
+
+
+def span(name, **attributes):
+    """Span filho do span atual (ou NOOP_SPAN fora de um trace amostrado)"""
+    parent = _current_span.get()
+    if parent is None or not parent.trace.sampled:
+        return NOOP_SPAN
+    return Span(parent.trace, name, parent.span_id, attributes)
+
+
+def traced(name=None):
+    """Decorator: executa a função (sync ou async) dentro de um span"""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+    return decorator
+
+
+def trace_headers(headers):
+    """`headers` com o traceparent do span atual (uma cópia; o original não muda)"""
+    current = _current_span.get()
+    if current is None:
+        return headers
+    return {**headers, TRACEPARENT_HEADER: current.traceparent()}
+
+
+class TracedValidationMixin:
+    """Mixin de serializers do DRF: is_valid() vira um span"""
+
+    def is_valid(self, *, raise_exception=False):
+        with span(f"serializer.{type(self).__name__}.is_valid"):
+            return super().is_valid(raise_exception=raise_exception)
+
+
+def query_tracer(execute, sql, params, many, context):
+    """execute_wrapper de todas as conexões: um span por query nos traces amostrados"""
+    current = _current_span.get()
+    if current is None or not current.trace.sampled:
+        return execute(sql, params, many, context)
+    with Span(current.trace, 'db.query', current.span_id, {
+        'db.system': context['connection'].vendor,
+        'db.statement': sql[:MAX_STATEMENT_LENGTH],
+    }):
+        return execute(sql, params, many, context)
+
+
+def install_query_tracer(sender, connection, **kwargs):
+    """Receiver de connection_created (ligado em PaymentsConfig.ready)"""
+    if query_tracer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_tracer)
+
+
+class TraceContextFilter(logging.Filter):
+    """Põe trace_id e span_id do span atual nos registros de log"""
+
+    def filter(self, record):
+        current = _current_span.get()
+        if current is not None:
+            record.trace_id = current.trace.trace_id
+            record.span_id = current.span_id
+        return True
+
+
+def span_to_dict(span_):
+    return {
+        'trace_id': span_.trace.trace_id,
+        'span_id': span_.span_id,
+        'parent_id': span_.parent_id,
+        'name': span_.name,
+        'start_ns': span_.start_ns,
+        'duration_ms': round((span_.end_ns - span_.start_ns) / 1e6, 3),
+        'attributes': span_.attributes,
+        'error': span_.error,
+    }
+
+
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def otlp_payload(spans, service_name):
+    """Corpo OTLP/HTTP JSON (ExportTraceServiceRequest) com os spans"""
+    return {'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': service_name}}]},
+        'scopeSpans': [{
+            'scope': {'name': 'payments'},
+            'spans': [{
+                'traceId': span_.trace.trace_id,
+                'spanId': span_.span_id,
+                'parentSpanId': span_.parent_id or '',
+                'name': span_.name,
+                # 2 = SERVER no span raiz, 1 = INTERNAL nos demais
+                'kind': 2 if span_.parent_id is None else 1,
+                'startTimeUnixNano': str(span_.start_ns),
+                'endTimeUnixNano': str(span_.end_ns),
+                'attributes': [{'key': key, 'value': otlp_value(value)} for key, value in span_.attributes.items()],
+                'status': {'code': 2, 'message': span_.error} if span_.error else {'code': 1},
+            } for span_ in spans],
+        }],
+    }]}
+
+
+class FileSpanExporter:
+    """Um span JSON por linha em PAGBANK_TRACE_FILE"""
+
+    def __init__(self, path=None):
+        self.path = path or getattr(settings, 'PAGBANK_TRACE_FILE', 'traces.jsonl')
+
+    def export(self, spans):
+        with open(self.path, 'a', encoding='utf-8') as trace_file:
+            trace_file.write(''.join(json.dumps(span_to_dict(s), default=str) + '\n' for s in spans))
+
+
+class OtlpHttpExporter:
+    """POST OTLP/HTTP JSON para PAGBANK_TRACE_OTLP_ENDPOINT"""
+
+    def __init__(self, endpoint=None, timeout=5.0):
+        self.endpoint = endpoint or getattr(settings, 'PAGBANK_TRACE_OTLP_ENDPOINT', 'http://127.0.0.1:4318/v1/traces')
+        self.service_name = getattr(settings, 'PAGBANK_TRACE_SERVICE_NAME', 'pagbank-api')
+        self.timeout = timeout
+        # Session própria: o pool do PagBank (http_client) fica só para o gateway
+        self.session = requests.Session()
+
+    def export(self, spans):
+        response = self.session.post(self.endpoint, json=otlp_payload(spans, self.service_name), timeout=self.timeout)
+        response.raise_for_status()
+
+
+EXPORTERS = {
+    'file': FileSpanExporter,
+    'otlp': OtlpHttpExporter,
+}
+
+
+class BatchSpanProcessor:
+    """Fila de traces terminados exportados em lotes por uma thread.
+
+    Com a fila cheia o trace é descartado (e contado), sem segurar a
+    requisição. A thread é iniciada no primeiro trace de cada processo.
+    """
+
+    def __init__(self, exporter, max_queue_size=2048, batch_size=512, interval=1.0):
+        self.exporter = exporter
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_worker(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                threading.Thread(target=self._run, name='trace-exporter', daemon=True).start()
+                self._pid = os.getpid()
+
+    def submit(self, spans):
+        self._ensure_worker()
+        try:
+            self.queue.put_nowait(spans)
+        except queue.Full:
+            stats.increment('dropped')
+
+    def _drain(self, first=None):
+        batch = list(first or [])
+        while len(batch) < self.batch_size:
+            try:
+                batch.extend(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if not batch:
+            return
+        try:
+            self.exporter.export(batch)
+        except Exception as e:
+            stats.increment('export_errors')
+            logger.warning(f"Falha ao exportar {len(batch)} spans: {str(e)}")
+        else:
+            for _ in batch:
+                stats.increment('exported_spans')
+
+    def _run(self):
+        while True:
+            try:
+                first = self.queue.get(timeout=self.interval)
+            except queue.Empty:
+                continue
+            self._drain(first)
+
+    def flush(self):
+        """Exporta o que está na fila na thread atual (testes, benchmarks)"""
+        while not self.queue.empty():
+            self._drain()
+
+
+_processor = None
+_processor_lock = threading.Lock()
+
+
+def get_processor():
+    """BatchSpanProcessor com o exporter de PAGBANK_TRACE_EXPORTER"""
+    global _processor
+    if _processor is None:
+        with _processor_lock:
+            if _processor is None:
+                name = getattr(settings, 'PAGBANK_TRACE_EXPORTER', 'file')
+                exporter_class = EXPORTERS.get(name) or import_string(name)
+                _processor = BatchSpanProcessor(exporter_class())
+    return _processor
+
+
+class TracingMiddleware:
+    """Span raiz de cada requisição; desligado com PAGBANK_TRACING_ENABLED=False"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'PAGBANK_TRACING_ENABLED', True)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def start(self, request):
+        return start_trace(f"HTTP {request.method}", request.headers.get(TRACEPARENT_HEADER), attributes={
+            'http.method': request.method,
+            'http.target': request.path,
+        })
+
+    def finish(self, request, root, response):
+        response[TRACE_ID_HEADER] = root.trace.trace_id
+        if root.trace.sampled:
+            match = getattr(request, 'resolver_match', None)
+            if match is not None:
+                root.name = f"HTTP {request.method} {match.url_name or match.view_name}"
+                root.set_attribute('http.route', match.route)
+            root.set_attribute('http.status_code', response.status_code)
+            get_processor().submit(root.trace.spans)
+        return response
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        with self.start(request) as root:
+            response = self.get_response(request)
+        return self.finish(request, root, response)
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        with self.start(request) as root:
+            response = await self.get_response(request)
+        return self.finish(request, root, response)
@@ -1,7 +1,10 @@
+from django.conf import settings
 from django.urls import path
+from . import async_views
 from .views import (
     # Views principais
     PaymentListCreateView,
+    PaymentBulkCreateView,
     PaymentDetailView,
     PagSeguroWebhookView,
     payment_status,
@@ -11,6 +14,9 @@ from .views import (
     health_check,
     pagbank_health_check,
     api_documentation,
+    prometheus_metrics,
+    profile_list,
+    profile_detail,
     
     # Testes de configuração
     test_config,
@@ -20,6 +26,18 @@ from .views import (
     test_mercadopago,
 )
 
+if getattr(settings, 'PAGBANK_ASYNC_VIEWS', False):
+    # Deploy ASGI: mesmas rotas atendidas pelas views async
+    payment_list_create_view = async_views.AsyncPaymentListCreateView.as_view()
+    payment_bulk_create_view = async_views.AsyncPaymentBulkCreateView.as_view()
+    payment_status_view = async_views.payment_status
+    transparent_payment_view = async_views.create_transparent_payment
+else:
+    payment_list_create_view = PaymentListCreateView.as_view()
+    payment_bulk_create_view = PaymentBulkCreateView.as_view()
+    payment_status_view = payment_status
+    transparent_payment_view = create_transparent_payment
+
 urlpatterns = [
     # ===============================
     # ENDPOINTS PRINCIPAIS
@@ -31,11 +49,22 @@ urlpatterns = [
     # Documentação da API
     path('docs/', api_documentation, name='api-docs'),
     
+    # Métricas (formato texto do Prometheus)
+    path('metrics/', prometheus_metrics, name='metrics'),
+    
+    # Perfis de requisições lentas/amostradas (só staff)
+    path('profiles/', profile_list, name='profile-list'),
+    path('profiles/<int:profile_id>/', profile_detail, name='profile-detail'),
+    
     # Operações de pagamento
-    path('payments/', PaymentListCreateView.as_view(), name='payment-list-create'),
+    path('payments/', payment_list_create_view, name='payment-list-create'),
+    path('payments/bulk/', payment_bulk_create_view, name='payment-bulk-create'),
     path('payments/<uuid:payment_id>/', PaymentDetailView.as_view(), name='payment-detail'),
-    path('payments/<uuid:payment_id>/status/', payment_status, name='payment-status'),
-    path('payments/transparent/', create_transparent_payment, name='transparent-payment'),
+    path('payments/<uuid:payment_id>/status/', payment_status_view, name='payment-status'),
+    path('payments/transparent/', transparent_payment_view, name='transparent-payment'),
+    # Long-poll e SSE de status (só no handler ASGI; sob WSGI respondem 501)
+    path('payments/<uuid:payment_id>/status/wait/', async_views.payment_status_wait, name='payment-status-wait'),
+    path('payments/<uuid:payment_id>/events/', async_views.payment_events, name='payment-events'),
     
     # Webhook
     path('payments/webhook/', PagSeguroWebhookView.as_view(), name='pagbank-webhook'),
@@ -71,9 +100,15 @@ urlpatterns = [
 MAIN_ENDPOINTS = [
     'health-check',
     'api-docs', 
+    'metrics',
+    'profile-list',
+    'profile-detail',
     'payment-list-create',
+    'payment-bulk-create',
     'payment-detail',
     'payment-status',
+    'payment-status-wait',
+    'payment-events',
     'transparent-payment',
     'pagbank-webhook'
 ]
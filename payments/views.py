@@ -1,84 +1,98 @@
 from rest_framework import status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse
+from django.views.decorators.http import require_GET
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
+import hmac
 import json
 import logging
 import requests
 import time
 from django.conf import settings
 
-from .models import Payment, PaymentItem
-from .serializers import PaymentSerializer, CreatePaymentSerializer
-from .services import PagSeguroService
+from .models import Payment
+from .serializers import PaymentSerializer
+from .services import PagSeguroService, CIRCUIT_ENDPOINTS
+from .circuit_breaker import get_breaker
+from .db import release_connection
+from .idempotency import idempotent
+from .throttling import throttle
+from .webhook_queue import get_webhook_queue
+from .pagination import PaymentCursorPagination, payment_list_queryset
+from .bulk import bulk_size, create_checkouts
+from . import checkout, metrics, profiling, retry, status_cache, status_events
 
 logger = logging.getLogger(__name__)
 
+def api_response(result):
+    """Response do DRF para uma resposta (dados, status, headers) de payments.checkout"""
+    data, status_code, headers = result
+    return Response(data, status=status_code, headers=headers)
+
 class PaymentListCreateView(APIView):
+    @throttle('reads')
     def get(self, request):
-        """Lista todos os pagamentos"""
-        payments = Payment.objects.all()
-        serializer = PaymentSerializer(payments, many=True)
-        return Response(serializer.data)
+        """Lista pagamentos paginados por cursor.
+        
+        Query params: status (um ou vários separados por vírgula),
+        payer_email, created_after, created_before, fields, page_size e cursor.
+        """
+        payments, fields = payment_list_queryset(request.query_params, PaymentSerializer.Meta.fields)
+        paginator = PaymentCursorPagination()
+        page = paginator.paginate_queryset(payments, request, view=self)
+        serializer = PaymentSerializer(page, many=True, fields=fields)
+        return paginator.get_paginated_response(serializer.data)
     
+    @throttle('writes')
+    @idempotent('payments.create')
     def post(self, request):
-        """Cria um novo pagamento"""
-        serializer = CreatePaymentSerializer(data=request.data)
+        """Cria um novo pagamento (aceita o header Idempotency-Key)"""
+        validated_data, error = checkout.validate_payment(request.data)
+        if error:
+            return api_response(error)
         
-        if serializer.is_valid():
-            # Criar pagamento no banco local
-            payment = Payment.objects.create(
-                amount=serializer.validated_data['amount'],
-                description=serializer.validated_data['description'],
-                payer_email=serializer.validated_data['payer_email']
-            )
-            
-            # Criar itens do pagamento
-            for item_data in serializer.validated_data['items']:
-                PaymentItem.objects.create(
-                    payment=payment,
-                    **item_data
-                )
-            
-            # Criar checkout no PagSeguro/PagBank
-            ps_service = PagSeguroService()
-            
-            checkout_data = {
-                'items': serializer.validated_data['items'],
-                'payer_email': serializer.validated_data['payer_email'],
-                'payer_name': 'Cliente',  # Pode ser passado no request se necessário
-                'external_reference': str(payment.id)
-            }
-            
-            ps_result = ps_service.create_checkout_session(checkout_data)
-            
-            if ps_result['success']:
-                payment.preference_id = ps_result.get('checkout_code', '')
-                payment.save()
-                
-                return Response({
-                    'payment_id': payment.id,
-                    'checkout_code': ps_result.get('checkout_code'),
-                    'checkout_url': ps_result.get('checkout_url'),
-                    'payment_url': ps_result.get('payment_url')
-                }, status=status.HTTP_201_CREATED)
-            else:
-                payment.delete()  # Remove pagamento se falhou na criação do checkout
-                return Response({
-                    'error': 'Erro ao criar checkout PagBank',
-                    'details': ps_result.get('error')
-                }, status=status.HTTP_400_BAD_REQUEST)
+        payment = checkout.create_pending_payment(validated_data, request)
         
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        # Criar checkout no PagSeguro/PagBank, fora de transação e sem segurar conexão
+        release_connection()
+        ps_result = PagSeguroService().create_checkout_session(
+            checkout.checkout_request(payment, validated_data)
+        )
+        
+        new_status, fields = checkout.checkout_gateway_result(ps_result)
+        Payment.objects.record_gateway_result(payment.id, new_status, **fields)
+        return api_response(checkout.checkout_response(payment, ps_result))
+
+class PaymentBulkCreateView(APIView):
+    # Cada pagamento do lote conta como uma escrita nos limites
+    @throttle('writes', cost=lambda request: bulk_size(request.body))
+    @idempotent('payments.bulk_create')
+    def post(self, request):
+        """Cria vários pagamentos de uma vez: {"payments": [<payload de POST /api/payments/>, ...]}
+        (aceita o header Idempotency-Key)
+        
+        Pagamentos e itens são inseridos com bulk_create em uma transação e as
+        ordens no PagBank são criadas em paralelo. Retorna um resultado por
+        pagamento, na ordem enviada.
+        """
+        validated_data, error = checkout.validate_bulk(request.data)
+        if error:
+            return api_response(error)
+        
+        payments = checkout.create_pending_payments(validated_data)
+        release_connection()
+        results = create_checkouts(PagSeguroService(), payments, validated_data)
+        return api_response(checkout.bulk_response(payments, results))
 
 class PaymentDetailView(APIView):
     def get(self, request, payment_id):
         """Busca detalhes de um pagamento específico"""
         try:
-            payment = Payment.objects.get(id=payment_id)
+            payment = Payment.objects.with_items().get(id=payment_id)
             serializer = PaymentSerializer(payment)
             return Response(serializer.data)
         except Payment.DoesNotExist:
@@ -87,124 +101,79 @@ class PaymentDetailView(APIView):
 @method_decorator(csrf_exempt, name='dispatch')
 class PagSeguroWebhookView(APIView):
     def post(self, request):
-        """Processa notificações do webhook do PagSeguro/PagBank"""
+        """Enfileira a notificação do PagSeguro/PagBank e responde imediatamente.
+
+        O processamento (lookup e atualização do Payment) fica com o comando
+        `manage.py process_webhooks`, então rajadas de notificações não
+        seguram os workers nem geram reenvios do gateway.
+        """
         try:
-            # PagSeguro envia notificationCode via POST
-            notification_code = request.data.get('notificationCode') or request.POST.get('notificationCode')
-            notification_type = request.data.get('notificationType') or request.POST.get('notificationType')
-            
-            logger.info(f"Webhook recebido - Tipo: {notification_type}, Código: {notification_code}")
-            
-            if notification_code and notification_type == 'transaction':
-                ps_service = PagSeguroService()
-                result = ps_service.process_notification(notification_code)
-                
-                if result['success']:
-                    return HttpResponse(status=200)
-                else:
-                    logger.error(f"Erro ao processar notificação: {result.get('error')}")
-                    return HttpResponse(status=400)
-            else:
-                logger.warning("Notificação inválida ou tipo não suportado")
+            body = request.body.decode('utf-8', errors='replace')
+            if not body.strip():
+                logger.warning("Notificação vazia recebida")
                 return HttpResponse(status=400)
-                
+
+            event = get_webhook_queue().enqueue(body, request.content_type or '')
+            logger.info(f"Webhook enfileirado - Evento: {getattr(event, 'id', None)}")
+            return HttpResponse(status=200)
+
         except Exception as e:
-            logger.error(f"Erro no webhook: {str(e)}")
+            # 500 faz o PagBank reenviar a notificação mais tarde
+            logger.error(f"Erro ao enfileirar webhook: {str(e)}")
             return HttpResponse(status=500)
 
-@api_view(['GET'])
-def payment_status(request, payment_id):
-    """Verifica o status atual de um pagamento"""
+def load_payment_status(payment_id):
+    """Pagamento serializado com o status atualizado pelo PagBank, ou None"""
     try:
-        payment = Payment.objects.get(id=payment_id)
-        
-        # Se o pagamento tem código de transação, busca status atualizado
-        if payment.mercadopago_id:  # Reutilizando campo para armazenar transaction_code
-            ps_service = PagSeguroService()
-            ps_result = ps_service.get_transaction(payment.mercadopago_id)
-            
-            if ps_result['success']:
-                # Atualiza status local se necessário
-                transaction_data = ps_result['transaction']
-                new_status = transaction_data['status']
-                
-                # Converter status do PagSeguro/PagBank
-                status_map = {
-                    '1': 'pending',    # Aguardando pagamento
-                    '2': 'pending',    # Em análise
-                    '3': 'approved',   # Paga
-                    '4': 'approved',   # Disponível
-                    '5': 'pending',    # Em disputa
-                    '6': 'refunded',   # Devolvida
-                    '7': 'cancelled',  # Cancelada
-                    # Status PagBank v4
-                    'PAID': 'approved',
-                    'DECLINED': 'rejected',
-                    'CANCELED': 'cancelled',
-                    'AUTHORIZED': 'pending',
-                    'IN_ANALYSIS': 'pending',
-                    'WAITING': 'pending'
-                }
-                
-                mapped_status = status_map.get(new_status, 'pending')
-                if payment.status != mapped_status:
-                    payment.status = mapped_status
-                    payment.save()
-        
-        serializer = PaymentSerializer(payment)
-        return Response(serializer.data)
-        
+        payment = Payment.objects.with_items().get(id=payment_id)
     except Payment.DoesNotExist:
-        return Response({'error': 'Payment not found'}, status=status.HTTP_404_NOT_FOUND)
+        return None
+    
+    # Se o pagamento tem código de transação, busca status atualizado
+    if payment.mercadopago_id:  # Reutilizando campo para armazenar transaction_code
+        mapped_status = checkout.order_status(PagSeguroService().get_order(payment.mercadopago_id))
+        # Atualiza status local se necessário
+        if mapped_status and Payment.objects.transition_status(payment.id, mapped_status):
+            payment.refresh_from_db(fields=['status', 'updated_at'])
+            status_events.publish(payment.id, mapped_status)
+    
+    return PaymentSerializer(payment).data
+
+@api_view(['GET'])
+@throttle('reads')
+def payment_status(request, payment_id):
+    """Verifica o status atual de um pagamento.
+    
+    Servido pelo cache de status (ver status_cache): polls repetidos não
+    consultam banco nem PagBank enquanto a entrada vale.
+    """
+    return api_response(checkout.status_response(status_cache.get_status(payment_id, load_payment_status)))
 
 @api_view(['POST'])
+@throttle('writes')
+@idempotent('payments.transparent')
 def create_transparent_payment(request):
-    """Cria um pagamento transparente com cartão de crédito"""
+    """Cria um pagamento transparente com cartão de crédito (aceita o header Idempotency-Key)"""
     try:
-        payment_data = request.data.get('payment', {})
-        card_data = request.data.get('card', {})
+        payment_data, card_data, error = checkout.validate_transparent(request.data)
+        if error:
+            return api_response(error)
         
-        if not payment_data or not card_data:
-            return Response({
-                'error': 'Dados de pagamento e cartão são obrigatórios'
-            }, status=status.HTTP_400_BAD_REQUEST)
+        payment = checkout.create_transparent_pending_payment(payment_data, request)
         
-        # Criar pagamento no banco local
-        payment = Payment.objects.create(
-            amount=payment_data['amount'],
-            description=payment_data.get('description', 'Pagamento transparente'),
-            payer_email=payment_data['payer_email']
+        # Criar pagamento transparente, fora de transação e sem segurar conexão
+        release_connection()
+        result = PagSeguroService().create_transparent_payment(
+            checkout.transparent_request(payment, payment_data), card_data
         )
         
-        # Adicionar referência externa
-        payment_data['external_reference'] = str(payment.id)
-        
-        # Criar pagamento transparente
-        ps_service = PagSeguroService()
-        result = ps_service.create_transparent_payment(payment_data, card_data)
-        
-        if result['success']:
-            payment.mercadopago_id = result.get('transaction_code', '')
-            payment.save()
-            
-            return Response({
-                'success': True,
-                'payment_id': payment.id,
-                'transaction_code': result.get('transaction_code'),
-                'status': result.get('status')
-            }, status=status.HTTP_201_CREATED)
-        else:
-            payment.delete()
-            return Response({
-                'success': False,
-                'error': result.get('error')
-            }, status=status.HTTP_400_BAD_REQUEST)
+        new_status, fields = checkout.transparent_gateway_result(result)
+        Payment.objects.record_gateway_result(payment.id, new_status, **fields)
+        return api_response(checkout.transparent_response(payment, result))
             
     except Exception as e:
         logger.error(f"Erro no pagamento transparente: {str(e)}")
-        return Response({
-            'error': str(e)
-        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return api_response(checkout.server_error(e))
 
 @api_view(['GET'])
 def health_check(request):
@@ -216,6 +185,35 @@ def health_check(request):
         'timestamp': int(time.time())
     })
 
+@require_GET
+def prometheus_metrics(request):
+    """Métricas no formato texto do Prometheus (ver payments.metrics)"""
+    if not getattr(settings, 'PAGBANK_METRICS_ENABLED', True):
+        raise Http404
+    token = getattr(settings, 'PAGBANK_METRICS_TOKEN', '')
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=401, headers={'WWW-Authenticate': 'Bearer'})
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profile_list(request):
+    """Perfis guardados pelo ProfilingMiddleware, do mais recente ao mais antigo (só staff)"""
+    if not getattr(settings, 'PAGBANK_PROFILING_ENABLED', False):
+        raise Http404
+    return Response({'results': [profiling.summary(entry) for entry in profiling.get_buffer().entries()]})
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profile_detail(request, profile_id):
+    """Perfil completo: funções do cProfile, queries e chamadas ao PagBank (só staff)"""
+    if not getattr(settings, 'PAGBANK_PROFILING_ENABLED', False):
+        raise Http404
+    entry = profiling.get_buffer().get(profile_id)
+    if entry is None:
+        raise Http404
+    return Response(entry)
+
 @api_view(['GET'])
 def test_config(request):
     """Teste de configuração PagBank"""
@@ -443,6 +441,12 @@ def pagbank_health_check(request):
                 'test_url': test_url,
                 'status': connectivity_status
             },
+            'gateway_retries': retry.stats.snapshot(),
+            'circuit_breakers': {
+                endpoint: get_breaker(endpoint).state
+                for endpoint in CIRCUIT_ENDPOINTS.values() if endpoint
+            },
+            'webhook_queue': {'pending': get_webhook_queue().pending_count()},
             'recommendations': get_health_recommendations(config_check, connectivity_ok),
             'next_actions': [
                 "Execute /test-pagbank-auth/ para validar credenciais",
@@ -508,8 +512,11 @@ def api_documentation(request):
         'endpoints': {
             'payments': {
                 'list_create': 'GET/POST /api/payments/',
+                'bulk_create': 'POST /api/payments/bulk/',
                 'detail': 'GET /api/payments/{id}/',
                 'status': 'GET /api/payments/{id}/status/',
+                'status_wait': 'GET /api/payments/{id}/status/wait/?status=&timeout= (ASGI)',
+                'events': 'GET /api/payments/{id}/events/ (SSE, ASGI)',
                 'transparent': 'POST /api/payments/transparent/'
             },
             'webhooks': {
@@ -523,7 +530,9 @@ def api_documentation(request):
             },
             'utils': {
                 'health_simple': 'GET /api/',
-                'docs': 'GET /api/docs/'
+                'docs': 'GET /api/docs/',
+                'metrics': 'GET /api/metrics/ (Prometheus)',
+                'profiles': 'GET /api/profiles/ (staff, PAGBANK_PROFILING_ENABLED)'
             }
         },
         'flow': {
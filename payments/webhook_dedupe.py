@@ -0,0 +1,80 @@
+"""Deduplicação de reenvios de notificações do PagBank.
+
+Cada notificação aplicada grava a sua chave (id no gateway, status e
+timestamp do evento) em WebhookDelivery, na mesma transação que muda o
+Payment. A unique constraint da tabela vale para todos os workers: um
+reenvio encontra a chave e não é aplicado de novo, e uma aplicação que
+falha desfaz a chave junto, então o reenvio seguinte ainda é aplicado.
+"""
+import hashlib
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import WebhookDelivery
+
+logger = logging.getLogger(__name__)
+
+
+def _event_timestamp(webhook_data):
+    """Momento do evento: updated_at da ordem ou datas da última cobrança"""
+    charges = webhook_data.get('charges') or []
+    charge = charges[-1] if charges and isinstance(charges[-1], dict) else {}
+    return (
+        webhook_data.get('updated_at')
+        or charge.get('paid_at')
+        or charge.get('created_at')
+        or webhook_data.get('created_at')
+        or ''
+    )
+
+
+def event_key(webhook_data):
+    """Chave de deduplicação (sha1 de id no gateway, status e timestamp), ou None se não há id"""
+    gateway_id = webhook_data.get('id')
+    if not gateway_id:
+        return None
+    raw = f"{gateway_id}|{webhook_data.get('status', '')}|{_event_timestamp(webhook_data)}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def claim_delivery(webhook_data):
+    """Grava a chave da notificação; False se ela já foi aplicada.
+
+    Chame dentro da transação que aplica a notificação: se a aplicação
+    falhar, o rollback desfaz a chave e um reenvio não é descartado.
+    """
+    key = event_key(webhook_data)
+    if key is None:
+        return True
+    try:
+        with transaction.atomic():
+            WebhookDelivery.objects.create(key=key)
+    except IntegrityError:
+        return False
+    return True
+
+
+def processed_keys(keys):
+    """Chaves de `keys` já aplicadas, com uma query"""
+    keys = [key for key in keys if key]
+    if not keys:
+        return set()
+    return set(WebhookDelivery.objects.filter(key__in=keys).values_list('key', flat=True))
+
+
+def record_deliveries(keys):
+    """Grava as chaves de um lote aplicado (na transação do lote)"""
+    WebhookDelivery.objects.bulk_create(
+        [WebhookDelivery(key=key) for key in set(keys) if key], ignore_conflicts=True
+    )
+
+
+def purge_expired():
+    """Remove chaves mais antigas que PAGBANK_WEBHOOK_DEDUPE_TTL; retorna quantas foram apagadas"""
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'PAGBANK_WEBHOOK_DEDUPE_TTL', 86400))
+    deleted, _ = WebhookDelivery.objects.filter(processed_at__lt=cutoff).delete()
+    return deleted
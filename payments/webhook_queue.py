@@ -0,0 +1,146 @@
+import json
+import logging
+import threading
+import uuid
+from datetime import timedelta
+from urllib.parse import parse_qsl
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .metrics import observe_webhook_lag
+from .models import WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+
+def parse_webhook_body(body, content_type=''):
+    """Converte o corpo bruto da notificação em dict (JSON v4 ou form legado)"""
+    if 'application/x-www-form-urlencoded' in content_type:
+        return dict(parse_qsl(body))
+    data = json.loads(body)
+    if not isinstance(data, dict):
+        raise ValueError("Corpo do webhook não é um objeto JSON")
+    return data
+
+
+class DatabaseWebhookQueue:
+    """Fila de webhooks na tabela WebhookEvent (outbox), sem broker externo.
+
+    Um lote é reservado com um UPDATE condicional (status='pending') que grava
+    um claim_token único, então vários workers podem drenar a fila ao mesmo
+    tempo sem processar o mesmo evento duas vezes.
+    """
+
+    def enqueue(self, body, content_type=''):
+        return WebhookEvent.objects.create(body=body, content_type=content_type[:100])
+
+    def claim(self, batch_size):
+        ids = list(
+            WebhookEvent.objects.filter(status='pending')
+            .order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return []
+
+        token = uuid.uuid4().hex
+        WebhookEvent.objects.filter(id__in=ids, status='pending').update(
+            status='processing',
+            claim_token=token,
+            claimed_at=timezone.now(),
+            attempts=F('attempts') + 1,
+        )
+        return list(WebhookEvent.objects.filter(claim_token=token, status='processing').order_by('id'))
+
+    def complete(self, done, failed, max_attempts):
+        """Finaliza um lote: done é lista de eventos, failed é lista de (evento, erro, definitivo)"""
+        now = timezone.now()
+        if done:
+            WebhookEvent.objects.filter(id__in=[event.id for event in done]).update(
+                status='done', processed_at=now, claim_token=None
+            )
+
+        for event, error, permanent in failed:
+            event.status = 'failed' if permanent or event.attempts >= max_attempts else 'pending'
+            event.last_error = error
+            event.claim_token = None
+            event.processed_at = now if event.status == 'failed' else None
+        if failed:
+            WebhookEvent.objects.bulk_update(
+                [event for event, _, _ in failed],
+                ['status', 'last_error', 'claim_token', 'processed_at'],
+            )
+
+    def requeue_stale(self, visibility_timeout, max_attempts):
+        """Devolve à fila eventos de workers que morreram no meio do lote"""
+        stale = WebhookEvent.objects.filter(
+            status='processing',
+            claimed_at__lt=timezone.now() - timedelta(seconds=visibility_timeout),
+        )
+        failed = stale.filter(attempts__gte=max_attempts).update(
+            status='failed', claim_token=None, last_error='Tentativas esgotadas', processed_at=timezone.now()
+        )
+        requeued = stale.update(status='pending', claim_token=None)
+        return requeued + failed
+
+    def pending_count(self):
+        return WebhookEvent.objects.filter(status='pending').count()
+
+
+BACKENDS = {
+    'database': DatabaseWebhookQueue,
+}
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_webhook_queue():
+    """Fila de webhooks configurada em PAGBANK_WEBHOOK_QUEUE_BACKEND"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                name = getattr(settings, 'PAGBANK_WEBHOOK_QUEUE_BACKEND', 'database')
+                backend_class = BACKENDS.get(name) or import_string(name)
+                _queue = backend_class()
+    return _queue
+
+
+def process_batch(queue, service, batch_size, max_attempts):
+    """Reserva e aplica um lote de notificações via PagBankService.process_webhooks.
+
+    O lote inteiro é aplicado com uma leitura (id__in) e um bulk_update, em
+    uma transação. Se a transação falhar, os eventos voltam para a fila.
+    Retorna a quantidade de eventos (processados, falhos).
+    """
+    events = queue.claim(batch_size)
+    if not events:
+        return 0, 0
+
+    parsed, failed = [], []
+    for event in events:
+        try:
+            parsed.append((event, parse_webhook_body(event.body, event.content_type)))
+        except ValueError as e:
+            failed.append((event, f"Corpo inválido: {e}", True))
+
+    done = []
+    try:
+        outcomes = service.process_webhooks([data for _, data in parsed])
+    except Exception as e:
+        logger.error(f"Erro ao processar lote de webhooks: {str(e)}")
+        failed.extend((event, str(e), False) for event, _ in parsed)
+    else:
+        for (event, _), outcome in zip(parsed, outcomes):
+            if outcome == 'invalid':
+                failed.append((event, "Dados incompletos no webhook", True))
+            else:
+                done.append(event)
+
+    queue.complete(done, failed, max_attempts)
+    observe_webhook_lag(done, timezone.now())
+    return len(done), len(failed)